@@ -0,0 +1,59 @@
+import os
+import struct
+from cffi import FFI
+
+ffi = FFI()
+ffi.cdef("""
+int inotify_init1(int flags);
+int inotify_add_watch(int fd, const char *pathname, uint32_t mask);
+int inotify_rm_watch(int fd, int wd);
+""")
+libc = ffi.dlopen(None)
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def inotify_init(flags=IN_CLOEXEC):
+  fd = libc.inotify_init1(flags)
+  if fd == -1:
+    raise OSError(ffi.errno, f"{os.strerror(ffi.errno)}: inotify_init1({flags})")
+  return fd
+
+def add_watch(fd, path, mask):
+  wd = libc.inotify_add_watch(fd, path.encode(), mask)
+  if wd == -1:
+    raise OSError(ffi.errno, f"{os.strerror(ffi.errno)}: inotify_add_watch({path}, {mask:#x})")
+  return wd
+
+def rm_watch(fd, wd):
+  if libc.inotify_rm_watch(fd, wd) == -1:
+    raise OSError(ffi.errno, f"{os.strerror(ffi.errno)}: inotify_rm_watch({wd})")
+
+def read_events(fd, size=4096):
+  """Blocks until events are available, returns them as (wd, mask, cookie, name) tuples."""
+  buf = os.read(fd, size)
+  events = []
+  i = 0
+  while i < len(buf):
+    wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(buf, i)
+    i += _EVENT_HEADER.size
+    name = buf[i:i + name_len].rstrip(b"\0").decode()
+    i += name_len
+    events.append((wd, mask, cookie, name))
+  return events
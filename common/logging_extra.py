@@ -18,6 +18,9 @@ def json_handler(obj):
 def json_robust_dumps(obj):
   return json.dumps(obj, default=json_handler)
 
+def json_compact_dumps(obj):
+  return json.dumps(obj, default=json_handler, separators=(',', ':'))
+
 class NiceOrderedDict(OrderedDict):
   def __str__(self):
     return json_robust_dumps(self)
@@ -29,36 +32,43 @@ class SwagFormatter(logging.Formatter):
     self.swaglogger = swaglogger
     self.host = socket.gethostname()
 
-  def format_dict(self, record):
-    record_dict = NiceOrderedDict()
-
+  def format_msg(self, record):
     if isinstance(record.msg, dict):
-      record_dict['msg'] = record.msg
-    else:
-      try:
-        record_dict['msg'] = record.getMessage()
-      except (ValueError, TypeError):
-        record_dict['msg'] = [record.msg]+record.args
+      return record.msg
+    try:
+      return record.getMessage()
+    except (ValueError, TypeError):
+      return [record.msg]+record.args
+
+  def format_fields(self, record):
+    """The fields that are fixed once the record is created"""
+    fields = NiceOrderedDict()
+    fields['level'] = record.levelname
+    fields['levelnum'] = record.levelno
+    fields['name'] = record.name
+    fields['filename'] = record.filename
+    fields['lineno'] = record.lineno
+    fields['pathname'] = record.pathname
+    fields['module'] = record.module
+    fields['funcName'] = record.funcName
+    fields['host'] = self.host
+    fields['process'] = record.process
+    fields['thread'] = record.thread
+    fields['threadName'] = record.threadName
+    fields['created'] = record.created
+    if hasattr(record, 'suppressed'):
+      fields['suppressed'] = record.suppressed
+    return fields
 
+  def format_dict(self, record):
+    record_dict = NiceOrderedDict()
+    record_dict['msg'] = self.format_msg(record)
     record_dict['ctx'] = self.swaglogger.get_ctx()
 
     if record.exc_info:
       record_dict['exc_info'] = self.formatException(record.exc_info)
 
-    record_dict['level'] = record.levelname
-    record_dict['levelnum'] = record.levelno
-    record_dict['name'] = record.name
-    record_dict['filename'] = record.filename
-    record_dict['lineno'] = record.lineno
-    record_dict['pathname'] = record.pathname
-    record_dict['module'] = record.module
-    record_dict['funcName'] = record.funcName
-    record_dict['host'] = self.host
-    record_dict['process'] = record.process
-    record_dict['thread'] = record.thread
-    record_dict['threadName'] = record.threadName
-    record_dict['created'] = record.created
-
+    record_dict.update(self.format_fields(record))
     return record_dict
 
   def format(self, record):
@@ -68,11 +78,41 @@ class SwagErrorFilter(logging.Filter):
   def filter(self, record):
     return record.levelno < logging.ERROR
 
+class SwagRateLimitFilter(logging.Filter):
+  """Samples text records logged over and over from the same line. Every line gets burst
+  records per window seconds, after that only every sample-th goes through. The
+  record after records were dropped has their number in 'suppressed'. Events and
+  errors always go through."""
+  def __init__(self, burst=20, window=1., sample=100):
+    logging.Filter.__init__(self)
+    self.burst = burst
+    self.window = window
+    self.sample = sample
+    self.lines = {}  # (pathname, lineno) -> [start of window, records in window, dropped]
+
+  def filter(self, record):
+    if isinstance(record.msg, dict) or record.levelno >= logging.ERROR:
+      return True
+
+    key = (record.pathname, record.lineno)
+    line = self.lines.get(key)
+    if line is None or record.created - line[0] >= self.window:
+      line = self.lines[key] = [record.created, 0, line[2] if line is not None else 0]
+
+    line[1] += 1
+    if line[1] > self.burst and (line[1] - self.burst) % self.sample != 0:
+      line[2] += 1
+      return False
+
+    if line[2]:
+      record.suppressed = line[2]
+      line[2] = 0
+    return True
+
 def _tmpfunc():
   return 0
 
-def _srcfile():
-  return os.path.normcase(_tmpfunc.__code__.co_filename)
+_srcfile = os.path.normcase(_tmpfunc.__code__.co_filename)
 
 class SwagLogger(logging.Logger):
   def __init__(self):
@@ -125,38 +165,27 @@ class SwagLogger(logging.Logger):
     Find the stack frame of the caller so that we can note the source
     file name, line number and function name.
     """
-    f = sys._getframe(3)
-    #On some versions of IronPython, currentframe() returns None if
-    #IronPython isn't run with -X:Frames.
-    if f is not None:
-        f = f.f_back
-    orig_f = f
-    while f and stacklevel > 1:
-        f = f.f_back
-        stacklevel -= 1
-    if not f:
-        f = orig_f
-    rv = "(unknown file)", 0, "(unknown function)", None
-    while hasattr(f, "f_code"):
-        co = f.f_code
-        filename = os.path.normcase(co.co_filename)
-
-        # TODO: is this pylint exception correct?
-        if filename == _srcfile:  # pylint: disable=comparison-with-callable
-            f = f.f_back
-            continue
-        sinfo = None
-        if stack_info:
-            sio = io.StringIO()
-            sio.write('Stack (most recent call last):\n')
-            traceback.print_stack(f, file=sio)
-            sinfo = sio.getvalue()
-            if sinfo[-1] == '\n':
-                sinfo = sinfo[:-1]
-            sio.close()
-        rv = (co.co_filename, f.f_lineno, co.co_name, sinfo)
-        break
-    return rv
+    # the first frame outside of logging and this file, like event() calling info()
+    f = sys._getframe(1)
+    while f is not None and os.path.normcase(f.f_code.co_filename) in (_srcfile, logging._srcfile):
+      f = f.f_back
+    while f is not None and stacklevel > 1 and f.f_back is not None:
+      f = f.f_back
+      stacklevel -= 1
+    if f is None:
+      return "(unknown file)", 0, "(unknown function)", None
+
+    co = f.f_code
+    sinfo = None
+    if stack_info:
+      sio = io.StringIO()
+      sio.write('Stack (most recent call last):\n')
+      traceback.print_stack(f, file=sio)
+      sinfo = sio.getvalue()
+      if sinfo[-1] == '\n':
+        sinfo = sinfo[:-1]
+      sio.close()
+    return co.co_filename, f.f_lineno, co.co_name, sinfo
 
 if __name__ == "__main__":
   log = SwagLogger()
@@ -19,16 +19,24 @@ before deleting the old <params_dir>/<d> directory.
 
 Writers that only modify a single key can simply take the lock, then swap the corresponding value
 file in place without messing with <params_dir>/d.
+
+Reads through Params are served from a per-process cache. An inotify watch on <params_dir> and
+<params_dir>/d drops cached values as soon as another process writes them, and also wakes up
+readers blocked on a key that doesn't exist yet.
 """
 import time
 import os
+import atexit
 import errno
 import shutil
 import fcntl
 import tempfile
 import threading
+from collections import defaultdict
 from enum import Enum
 from common.basedir import PARAMS
+from common import inotify
+from selfdrive.swaglog import cloudlog
 
 
 def mkdirs_exists_ok(path):
@@ -318,42 +326,215 @@ def read_db(params_path, key):
 
 
 def write_db(params_path, key, value):
-  if isinstance(value, str):
-    value = value.encode('utf8')
+  write_db_batch(params_path, [(key, value)])
+
 
+def write_db_batch(params_path, items):
+  """Writes several keys under one lock, with a single fsync of the data directory."""
   prev_umask = os.umask(0)
   lock = FileLock(params_path + "/.lock", True, True)
   lock.acquire()
 
+  tmp_paths = []
   try:
-    tmp_path = tempfile.NamedTemporaryFile(mode="wb", prefix=".tmp", dir=params_path, delete=False)
-    with tmp_path as f:
-      f.write(value)
-      f.flush()
-      os.fsync(f.fileno())
-    os.chmod(tmp_path.name, 0o666)
-
-    path = "%s/d/%s" % (params_path, key)
-    os.rename(tmp_path.name, path)
-    fsync_dir(os.path.dirname(path))
+    for key, value in items:
+      if isinstance(value, str):
+        value = value.encode('utf8')
+
+      tmp_path = tempfile.NamedTemporaryFile(mode="wb", prefix=".tmp", dir=params_path, delete=False)
+      tmp_paths.append((key, tmp_path.name))
+      with tmp_path as f:
+        f.write(value)
+        f.flush()
+        os.fsync(f.fileno())
+      os.chmod(tmp_path.name, 0o666)
+
+    data_path = "%s/d" % params_path
+    for key, tmp_path in tmp_paths:
+      os.rename(tmp_path, os.path.join(data_path, key))
+    fsync_dir(data_path)
   finally:
+    # only left behind if something failed
+    for _, tmp_path in tmp_paths:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
     os.umask(prev_umask)
     lock.release()
 
 
-class Params():
-  def __init__(self, db=PARAMS):
+class ParamsCache():
+  """Process-wide cache of the values in one params db, invalidated through inotify."""
+  DATA_EVENTS = inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM | inotify.IN_CLOSE_WRITE | inotify.IN_DELETE
+  ROOT_EVENTS = inotify.IN_MOVED_TO | inotify.IN_CREATE | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF
+
+  def __init__(self, db):
     self.db = db
+    self.alive = True
+    self._cv = threading.Condition()
+    self._vals = {}
+    # bumped whenever a key (or the whole db) changes, so a read racing a write isn't cached
+    self._gens = defaultdict(int)
+    self._gen_all = 0
+
+    self._fd = inotify.inotify_init()
+    try:
+      self._root_wd = inotify.add_watch(self._fd, self.db, self.ROOT_EVENTS | inotify.IN_ONLYDIR)
+      self._data_wd = inotify.add_watch(self._fd, os.path.join(self.db, "d"), self.DATA_EVENTS | inotify.IN_ONLYDIR)
+    except OSError:
+      os.close(self._fd)
+      raise
+
+    self._thread = threading.Thread(target=self._watch_thread, daemon=True)
+    self._thread.start()
+
+  def _gen(self, key):
+    return self._gen_all, self._gens[key]
+
+  def _watch_thread(self):
+    try:
+      while self.alive:
+        for wd, mask, _, name in inotify.read_events(self._fd):
+          with self._cv:
+            if mask & inotify.IN_Q_OVERFLOW:
+              self.invalidate_all()
+            elif wd == self._data_wd:
+              self.invalidate(name)
+            elif wd == self._root_wd and mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+              # db was removed, the next Params call sets up a new cache
+              self.alive = False
+              self.invalidate_all()
+            elif wd == self._root_wd and name == "d":
+              # a transaction swapped the data dir, follow the symlink again
+              self._rearm_data_watch()
+              self.invalidate_all()
+    except OSError:
+      pass
+    finally:
+      with self._cv:
+        self.alive = False
+        self.invalidate_all()
+      os.close(self._fd)
+
+  def _rearm_data_watch(self):
+    if self._data_wd is not None:
+      try:
+        inotify.rm_watch(self._fd, self._data_wd)
+      except OSError as e:
+        # the old data dir was already removed by the transaction that swapped it
+        if e.errno not in (errno.EINVAL, errno.ENOENT):
+          raise
+    try:
+      self._data_wd = inotify.add_watch(self._fd, os.path.join(self.db, "d"), self.DATA_EVENTS | inotify.IN_ONLYDIR)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      # swapped again and removed before we got here, the event of that swap re-arms it
+      self._data_wd = None
+
+  def invalidate(self, key):
+    with self._cv:
+      self._vals.pop(key, None)
+      self._gens[key] += 1
+      self._cv.notify_all()
+
+  def invalidate_all(self):
+    with self._cv:
+      self._vals.clear()
+      self._gen_all += 1
+      self._cv.notify_all()
+
+  def get(self, key):
+    with self._cv:
+      if key in self._vals:
+        return self._vals[key]
+      gen = self._gen(key)
+
+    val = read_db(self.db, key)
+
+    with self._cv:
+      if self.alive and self._gen(key) == gen:
+        self._vals[key] = val
+    return val
+
+  def wait_for(self, key, timeout=None):
+    """Returns the value of key as soon as it's set, or None after timeout seconds."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      with self._cv:
+        gen = self._gen(key)
+
+      val = self.get(key)
+      if val is not None or not self.alive:
+        return val
+
+      with self._cv:
+        while self._gen(key) == gen and self.alive:
+          remaining = None if deadline is None else deadline - time.monotonic()
+          if remaining is not None and remaining <= 0:
+            return None
+          self._cv.wait(remaining)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+_created_dbs = set()
+
+def _get_cache(db):
+  """Returns the ParamsCache of db, or None if inotify isn't available."""
+  cache = _caches.get(db)
+  if cache is not None and cache.alive:
+    return cache
+
+  with _caches_lock:
+    cache = _caches.get(db)
+    if cache is None or not cache.alive:
+      try:
+        cache = ParamsCache(db)
+      except (OSError, AttributeError):
+        cache = None
+      _caches[db] = cache
+  return cache
+
+def _invalidate_cache(db, key=None):
+  cache = _caches.get(db)
+  if cache is not None:
+    if key is None:
+      cache.invalidate_all()
+    else:
+      cache.invalidate(key)
+
+def _reset_after_fork():
+  # the watch and writer threads don't survive a fork
+  global _caches_lock, _writer, _writer_lock
+  _caches.clear()
+  _caches_lock = threading.Lock()
+  _writer = None
+  _writer_lock = threading.Lock()
+
+def default_params_path():
+  # same variable as the native processes use, process replay points it at a scratch dir
+  return os.environ.get("PARAMS_PATH", PARAMS)
+
+
+class Params():
+  def __init__(self, db=None):
+    self.db = db if db is not None else default_params_path()
 
     # create the database if it doesn't exist...
-    if not os.path.exists(self.db + "/d"):
-      with self.transaction(write=True):
-        pass
+    if self.db not in _created_dbs:
+      if not os.path.exists(self.db + "/d"):
+        with self.transaction(write=True):
+          pass
+      _created_dbs.add(self.db)
 
   def clear_all(self):
     shutil.rmtree(self.db, ignore_errors=True)
     with self.transaction(write=True):
       pass
+    self._invalidate()
+
+  def _invalidate(self, key=None):
+    _invalidate_cache(self.db, key)
 
   def transaction(self, write=False):
     if write:
@@ -366,6 +547,7 @@ class Params():
       for key in keys:
         if tx_type in keys[key]:
           txn.delete(key)
+    self._invalidate()
 
   def manager_start(self):
     self._clear_keys_with_type(TxType.CLEAR_ON_MANAGER_START)
@@ -376,16 +558,45 @@ class Params():
   def delete(self, key):
     with self.transaction(write=True) as txn:
       txn.delete(key)
+    self._invalidate(key)
 
   def get(self, key, block=False, encoding=None):
     if key not in keys:
       raise UnknownKeyName(key)
 
+    if block:
+      return self.wait_for(key, encoding=encoding)
+
+    cache = _get_cache(self.db)
+    ret = cache.get(key) if cache is not None else read_db(self.db, key)
+
+    if ret is not None and encoding is not None:
+      ret = ret.decode(encoding)
+
+    return ret
+
+  def wait_for(self, key, timeout=None, encoding=None):
+    """Blocks until key is set and returns its value, or None after timeout seconds."""
+    if key not in keys:
+      raise UnknownKeyName(key)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
     while 1:
-      ret = read_db(self.db, key)
-      if not block or ret is not None:
+      remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+      cache = _get_cache(self.db)
+      if cache is not None:
+        ret = cache.wait_for(key, remaining)
+        if ret is not None or cache.alive:
+          break
+      else:
+        # no inotify, fall back to polling
+        ret = read_db(self.db, key)
+        if ret is not None:
+          break
+
+      # the watcher died (db removed or moved), poll until it can be set up again
+      if deadline is not None and time.monotonic() > deadline:
         break
-      # is polling really the best we can do?
       time.sleep(0.05)
 
     if ret is not None and encoding is not None:
@@ -406,13 +617,99 @@ class Params():
       raise UnknownKeyName(key)
 
     write_db(self.db, key, dat)
+    self._invalidate(key)
+
+
+class ParamsWriter():
+  """Background writer behind put_nonblocking, one per process.
+
+  Puts queued while a batch is being written are coalesced per key and
+  committed together by write_db_batch. A batch that fails to write isn't
+  committed, its error is raised by the next flush.
+  """
+  def __init__(self):
+    self._cv = threading.Condition()
+    self._pending = {}
+    self._queued = 0
+    self._committed = 0
+    self._error = None
+
+    self._thread = threading.Thread(target=self._writer_thread, daemon=True)
+    self._thread.start()
+
+  def put(self, db, key, val):
+    with self._cv:
+      self._pending.setdefault(db, {})[key] = val
+      self._queued += 1
+      self._cv.notify_all()
+
+  def flush(self, timeout=None):
+    """Blocks until everything queued before this call is on disk. Returns False on timeout.
+
+    Raises the error of a write that failed since the last flush.
+    """
+    with self._cv:
+      target = self._queued
+      done = self._cv.wait_for(lambda: self._committed >= target or self._error is not None, timeout)
+      if self._error is not None:
+        error, self._error = self._error, None
+        raise error
+      return done
+
+  def _writer_thread(self):
+    while True:
+      with self._cv:
+        self._cv.wait_for(lambda: len(self._pending))
+        batch, self._pending = self._pending, {}
+        queued = self._queued
+
+      error = None
+      for db, items in batch.items():
+        try:
+          write_db_batch(db, list(items.items()))
+        except Exception as e:
+          cloudlog.exception("params: put_nonblocking failed to write %s" % db)
+          error = e
+        for key in items:
+          _invalidate_cache(db, key)
+
+      with self._cv:
+        if error is None:
+          self._committed = queued
+        else:
+          self._error = error
+        self._cv.notify_all()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def _get_writer():
+  global _writer
+  with _writer_lock:
+    if _writer is None:
+      _writer = ParamsWriter()
+    return _writer
+
+def _flush_at_exit():
+  # don't lose queued writes on a clean exit
+  if _writer is not None:
+    try:
+      _writer.flush(timeout=5.)
+    except Exception:
+      pass  # already logged by the writer
+
+atexit.register(_flush_at_exit)
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
 
+def put_nonblocking(key, val, db=None):
+  if key not in keys:
+    raise UnknownKeyName(key)
+  _get_writer().put(db if db is not None else default_params_path(), key, val)
 
-def put_nonblocking(key, val):
-  def f(key, val):
-    params = Params()
-    params.put(key, val)
 
-  t = threading.Thread(target=f, args=(key, val))
-  t.start()
-  return t
+def flush_nonblocking(timeout=None):
+  """Waits until all put_nonblocking calls made so far are durable."""
+  return _get_writer().flush(timeout)
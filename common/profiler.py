@@ -1,3 +1,8 @@
+import json
+import math
+import os
+import queue
+import threading
 import time
 
 class Profiler():
@@ -43,3 +48,147 @@ class Profiler():
       else:
         print("%30s: %9.2f   percent: %3.0f" % (n, ms*1000.0, ms/self.tot*100))
     print("Iter clock: %2.6f   TOTAL: %2.2f" % (self.tot/self.iter, self.tot))
+
+
+# The latency profiler is off unless LATENCY_PROFILE is set when the process starts,
+# then latency_profiler returns a profiler that does nothing
+LATENCY_PROFILE = os.getenv("LATENCY_PROFILE") is not None
+LATENCY_DIR = os.getenv("LATENCY_DIR", "/tmp/latency")
+LATENCY_PUBLISH_INTERVAL = 10.  # seconds
+
+# buckets are log spaced, 8 per power of two of microseconds, so within 9% of the value
+_SUB_BUCKETS = 8
+_BUCKETS = 32 * _SUB_BUCKETS
+
+
+def _bucket(us):
+  if us < 1.:
+    return 0
+  m, e = math.frexp(us)
+  return min(e * _SUB_BUCKETS + int((m - 0.5) * 2 * _SUB_BUCKETS), _BUCKETS - 1)
+
+
+def _bucket_value(idx):
+  """Upper bound of a bucket in microseconds"""
+  e, sub = divmod(idx, _SUB_BUCKETS)
+  return math.ldexp(0.5 + (sub + 1) / (2. * _SUB_BUCKETS), e)
+
+
+class LatencyHistogram():
+  def __init__(self):
+    self.counts = [0] * _BUCKETS
+    self.count = 0
+    self.max = 0.
+
+  def add(self, dt):
+    us = dt * 1e6
+    self.counts[_bucket(us)] += 1
+    self.count += 1
+    if us > self.max:
+      self.max = us
+
+  def percentile(self, p):
+    """In microseconds, rounded up to the bucket"""
+    if self.count == 0:
+      return 0.
+    target = p / 100. * self.count
+    seen = 0
+    for idx, c in enumerate(self.counts):
+      seen += c
+      if c and seen >= target:
+        return min(_bucket_value(idx), self.max)
+    return self.max
+
+  def summary(self):
+    return {"count": self.count, "p50": round(self.percentile(50), 1),
+            "p99": round(self.percentile(99), 1), "max": round(self.max, 1)}
+
+
+class LatencyProfiler():
+  """Histograms of the time between named checkpoints of a loop, and of the whole
+  iteration. Every publish_interval seconds the histograms are handed to a background
+  thread, which sends the percentiles to cloudlog as a 'latency' event and appends them
+  to LATENCY_DIR/<name>.json. The loop starts over with empty histograms."""
+  def __init__(self, name, publish_interval=LATENCY_PUBLISH_INTERVAL):
+    self.name = name
+    self.publish_interval = publish_interval
+    self.stages = {}
+    self.total = LatencyHistogram()
+    self.start_time = self.last_time = time.perf_counter()
+    self.publish_time = self.start_time + publish_interval
+    self.publish_queue = queue.Queue()
+    self.publish_thread = None
+
+  def start(self):
+    self.start_time = self.last_time = time.perf_counter()
+
+  def checkpoint(self, name):
+    t = time.perf_counter()
+    hist = self.stages.get(name)
+    if hist is None:
+      hist = self.stages[name] = LatencyHistogram()
+    hist.add(t - self.last_time)
+    self.last_time = t
+
+  def end(self):
+    t = time.perf_counter()
+    self.total.add(t - self.start_time)
+    if t > self.publish_time:
+      self.publish()
+      self.publish_time = t + self.publish_interval
+
+  def summary(self):
+    return self._summary(self.stages, self.total)
+
+  @staticmethod
+  def _summary(stages, total):
+    ret = {name: hist.summary() for name, hist in stages.items()}
+    ret["total"] = total.summary()
+    return ret
+
+  def publish(self):
+    if self.publish_thread is None:
+      self.publish_thread = threading.Thread(target=self._publish_thread, name="latency_" + self.name, daemon=True)
+      self.publish_thread.start()
+
+    self.publish_queue.put((time.time(), self.stages, self.total))
+    self.stages = {}
+    self.total = LatencyHistogram()
+
+  def flush(self):
+    """Waits until everything handed to the publish thread is written"""
+    self.publish_queue.join()
+
+  def _publish_thread(self):
+    from selfdrive.swaglog import cloudlog
+
+    while True:
+      t, stages, total = self.publish_queue.get()
+      try:
+        summary = self._summary(stages, total)
+        cloudlog.event("latency", proc=self.name, stages=summary)
+        try:
+          os.makedirs(LATENCY_DIR, exist_ok=True)
+          with open(os.path.join(LATENCY_DIR, self.name + ".json"), "a") as f:
+            f.write(json.dumps({"time": t, "stages": summary}) + "\n")
+        except OSError:
+          cloudlog.exception("latency profiler can't write to %s" % LATENCY_DIR)
+      finally:
+        self.publish_queue.task_done()
+
+
+class NullLatencyProfiler():
+  def start(self):
+    pass
+
+  def checkpoint(self, name):
+    pass
+
+  def end(self):
+    pass
+
+
+def latency_profiler(name, publish_interval=LATENCY_PUBLISH_INTERVAL):
+  if LATENCY_PROFILE:
+    return LatencyProfiler(name, publish_interval)
+  return NullLatencyProfiler()
@@ -0,0 +1,77 @@
+import logging
+import unittest
+
+from common.logging_extra import SwagLogger, SwagRateLimitFilter
+
+
+class ListHandler(logging.Handler):
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+
+class TestSwagLogger(unittest.TestCase):
+  def setUp(self):
+    self.log = SwagLogger()
+    self.handler = ListHandler()
+    self.log.addHandler(self.handler)
+
+  def test_caller(self):
+    def log_lines():
+      self.log.info("a")
+      self.log.warning("b")
+      self.log.event("c")
+      return log_lines.__code__.co_firstlineno
+
+    first_line = log_lines()
+    self.assertEqual([(r.pathname, r.lineno, r.funcName) for r in self.handler.records],
+                     [(__file__, first_line + i, "log_lines") for i in (1, 2, 3)])
+
+  def test_rate_limit(self):
+    self.log.addFilter(SwagRateLimitFilter(burst=20, window=10., sample=100))
+    for i in range(270):
+      self.log.info("spam %d", i)
+    self.log.info("other line")
+
+    # the first 20, then every 100th with the number dropped before it
+    passed = [r.getMessage() for r in self.handler.records]
+    self.assertEqual(passed, ["spam %d" % i for i in list(range(20)) + [119, 219]] + ["other line"])
+    self.assertEqual([getattr(r, "suppressed", None) for r in self.handler.records[19:]], [None, 99, 99, None])
+
+  def test_rate_limit_events_and_errors(self):
+    self.log.addFilter(SwagRateLimitFilter(burst=1, window=10., sample=100))
+    for _ in range(10):
+      self.log.event("evt", x=1)
+      self.log.error("error")
+    self.assertEqual(len(self.handler.records), 20)
+
+
+class TestSwagRateLimitFilter(unittest.TestCase):
+  def record(self, lineno, created):
+    record = logging.LogRecord("swaglog", logging.INFO, "file.py", lineno, "msg", None, None)
+    record.created = created
+    return record
+
+  def test_window(self):
+    f = SwagRateLimitFilter(burst=2, window=1., sample=100)
+    self.assertEqual([f.filter(self.record(1, t)) for t in (0., 0.1, 0.2, 0.3)], [True, True, False, False])
+
+    # a new window lets a burst through again, the first one says how many were dropped
+    record = self.record(1, 1.5)
+    self.assertTrue(f.filter(record))
+    self.assertEqual(record.suppressed, 2)
+    self.assertTrue(f.filter(self.record(1, 1.6)))
+    self.assertFalse(f.filter(self.record(1, 1.7)))
+
+  def test_lines_are_separate(self):
+    f = SwagRateLimitFilter(burst=1, window=1., sample=100)
+    self.assertTrue(f.filter(self.record(1, 0.)))
+    self.assertFalse(f.filter(self.record(1, 0.)))
+    self.assertTrue(f.filter(self.record(2, 0.)))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,4 +1,6 @@
-from common.params import Params, UnknownKeyName
+from common.params import Params, UnknownKeyName, write_db, put_nonblocking, flush_nonblocking
+import multiprocessing
+import os
 import threading
 import time
 import tempfile
@@ -6,6 +8,17 @@ import shutil
 import unittest
 
 
+def _get_block(db, key, q):
+  q.put(Params(db).get(key, block=True))
+
+def _swap_then_put(db, key, n):
+  params = Params(db)
+  for _ in range(n):
+    # every transaction swaps the data dir and removes the old one
+    params.delete("AthenadPid")
+  params.put(key, "done")
+
+
 class TestParams(unittest.TestCase):
   def setUp(self):
     self.tmpdir = tempfile.mkdtemp()
@@ -54,6 +67,66 @@ class TestParams(unittest.TestCase):
     assert self.params.get("CarParams") is None
     assert self.params.get("CarParams", True) == b"test"
 
+  def test_params_wait_for_timeout(self):
+    t = time.monotonic()
+    assert self.params.wait_for("CarParams", timeout=0.2) is None
+    assert time.monotonic() - t >= 0.2
+
+  def test_params_cache_invalidation(self):
+    self.params.put("DongleId", "bob")
+    assert self.params.get("DongleId") == b"bob"
+
+    # written behind the cache's back, like another process would
+    write_db(self.tmpdir, "DongleId", "alice")
+    deadline = time.monotonic() + 1
+    while self.params.get("DongleId") != b"alice" and time.monotonic() < deadline:
+      time.sleep(0.01)
+    assert self.params.get("DongleId") == b"alice"
+
+    Params(self.tmpdir).delete("DongleId")
+    assert self.params.get("DongleId") is None
+
+  def test_params_get_block_multiprocess(self):
+    q = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=_get_block, args=(self.tmpdir, "CarParams", q)) for _ in range(2)]
+    for p in readers:
+      p.start()
+    time.sleep(0.2)
+
+    writers = [multiprocessing.Process(target=_swap_then_put, args=(self.tmpdir, "CarParams", 50)) for _ in range(2)]
+    for p in writers:
+      p.start()
+    for p in writers:
+      p.join(10)
+
+    assert [q.get(timeout=10) for _ in readers] == [b"done", b"done"]
+    for p in readers:
+      p.join(1)
+
+    # the cache of this process followed the swaps too
+    assert self.params.get("CarParams", True) == b"done"
+    write_db(self.tmpdir, "DongleId", "bob")
+    assert self.params.wait_for("DongleId", timeout=1) == b"bob"
+
+  def test_params_put_nonblocking(self):
+    for i in range(100):
+      put_nonblocking("CarParams", str(i), self.tmpdir)
+    put_nonblocking("DongleId", "bob", self.tmpdir)
+    assert flush_nonblocking(timeout=5)
+    assert self.params.get("CarParams") == b"99"
+    assert self.params.get("DongleId") == b"bob"
+
+  def test_params_put_nonblocking_error(self):
+    missing = os.path.join(self.tmpdir, "missing")
+    put_nonblocking("DongleId", "bob", missing)
+    with self.assertRaises(OSError):
+      flush_nonblocking(timeout=5)
+
+    # reported once, later writes go through
+    put_nonblocking("DongleId", "bob", self.tmpdir)
+    assert flush_nonblocking(timeout=5)
+    assert self.params.get("DongleId") == b"bob"
+
   def test_params_unknown_key_fails(self):
     with self.assertRaises(UnknownKeyName):
       self.params.get("swag")
@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import common.profiler as profiler
+from common.profiler import LatencyHistogram, LatencyProfiler, NullLatencyProfiler, latency_profiler
+
+
+class TestLatencyProfiler(unittest.TestCase):
+  def test_histogram_percentiles(self):
+    hist = LatencyHistogram()
+    for us in range(1, 1001):
+      hist.add(us * 1e-6)
+
+    self.assertEqual(hist.count, 1000)
+    self.assertEqual(hist.max, 1000.)
+    for p, expected in [(50, 500.), (99, 990.)]:
+      # the bucket is at most 1/8 of a power of two above the value
+      self.assertGreaterEqual(hist.percentile(p), expected)
+      self.assertLessEqual(hist.percentile(p), expected * 1.13)
+    self.assertEqual(hist.percentile(100), 1000.)
+
+  def test_off_by_default(self):
+    with mock.patch.object(profiler, "LATENCY_PROFILE", False):
+      self.assertIsInstance(latency_profiler("test"), NullLatencyProfiler)
+    with mock.patch.object(profiler, "LATENCY_PROFILE", True):
+      self.assertIsInstance(latency_profiler("test"), LatencyProfiler)
+
+  def test_publish(self):
+    with tempfile.TemporaryDirectory() as d, mock.patch.object(profiler, "LATENCY_DIR", d):
+      prof = LatencyProfiler("test", publish_interval=0.)
+      for _ in range(10):
+        prof.start()
+        prof.checkpoint("a")
+        prof.checkpoint("b")
+        prof.end()
+      prof.flush()
+
+      with open(os.path.join(d, "test.json")) as f:
+        lines = [json.loads(l) for l in f]
+      self.assertEqual(len(lines), 10)
+      self.assertEqual(set(lines[0]["stages"]), {"a", "b", "total"})
+      self.assertEqual(lines[0]["stages"]["total"]["count"], 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import common.url_file as url_file
+from common.url_file import URLFile
+
+DATA = os.urandom(int(url_file.CHUNK_SIZE * 3.5))
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+  requests = []
+
+  def log_message(self, *args):
+    pass
+
+  def _send(self, body):
+    rng = self.headers.get("Range")
+    if rng is None:
+      self.send_response(200)
+      start, end = 0, len(DATA) - 1
+    else:
+      start, end = rng.split("=")[1].split("-")
+      start, end = int(start), int(end) if end else len(DATA) - 1
+      self.send_response(206)
+      self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(DATA)))
+    self.send_header("Content-Length", str(end - start + 1))
+    self.end_headers()
+    if body:
+      self.wfile.write(DATA[start:end + 1])
+
+  def do_HEAD(self):
+    self._send(False)
+
+  def do_GET(self):
+    RangeHandler.requests.append(self.headers.get("Range"))
+    self._send(True)
+
+
+class TestURLFile(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+    cls.url = "http://127.0.0.1:%d/fcamera.hevc" % cls.server.server_port
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.prev_cache_dir = url_file.CACHE_DIR
+    url_file.CACHE_DIR = self.cache_dir
+    RangeHandler.requests = []
+
+  def tearDown(self):
+    url_file.CACHE_DIR = self.prev_cache_dir
+    shutil.rmtree(self.cache_dir)
+
+  def test_uncached_read(self):
+    f = URLFile(self.url, cache=False)
+    f.seek(100)
+    self.assertEqual(f.read(1000), DATA[100:1100])
+    self.assertEqual(f.read(), DATA[1100:])
+
+  def test_cached_read(self):
+    f = URLFile(self.url, cache=True)
+    for start, ll in [(0, 10), (url_file.CHUNK_SIZE - 5, 10), (123, url_file.CHUNK_SIZE * 2), (len(DATA) - 7, 100)]:
+      f.seek(start)
+      self.assertEqual(f.read(ll), DATA[start:start + ll])
+    f.seek(0)
+    self.assertEqual(f.read(), DATA)
+
+    # every chunk was downloaded exactly once
+    self.assertEqual(len(RangeHandler.requests), 4)
+    self.assertEqual(len(set(RangeHandler.requests)), 4)
+
+    # a new file object reads from disk
+    f = URLFile(self.url + "?sig=other", cache=True)
+    f.seek(500)
+    self.assertEqual(f.read(url_file.CHUNK_SIZE), DATA[500:500 + url_file.CHUNK_SIZE])
+    self.assertEqual(len(RangeHandler.requests), 4)
+
+  def test_evict(self):
+    f = URLFile(self.url, cache=True)
+    f.read()
+    url_file.evict_cache(self.cache_dir, url_file.CHUNK_SIZE * 2)
+    self.assertLessEqual(sum(os.path.getsize(os.path.join(self.cache_dir, fn)) for fn in os.listdir(self.cache_dir)), url_file.CHUNK_SIZE * 2)
+
+    f.seek(0)
+    self.assertEqual(f.read(), DATA)
+
+  def test_read_over_cache_size(self):
+    prev_cache_size = url_file.CACHE_SIZE
+    url_file.CACHE_SIZE = url_file.CHUNK_SIZE
+    try:
+      f = URLFile(self.url, cache=True)
+      # the chunks of a read aren't evicted while it's put together
+      self.assertEqual(f.read(), DATA)
+
+      # chunks evicted by another process are downloaded again
+      os.remove(f._chunk_path(1))
+      f.seek(0)
+      self.assertEqual(f.read(), DATA)
+    finally:
+      url_file.CACHE_SIZE = prev_cache_size
+
+  def test_cache_not_rescanned(self):
+    f = URLFile(self.url, cache=True)
+    with mock.patch("common.url_file.os.scandir", wraps=os.scandir) as scandir:
+      for chunk in range(4):
+        f.seek(chunk * url_file.CHUNK_SIZE)
+        f.read(10)
+    self.assertEqual(scandir.call_count, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
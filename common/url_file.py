@@ -10,20 +10,90 @@ from io import BytesIO
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from common.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
 
+# Remote reads are split into CHUNK_SIZE aligned blocks that are kept on disk, so
+# repeated random access to the same file doesn't go back to the network.
+K = 1000
+CHUNK_SIZE = 1000 * K
+CACHE_DIR = os.environ.get("COMMA_CACHE", "/tmp/comma_download_cache/")
+CACHE_SIZE = int(os.environ.get("COMMA_CACHE_SIZE", 10 * 1000 * 1000 * K))
+
+# how many chunks are fetched in parallel over one curl multi handle
+MAX_PARALLEL_CHUNKS = 8
+
+
+def hash_256(link):
+  # signed urls change on every request, the path is what identifies the file
+  hsh = hashlib.sha256(link.split("?")[0].encode('utf-8')).hexdigest()
+  return hsh
+
+
+# the cache is trimmed to this fraction of CACHE_SIZE, so it's not scanned again on the next fetch
+EVICT_TARGET = 0.9
+
+_cache_lock = threading.Lock()
+_cache_bytes = {}  # cache dir -> bytes in it, scanned on first use and when over CACHE_SIZE
+
+
+def evict_cache(cache_dir=None, max_size=None, keep=()):
+  """Removes least recently used chunks, except the paths in keep, until the cache fits
+  in max_size bytes. Returns the bytes left in the cache."""
+  cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+  max_size = CACHE_SIZE if max_size is None else max_size
+  try:
+    entries = [e for e in os.scandir(cache_dir) if e.is_file()]
+  except FileNotFoundError:
+    return 0
+
+  stats = []
+  for e in entries:
+    try:
+      stats.append((e.stat(), e.path))
+    except FileNotFoundError:
+      pass
+  total = sum(st.st_size for st, _ in stats)
+  for st, path in sorted(stats, key=lambda x: x[0].st_mtime):
+    if total <= max_size:
+      break
+    if path in keep:
+      continue
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+    total -= st.st_size
+  return total
+
+
+def _chunks_cached(size, keep):
+  """Accounts for size new bytes in the cache, evicting when it's over CACHE_SIZE."""
+  with _cache_lock:
+    total = _cache_bytes.get(CACHE_DIR)
+    if total is not None and total + size <= CACHE_SIZE:
+      _cache_bytes[CACHE_DIR] = total + size
+      return
+    _cache_bytes[CACHE_DIR] = evict_cache(max_size=int(CACHE_SIZE * EVICT_TARGET), keep=keep)
+
+
 class URLFile(object):
   _tlocal = threading.local()
 
-  def __init__(self, url, debug=False):
+  def __init__(self, url, debug=False, cache=None):
     self._url = url
     self._pos = 0
+    self._length = None
     self._local_file = None
     self._debug = debug
+    # Chunks are cached on disk if FILEREADER_CACHE is set, unless overridden by the cache argument
+    self._force_download = not (cache if cache is not None else os.environ.get("FILEREADER_CACHE") == "1")
 
     try:
       self._curl = self._tlocal.curl
     except AttributeError:
       self._curl = self._tlocal.curl = pycurl.Curl()
 
+    if not self._force_download:
+      mkdirs_exists_ok(CACHE_DIR)
+
   def __enter__(self):
     return self
 
@@ -33,8 +103,132 @@ class URLFile(object):
       self._local_file.close()
       self._local_file = None
 
+  def _setup_curl(self, c, trange, dats):
+    c.setopt(pycurl.URL, self._url)
+    c.setopt(pycurl.WRITEDATA, dats)
+    c.setopt(pycurl.NOSIGNAL, 1)
+    c.setopt(pycurl.TIMEOUT_MS, 500000)
+    c.setopt(pycurl.HTTPHEADER, ["Range: " + trange, "Connection: keep-alive"])
+    c.setopt(pycurl.FOLLOWLOCATION, True)
+
+  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
+  def get_length(self):
+    if self._length is not None:
+      return self._length
+
+    c = self._curl
+    c.setopt(pycurl.URL, self._url)
+    c.setopt(pycurl.WRITEDATA, BytesIO())
+    c.setopt(pycurl.NOSIGNAL, 1)
+    c.setopt(pycurl.HTTPHEADER, ["Connection: keep-alive"])
+    c.setopt(pycurl.FOLLOWLOCATION, True)
+    c.setopt(pycurl.NOBODY, True)
+    try:
+      c.perform()
+      length = int(c.getinfo(pycurl.CONTENT_LENGTH_DOWNLOAD))
+    finally:
+      c.setopt(pycurl.NOBODY, False)
+      c.setopt(pycurl.HTTPGET, True)
+
+    if length < 0:
+      raise Exception("Unknown length for {}".format(self._url))
+    self._length = length
+    return length
+
+  def _chunk_path(self, chunk):
+    return os.path.join(CACHE_DIR, "%s_%d" % (hash_256(self._url), chunk))
+
   @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
+  def _fetch_chunks(self, chunks):
+    """Downloads the given chunks concurrently, stores them in the cache and returns their data."""
+    length = self.get_length()
+    multi = pycurl.CurlMulti()
+    handles = []
+    for chunk in chunks:
+      start = chunk * CHUNK_SIZE
+      end = min(start + CHUNK_SIZE, length) - 1
+      c = pycurl.Curl()
+      dats = BytesIO()
+      self._setup_curl(c, 'bytes=%d-%d' % (start, end), dats)
+      multi.add_handle(c)
+      handles.append((chunk, c, dats, end - start + 1))
+
+    fetched = {}
+    try:
+      num_active = len(handles)
+      while num_active:
+        ret, num_active = multi.perform()
+        if ret == pycurl.E_CALL_MULTI_PERFORM:
+          continue
+        if num_active:
+          multi.select(1.0)
+
+      for chunk, c, dats, size in handles:
+        response_code = c.getinfo(pycurl.RESPONSE_CODE)
+        if response_code != 206 and response_code != 200:
+          raise Exception("Error {} ({}): {}".format(response_code, self._url, repr(dats.getvalue())[:500]))
+
+        dat = dats.getvalue()
+        if response_code == 200:
+          # server ignored the range
+          dat = dat[chunk * CHUNK_SIZE:chunk * CHUNK_SIZE + size]
+        if len(dat) != size:
+          raise Exception("Short read for chunk {} of {}: {} != {}".format(chunk, self._url, len(dat), size))
+
+        with atomic_write_in_dir(self._chunk_path(chunk), mode="wb", overwrite=True) as cache_file:
+          cache_file.write(dat)
+        fetched[chunk] = dat
+    finally:
+      for _, c, _, _ in handles:
+        multi.remove_handle(c)
+        c.close()
+      multi.close()
+
+    return fetched
+
   def read(self, ll=None):
+    if self._force_download:
+      return self.read_aux(ll=ll)
+
+    file_end = self.get_length()
+    if ll is None:
+      ll = file_end - self._pos
+    end = min(self._pos + ll, file_end)
+    if end <= self._pos:
+      return b""
+
+    # the data of every chunk is kept until the read is put together, eviction
+    # can remove the files meanwhile
+    chunks = range(self._pos // CHUNK_SIZE, (end - 1) // CHUNK_SIZE + 1)
+    dats = {}
+    for chunk in chunks:
+      path = self._chunk_path(chunk)
+      try:
+        with open(path, "rb") as cached_file:
+          dats[chunk] = cached_file.read()
+        # mark as recently used for eviction
+        os.utime(path)
+      except FileNotFoundError:
+        pass
+
+    missing = [c for c in chunks if c not in dats]
+    for i in range(0, len(missing), MAX_PARALLEL_CHUNKS):
+      dats.update(self._fetch_chunks(missing[i:i + MAX_PARALLEL_CHUNKS]))
+
+    response = BytesIO()
+    for chunk in chunks:
+      chunk_start = chunk * CHUNK_SIZE
+      response.write(dats[chunk][max(self._pos - chunk_start, 0):end - chunk_start])
+
+    if missing:
+      _chunks_cached(sum(len(dats[c]) for c in missing), {self._chunk_path(c) for c in chunks})
+
+    ret = response.getvalue()
+    self._pos += len(ret)
+    return ret
+
+  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
+  def read_aux(self, ll=None):
     if ll is None:
       trange = 'bytes=%d-' % self._pos
     else:
@@ -42,12 +236,7 @@ class URLFile(object):
 
     dats = BytesIO()
     c = self._curl
-    c.setopt(pycurl.URL, self._url)
-    c.setopt(pycurl.WRITEDATA, dats)
-    c.setopt(pycurl.NOSIGNAL, 1)
-    c.setopt(pycurl.TIMEOUT_MS, 500000)
-    c.setopt(pycurl.HTTPHEADER, ["Range: " + trange, "Connection: keep-alive"])
-    c.setopt(pycurl.FOLLOWLOCATION, True)
+    self._setup_curl(c, trange, dats)
 
     if self._debug:
       print("downloading", self._url)
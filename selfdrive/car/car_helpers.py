@@ -1,10 +1,12 @@
 import os
+import threading
+from collections.abc import Mapping
 from common.params import Params
 from common.basedir import BASEDIR
 from selfdrive.version import comma_remote, tested_branch
-from selfdrive.car.fingerprints import eliminate_incompatible_cars, all_known_cars
-from selfdrive.car.vin import get_vin, VIN_UNKNOWN
-from selfdrive.car.fw_versions import get_fw_versions, match_fw_to_car
+from selfdrive.car.fingerprints import get_fingerprint_index
+from selfdrive.car.vin import VIN_UNKNOWN
+from selfdrive.car.fw_versions import get_vin_and_fw_versions, match_fw_to_car, match_fw_to_car_scores
 from selfdrive.swaglog import cloudlog
 import cereal.messaging as messaging
 from selfdrive.car import gen_empty_fingerprint
@@ -35,25 +37,52 @@ def get_one_can(logcan):
       return can
 
 
+def load_interface(brand_name):
+  path = ('selfdrive.car.%s' % brand_name)
+  CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
+
+  if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carstate.py'):
+    CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
+  else:
+    CarState = None
+
+  if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carcontroller.py'):
+    CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
+  else:
+    CarController = None
+
+  return CarInterface, CarController, CarState
+
+
 def load_interfaces(brand_names):
   ret = {}
   for brand_name in brand_names:
-    path = ('selfdrive.car.%s' % brand_name)
-    CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
+    brand_interface = load_interface(brand_name)
+    for model_name in brand_names[brand_name]:
+      ret[model_name] = brand_interface
+  return ret
 
-    if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carstate.py'):
-      CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
-    else:
-      CarState = None
 
-    if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carcontroller.py'):
-      CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
-    else:
-      CarController = None
+class LazyInterfaces(Mapping):
+  """Maps car models to (CarInterface, CarController, CarState), importing a
+     brand's modules the first time one of its models is looked up."""
+  def __init__(self, brand_names):
+    self.brands = {model_name: brand_name for brand_name in brand_names for model_name in brand_names[brand_name]}
+    self.loaded = {}
 
-    for model_name in brand_names[brand_name]:
-      ret[model_name] = (CarInterface, CarController, CarState)
-  return ret
+  def load_brand(self, brand_name):
+    if brand_name not in self.loaded:
+      self.loaded[brand_name] = load_interface(brand_name)
+    return self.loaded[brand_name]
+
+  def __getitem__(self, model_name):
+    return self.load_brand(self.brands[model_name])
+
+  def __iter__(self):
+    return iter(self.brands)
+
+  def __len__(self):
+    return len(self.brands)
 
 
 def _get_interface_names():
@@ -73,17 +102,29 @@ def _get_interface_names():
   return brand_names
 
 
-# imports from directory selfdrive/car/<name>/
-interface_names = _get_interface_names()
-interfaces = load_interfaces(interface_names)
+def _preload_cached_brand():
+  # import the brand the car was last fingerprinted as while the VIN and FW are
+  # queried, so recognizing the same car again doesn't wait on the import
+  try:
+    cached_params = Params().get("CarParamsCache")
+    if cached_params is not None:
+      brand_name = car.CarParams.from_bytes(cached_params).carName
+      if brand_name in interface_names:
+        interfaces.load_brand(brand_name)
+  except Exception:
+    cloudlog.exception("failed to preload car interface")
 
 
-def only_toyota_left(candidate_cars):
-  return all(("TOYOTA" in c or "LEXUS" in c) for c in candidate_cars) and len(candidate_cars) > 0
+# imports from directory selfdrive/car/<name>/
+interface_names = _get_interface_names()
+interfaces = LazyInterfaces(interface_names)
 
 
 # **** for use live only ****
 def fingerprint(logcan, sendcan, has_relay):
+  # imports are thread safe, a lookup of the same brand waits for this one to finish
+  threading.Thread(target=_preload_cached_brand, name="preload_car_interface", daemon=True).start()
+
   fixed_fingerprint = os.environ.get('FINGERPRINT', "")
   skip_fw_query = os.environ.get('SKIP_FW_QUERY', False)
 
@@ -103,10 +144,13 @@ def fingerprint(logcan, sendcan, has_relay):
       car_fw = list(cached_params.carFw)
     else:
       cloudlog.warning("Getting VIN & FW versions")
-      _, vin = get_vin(logcan, sendcan, bus)
-      car_fw = get_fw_versions(logcan, sendcan, bus)
+      vin, car_fw = get_vin_and_fw_versions(logcan, sendcan, bus)
 
     fw_candidates = match_fw_to_car(car_fw)
+    if len(fw_candidates) != 1 and len(car_fw) > 0:
+      scores = match_fw_to_car_scores(car_fw)
+      best = sorted(scores.items(), key=lambda s: (s[1][0], -s[1][1]), reverse=True)[:3]
+      cloudlog.warning("FW partial matches %s", [(c, "%d/%d" % s) for c, s in best])
   else:
     vin = VIN_UNKNOWN
     fw_candidates, car_fw = set(), []
@@ -115,11 +159,15 @@ def fingerprint(logcan, sendcan, has_relay):
   Params().put("CarVin", vin)
 
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_known_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  # candidates are bitsets over index.cars
+  index = get_fingerprint_index()
+  toyota_mask = index.mask(c for c in index.cars if "TOYOTA" in c or "LEXUS" in c)
+  candidate_cars = {i: index.all_mask for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
   frame = 0
   frame_fingerprint = 10  # 0.1s
   car_fingerprint = None
   done = False
+  force_fingerprint_tesla = CarSettings().forceFingerprintTesla
 
   while not done:
     a = get_one_can(logcan)
@@ -133,28 +181,29 @@ def fingerprint(logcan, sendcan, has_relay):
       if can.src in range(0, 4):
         finger[can.src][can.address] = len(can.dat)
       for b in candidate_cars:
-        if (can.src == b or (only_toyota_left(candidate_cars[b]) and can.src == 2)) and \
+        only_toyota = candidate_cars[b] and not (candidate_cars[b] & ~toyota_mask)
+        if (can.src == b or (only_toyota and can.src == 2)) and \
            can.address < 0x800 and can.address not in [0x7df, 0x7e0, 0x7e8]:
-          candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+          candidate_cars[b] = index.eliminate(candidate_cars[b], can.address, len(can.dat))
 
     # if we only have one car choice and the time since we got our first
     # message has elapsed, exit
     for b in candidate_cars:
       # Toyota needs higher time to fingerprint, since DSU does not broadcast immediately
-      if only_toyota_left(candidate_cars[b]):
+      if candidate_cars[b] and not (candidate_cars[b] & ~toyota_mask):
         frame_fingerprint = 100  # 1s
-      if len(candidate_cars[b]) == 1:
+      if candidate_cars[b] and not (candidate_cars[b] & (candidate_cars[b] - 1)):
         if frame > frame_fingerprint:
           # fingerprint done
-          car_fingerprint = candidate_cars[b][0]
+          car_fingerprint = index.names(candidate_cars[b])[0]
 
-    if (car_fingerprint is None) and CarSettings().forceFingerprintTesla:
+    if (car_fingerprint is None) and force_fingerprint_tesla:
           print ("Fingerprinting Failed: Returning Tesla (based on branch)")
           car_fingerprint = "TESLA MODEL S"
           vin = "TESLAFAKEVIN12345"
 
     # bail if no cars left or we've been waiting for more than 2s
-    failed = all(len(cc) == 0 for cc in candidate_cars.values()) or frame > 200
+    failed = all(cc == 0 for cc in candidate_cars.values()) or frame > 200
     succeeded = car_fingerprint is not None
     done = failed or succeeded
 
@@ -46,6 +46,62 @@ def is_valid_for_fingerprint(msg, car_fingerprint):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+# Fingerprinting checks every CAN message against every candidate car. The index
+# maps (address, length) to the bitset of cars that have that message in any of
+# their fingerprints, so eliminating cars is a single AND per message. Building
+# it takes a few ms, it's built the first time it's needed.
+
+
+class FingerprintIndex():
+  def __init__(self, cars, index, valid_mask):
+    self.cars = cars  # bit i of a mask is cars[i]
+    self.index = index
+    self.valid_mask = valid_mask  # every car that isn't ignored
+    self.all_mask = (1 << len(cars)) - 1
+    self.bits = {c: 1 << i for i, c in enumerate(cars)}
+
+  @classmethod
+  def build(cls, fingerprints, ignored):
+    cars = list(fingerprints.keys())
+    index = {}
+    valid_mask = 0
+    for i, car_name in enumerate(cars):
+      if car_name in ignored:
+        continue
+      valid_mask |= 1 << i
+      for fingerprint in fingerprints[car_name]:
+        fingerprint = {**fingerprint, **_DEBUG_ADDRESS}  # add alien debug address
+        for msg in fingerprint.items():
+          index[msg] = index.get(msg, 0) | (1 << i)
+    return cls(cars, index, valid_mask)
+
+  def mask(self, car_names):
+    ret = 0
+    for c in car_names:
+      ret |= self.bits.get(c, 0)
+    return ret
+
+  def names(self, mask):
+    return [c for i, c in enumerate(self.cars) if mask >> i & 1]
+
+  def eliminate(self, mask, address, length):
+    """Returns the subset of mask that could have sent a message of length bytes on address"""
+    # ignore addresses that are more than 11 bits
+    if address >= 0x800:
+      return mask & self.valid_mask
+    return mask & self.index.get((address, length), 0)
+
+
+_fingerprint_index = None
+
+
+def get_fingerprint_index():
+  global _fingerprint_index
+  if _fingerprint_index is None:
+    _fingerprint_index = FingerprintIndex.build(_FINGERPRINTS, IGNORED_FINGERPRINTS)
+  return _fingerprint_index
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -56,22 +112,9 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    if car_name in IGNORED_FINGERPRINTS:
-      continue
-
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      fingerprint.update(_DEBUG_ADDRESS)  # add alien debug address
-
-      if is_valid_for_fingerprint(msg, fingerprint):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  index = get_fingerprint_index()
+  mask = index.eliminate(index.mask(candidate_cars), msg.address, len(msg.dat))
+  return [c for c in candidate_cars if mask & index.bits.get(c, 0)]
 
 
 def all_known_cars():
@@ -10,6 +10,7 @@ from cereal import car
 from selfdrive.car.fingerprints import FW_VERSIONS, get_attr_from_cars
 from selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
 from selfdrive.car.toyota.values import CAR as TOYOTA
+from selfdrive.car.vin import add_vin_query, get_vin, vin_from_results
 from selfdrive.swaglog import cloudlog
 
 Ecu = car.CarParams.Ecu
@@ -103,52 +104,109 @@ REQUESTS = [
 ]
 
 
-def chunks(l, n=128):
-  for i in range(0, len(l), n):
-    yield l[i:i + n]
+# ECUs that have to answer for a car to match, unless listed as optional for it
+ESSENTIAL_ECUS = {Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa, Ecu.electricBrakeBooster}
+OPTIONAL_ECUS = {
+  Ecu.esp: {TOYOTA.RAV4, TOYOTA.COROLLA, TOYOTA.HIGHLANDER},
+  # TODO: COROLLA_TSS2 engine can show on two different addresses
+  Ecu.engine: {TOYOTA.COROLLA_TSS2, TOYOTA.CHR},
+}
+
+
+class FwVersionIndex():
+  """Bitsets over all cars with FW versions, so matching is a few ANDs per ECU
+  instead of a scan over every car. Bit i of a mask is cars[i]."""
+  def __init__(self, fw_versions):
+    self.cars = list(fw_versions.keys())
+    self.all_mask = (1 << len(self.cars)) - 1
+    self.ecu_cars = {}  # (ecu, addr, sub_addr) -> cars with versions for the ECU
+    self.version_cars = {}  # (ecu, addr, sub_addr, version) -> cars that have that version
+    self.required_cars = {}  # (ecu, addr, sub_addr) -> cars that can't match if the ECU doesn't answer
+    self.car_ecus = []  # per car [(ecu, addr, sub_addr), set of versions, required]
+
+    for i, (candidate, fws) in enumerate(fw_versions.items()):
+      bit = 1 << i
+      ecus = []
+      for ecu, expected_versions in fws.items():
+        required = ecu[0] in ESSENTIAL_ECUS and candidate not in OPTIONAL_ECUS.get(ecu[0], ())
+        self.ecu_cars[ecu] = self.ecu_cars.get(ecu, 0) | bit
+        if required:
+          self.required_cars[ecu] = self.required_cars.get(ecu, 0) | bit
+        for version in expected_versions:
+          self.version_cars[ecu + (version,)] = self.version_cars.get(ecu + (version,), 0) | bit
+        ecus.append((ecu, set(expected_versions), required))
+      self.car_ecus.append(ecus)
+
+  def names(self, mask):
+    return [c for i, c in enumerate(self.cars) if mask >> i & 1]
+
+  def match(self, fw_versions_dict):
+    """Returns the mask of cars that match every ECU in fw_versions_dict"""
+    invalid = 0
+    for ecu, cars in self.ecu_cars.items():
+      found_version = fw_versions_dict.get(ecu[1:])
+      if found_version is None:
+        invalid |= self.required_cars.get(ecu, 0)
+      else:
+        invalid |= cars & ~self.version_cars.get(ecu + (found_version,), 0)
+    return self.all_mask & ~invalid
+
+  def scores(self, fw_versions_dict):
+    """Returns {car: (matched, checked)}, where checked counts the ECUs of the car
+    that answered or are required and matched the ones with a known version.
+    A car matches exactly when both are equal."""
+    ret = {}
+    for candidate, ecus in zip(self.cars, self.car_ecus):
+      matched, checked = 0, 0
+      for ecu, expected_versions, required in ecus:
+        found_version = fw_versions_dict.get(ecu[1:])
+        if found_version is None:
+          checked += required
+        else:
+          checked += 1
+          matched += found_version in expected_versions
+      ret[candidate] = (matched, checked)
+    return ret
 
 
-def match_fw_to_car(fw_versions):
-  candidates = FW_VERSIONS
-  invalid = []
+_fw_version_index = None
+
+
+def get_fw_version_index():
+  global _fw_version_index
+  if _fw_version_index is None:
+    _fw_version_index = FwVersionIndex(FW_VERSIONS)
+  return _fw_version_index
+
 
+def build_fw_dict(fw_versions):
   fw_versions_dict = {}
   for fw in fw_versions:
     addr = fw.address
     sub_addr = fw.subAddress if fw.subAddress != 0 else None
     fw_versions_dict[(addr, sub_addr)] = fw.fwVersion
+  return fw_versions_dict
 
-  for candidate, fws in candidates.items():
-    for ecu, expected_versions in fws.items():
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-      found_version = fw_versions_dict.get(addr, None)
-      ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa, Ecu.electricBrakeBooster]
-      if ecu_type == Ecu.esp and candidate in [TOYOTA.RAV4, TOYOTA.COROLLA, TOYOTA.HIGHLANDER] and found_version is None:
-        continue
 
-      # TODO: COROLLA_TSS2 engine can show on two different addresses
-      if ecu_type == Ecu.engine and candidate in [TOYOTA.COROLLA_TSS2, TOYOTA.CHR] and found_version is None:
-        continue
-
-      # ignore non essential ecus
-      if ecu_type not in ESSENTIAL_ECUS and found_version is None:
-        continue
+def match_fw_to_car(fw_versions):
+  index = get_fw_version_index()
+  return set(index.names(index.match(build_fw_dict(fw_versions))))
 
-      if found_version not in expected_versions:
-        invalid.append(candidate)
-        break
 
-  return set(candidates.keys()) - set(invalid)
+def match_fw_to_car_scores(fw_versions):
+  """Like match_fw_to_car, but also reports partial matches as {car: (matched, checked)}"""
+  return get_fw_version_index().scores(build_fw_dict(fw_versions))
 
 
-def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False, progress=False):
+def add_fw_queries(query, extra=None, timeout=0.1):
+  """Queues the version requests of every brand on an IsoTpParallelQuery.
+     Returns the indices of the results and a dict of (addr, sub_addr) -> ecu type."""
   ecu_types = {}
 
   # Extract ECU adresses to query from fingerprints
-  # ECUs using a subadress need be queried one by one, the rest can be done in parallel
-  addrs = []
+  # ECUs using a subadress share their rx address, the query runs them one by one
   parallel_addrs = []
+  sub_addrs = []
 
   versions = get_attr_from_cars('FW_VERSIONS', combine_brands=False)
   if extra is not None:
@@ -165,26 +223,25 @@ def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False,
           if a not in parallel_addrs:
             parallel_addrs.append(a)
         else:
-          if [a] not in addrs:
-            addrs.append([a])
+          if a not in sub_addrs:
+            sub_addrs.append(a)
+
+  query_idxs = []
+  for addrs, t in [(parallel_addrs, 2 * timeout), (sub_addrs, timeout)]:
+    for brand, request, response in REQUESTS:
+      brand_addrs = [(a, s) for (b, a, s) in addrs if b in (brand, 'any')]
+      if brand_addrs:
+        query_idxs.append(query.add_query(brand_addrs, request, response, timeout=t))
+
+  return query_idxs, ecu_types
 
-  addrs.insert(0, parallel_addrs)
 
+def build_car_fw(results, ecu_types):
+  """Build capnp list to put into CarParams"""
   fw_versions = {}
-  for i, addr in enumerate(tqdm(addrs, disable=not progress)):
-    for addr_chunk in chunks(addr):
-      for brand, request, response in REQUESTS:
-        try:
-          addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any')]
-
-          if addrs:
-            query = IsoTpParallelQuery(sendcan, logcan, bus, addrs, request, response, debug=debug)
-            t = 2 * timeout if i == 0 else timeout
-            fw_versions.update(query.get_data(t))
-        except Exception:
-          cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
-
-  # Build capnp list to put into CarParams
+  for r in results:
+    fw_versions.update(r)
+
   car_fw = []
   for addr, version in fw_versions.items():
     f = car.CarParams.CarFw.new_message()
@@ -201,11 +258,44 @@ def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False,
   return car_fw
 
 
+def _run_query(query, timeout, progress):
+  with tqdm(total=sum(len(q[0]) for q in query.queries), disable=not progress) as pbar:
+    try:
+      query.get_all_data(timeout, request_done=pbar.update)
+    except Exception:
+      cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
+  # on an exception the responses so far are still used
+  return query.results
+
+
+def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False, progress=False):
+  query = IsoTpParallelQuery(sendcan, logcan, bus, debug=debug)
+  query_idxs, ecu_types = add_fw_queries(query, extra, timeout)
+  results = _run_query(query, timeout, progress)
+  return build_car_fw([results[i] for i in query_idxs], ecu_types)
+
+
+def get_vin_and_fw_versions(logcan, sendcan, bus, timeout=0.1, debug=False, progress=False):
+  """Runs the VIN query alongside the FW queries, so both take a single query window.
+     Returns the VIN and the capnp list of FW versions."""
+  query = IsoTpParallelQuery(sendcan, logcan, bus, debug=debug)
+  vin_idx = add_vin_query(query)
+  query_idxs, ecu_types = add_fw_queries(query, timeout=timeout)
+  results = _run_query(query, timeout, progress)
+
+  vin = vin_from_results(results[vin_idx])
+  if vin is None:
+    # fall back to the retries of the plain VIN query
+    vin = get_vin(logcan, sendcan, bus, timeout=timeout, debug=debug)
+
+  car_fw = build_car_fw([results[i] for i in query_idxs], ecu_types)
+  return vin[1], car_fw
+
+
 if __name__ == "__main__":
   import time
   import argparse
   import cereal.messaging as messaging
-  from selfdrive.car.vin import get_vin
 
   parser = argparse.ArgumentParser(description='Get firmware version of ECUs')
   parser.add_argument('--scan', action='store_true')
@@ -1,129 +1,234 @@
 import time
-from collections import defaultdict
-from functools import partial
+from collections import deque
 
 import cereal.messaging as messaging
 from selfdrive.swaglog import cloudlog
 from selfdrive.boardd.boardd import can_list_to_can_capnp
 from panda.python.uds import CanClient, IsoTpMessage, FUNCTIONAL_ADDRS, get_rx_addr_for_tx_addr
 
+# most requests that are in flight at the same time, the rest wait for a free slot
+MAX_PARALLEL_ADDRS = 128
+
+
+def is_functional_rx_addr(addr):
+  return (0x7E8 <= addr <= 0x7EF) or (0x18DAF100 <= addr <= 0x18DAF1FF)
+
+
+class _IsoTpRequest():
+  """State of one query on one tx address: which request of the sequence is
+  out, the frames received for it and when to give up."""
+  __slots__ = ('tx_addr', 'rx_id', 'query_idx', 'counter', 'deadline', 'start_time', 'buffer', 'msg')
+
+  def __init__(self, tx_addr, rx_id, query_idx, deadline, start_time):
+    self.tx_addr = tx_addr
+    self.rx_id = rx_id
+    self.query_idx = query_idx
+    self.counter = 0
+    self.deadline = deadline
+    self.start_time = start_time
+    self.buffer = []
+    self.msg = None
+
+  def can_rx(self):
+    msgs, self.buffer = self.buffer, []
+    return msgs
+
 
 class IsoTpParallelQuery():
-  def __init__(self, sendcan, logcan, bus, addrs, request, response, functional_addr=False, debug=False):
+  """Sends requests to many ECUs at once and collects their responses.
+
+  More queries can be added with add_query, they all share one receive loop. Every
+  tx address and sub address works through the queries it's part of in order, with
+  its own timeout per request, while different tx addresses run concurrently. The sub
+  addresses of one tx address take turns. Physical addresses that
+  answer in the range of the functional addresses wait until the functional
+  queries are done, so responses are never ambiguous.
+
+  The loop sleeps on the can socket until a frame arrives or the next request
+  times out, and only steps the requests that received frames. It's done as soon
+  as every address answered or timed out.
+  """
+  def __init__(self, sendcan, logcan, bus, addrs=None, request=None, response=None, functional_addr=False, debug=False):
     self.sendcan = sendcan
     self.logcan = logcan
     self.bus = bus
-    self.request = request
-    self.response = response
     self.debug = debug
-    self.functional_addr = functional_addr
-
-    self.real_addrs = []
-    for a in addrs:
-      if isinstance(a, tuple):
-        self.real_addrs.append(a)
+    self.poller = None
+
+    self.queries = []
+    self.results = []
+    self.response_times = {}
+    self.msg_addrs = {}
+    self.functional_active = False
+    # (rx address or functional tx address, sub address) -> request
+    self.active_rx = {}
+
+    if addrs is not None:
+      self.add_query(addrs, request, response, functional_addr)
+
+  def add_query(self, addrs, request, response, functional_addr=False, timeout=None):
+    """Queues request for addrs, returns the index of its results in get_all_data"""
+    real_addrs = [a if isinstance(a, tuple) else (a, None) for a in addrs]
+    for tx_addr in real_addrs:
+      self.msg_addrs[tx_addr] = get_rx_addr_for_tx_addr(tx_addr[0])
+
+    # functional addresses have no rx address, which is how they're told apart
+    self.queries.append((real_addrs, request, response, timeout))
+    self.results.append({})
+    return len(self.queries) - 1
+
+  def _recv_can(self, timeout):
+    """Waits up to timeout seconds for can packets, returns their (address, busTime, dat, src) tuples"""
+    if self.poller is None:
+      self.poller = messaging.Poller()
+      self.poller.registerSocket(self.logcan)
+
+    if timeout > 0 and not self.poller.poll(max(1, int(timeout * 1000))):
+      return []
+    return [(msg.address, msg.busTime, msg.dat, msg.src) for packet in messaging.drain_sock(self.logcan) for msg in packet.can]
+
+  def rx(self, timeout):
+    """Sorts the frames received within timeout into the requests waiting for them,
+    returns the requests that got any"""
+    updated = set()
+    for m in self._recv_can(timeout):
+      addr = m[0]
+      if m[3] != self.bus:
+        continue
+
+      if self.functional_active and is_functional_rx_addr(addr):
+        rx_id = next(a for a in FUNCTIONAL_ADDRS if addr - a <= 32)
       else:
-        self.real_addrs.append((a, None))
-
-    self.msg_addrs = {tx_addr: get_rx_addr_for_tx_addr(tx_addr[0]) for tx_addr in self.real_addrs}
-    self.msg_buffer = defaultdict(list)
-
-  def rx(self):
-    """Drain can socket and sort messages into buffers based on address"""
-    can_packets = messaging.drain_sock(self.logcan, wait_for_one=True)
+        rx_id = addr
 
-    for packet in can_packets:
-      for msg in packet.can:
-        if msg.src == self.bus:
-          if self.functional_addr:
-            if (0x7E8 <= msg.address <= 0x7EF) or (0x18DAF100 <= msg.address <= 0x18DAF1FF):
-              fn_addr = next(a for a in FUNCTIONAL_ADDRS if msg.address - a <= 32)
-              self.msg_buffer[fn_addr].append((msg.address, msg.busTime, msg.dat, msg.src))
-          elif msg.address in self.msg_addrs.values():
-            self.msg_buffer[msg.address].append((msg.address, msg.busTime, msg.dat, msg.src))
+      # sub addressed ECUs share the rx address, the first byte tells them apart
+      req = self.active_rx.get((rx_id, m[2][0] if len(m[2]) > 0 else None)) or self.active_rx.get((rx_id, None))
+      if req is not None:
+        req.buffer.append(m)
+        updated.add(req)
+    return updated
 
   def _can_tx(self, tx_addr, dat, bus):
     """Helper function to send single message"""
     msg = [tx_addr, 0, dat, bus]
     self.sendcan.send(can_list_to_can_capnp([msg], msgtype='sendcan'))
 
-  def _can_rx(self, addr, sub_addr=None):
-    """Helper function to retrieve message with specified address and subadress from buffer"""
-    keep_msgs = []
-
-    if sub_addr is None:
-      msgs = self.msg_buffer[addr]
-    else:
-      # Filter based on subadress
-      msgs = []
-      for m in self.msg_buffer[addr]:
-        first_byte = m[2][0]
-        if first_byte == sub_addr:
-          msgs.append(m)
-        else:
-          keep_msgs.append(m)
-
-    self.msg_buffer[addr] = keep_msgs
-    return msgs
-
   def _drain_rx(self):
-    messaging.drain_sock(self.logcan)
-    self.msg_buffer = defaultdict(list)
+    self._recv_can(0)
+    self.active_rx = {}
+
+  def _is_functional(self, tx_addr):
+    return self.msg_addrs[tx_addr] is None
+
+  def _blocked(self, tx_addr, active, functional_left):
+    """Functional and physical requests that answer on the same rx addresses can't run at the same time,
+    neither can requests with and without a sub address on the same rx address. ECUs using a sub
+    address are behind a gateway that can't interleave iso-tp sessions, they're queried one by one"""
+    if tx_addr[1] is not None and any(r.tx_addr[0] == tx_addr[0] and r.tx_addr[1] is not None for r in active.values()):
+      return True
+
+    rx_id = self.msg_addrs[tx_addr] or tx_addr[0]
+    if any(r.rx_id == rx_id and (r.tx_addr[1] is None) != (tx_addr[1] is None) for r in active.values()):
+      return True
+
+    if self._is_functional(tx_addr):
+      return any(not self._is_functional(r.tx_addr) and is_functional_rx_addr(r.rx_id) for r in active.values())
+    return functional_left > 0 and is_functional_rx_addr(self.msg_addrs[tx_addr])
+
+  def _start_request(self, tx_addr, query_idx, timeout):
+    """Sends the first frame of a query to tx_addr, returns the request state"""
+    rx_addr = self.msg_addrs[tx_addr]
+    # rx_addr not set when using functional tx addr
+    id_addr = rx_addr or tx_addr[0]
+    sub_addr = tx_addr[1]
+    _, request, _, query_timeout = self.queries[query_idx]
+
+    now = time.monotonic()
+    req = _IsoTpRequest(tx_addr, id_addr, query_idx, now + (query_timeout if query_timeout is not None else timeout), now)
+    self.active_rx[(id_addr, sub_addr)] = req
+
+    can_client = CanClient(self._can_tx, req.can_rx, tx_addr[0], rx_addr, self.bus, sub_addr=sub_addr, debug=self.debug)
+
+    max_len = 8 if sub_addr is None else 7
+
+    req.msg = IsoTpMessage(can_client, timeout=0, max_len=max_len, debug=self.debug)
+    req.msg.send(request[0])
+    return req
+
+  def _step(self, req):
+    """Feeds the received frames to the request, returns True when it's done"""
+    dat = req.msg.recv()
+    if not dat:
+      return False
+
+    _, request, response, _ = self.queries[req.query_idx]
+    expected_response = response[req.counter]
+    if dat[:len(expected_response)] != expected_response:
+      cloudlog.warning(f"iso-tp query bad response: 0x{bytes.hex(dat)}")
+      return True
+
+    if req.counter + 1 < len(request):
+      req.counter += 1
+      req.msg.send(request[req.counter])
+      return False
+
+    self.results[req.query_idx][req.tx_addr] = dat[len(expected_response):]
+    self.response_times[(req.query_idx, req.tx_addr)] = time.monotonic() - req.start_time
+    return True
 
   def get_data(self, timeout):
-    self._drain_rx()
-
-    # Create message objects
-    msgs = {}
-    request_counter = {}
-    request_done = {}
-    for tx_addr, rx_addr in self.msg_addrs.items():
-      # rx_addr not set when using functional tx addr
-      id_addr = rx_addr or tx_addr[0]
-      sub_addr = tx_addr[1]
-
-      can_client = CanClient(self._can_tx, partial(self._can_rx, id_addr, sub_addr=sub_addr), tx_addr[0], rx_addr,
-                             self.bus, sub_addr=sub_addr, debug=self.debug)
+    return self.get_all_data(timeout)[0]
 
-      max_len = 8 if sub_addr is None else 7
+  def get_all_data(self, timeout, request_done=None):
+    """Runs all queries, returns a dict of {tx_addr: data} per query.
 
-      msg = IsoTpMessage(can_client, timeout=0, max_len=max_len, debug=self.debug)
-      msg.send(self.request[0])
+    timeout applies per request and address, unless the query set its own.
+    request_done is called every time an address finished a request."""
+    self._drain_rx()
+    self.results = [{} for _ in self.queries]
+    self.response_times = {}
 
-      msgs[tx_addr] = msg
-      request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
+    # every (tx address, sub address) gets the queries it's part of in order
+    pending = {}
+    for query_idx, (real_addrs, _, _, _) in enumerate(self.queries):
+      for tx_addr in real_addrs:
+        pending.setdefault(tx_addr, deque()).append((tx_addr, query_idx))
+    functional_left = sum(1 for steps in pending.values() for tx_addr, _ in steps if self._is_functional(tx_addr))
 
-    results = {}
-    start_time = time.time()
+    active = {}  # (tx address, sub address) -> request
     while True:
-      self.rx()
-
-      if all(request_done.values()):
+      # start the next request on every address that's free
+      if pending and len(active) < MAX_PARALLEL_ADDRS:
+        for addr, steps in list(pending.items()):
+          tx_addr, query_idx = steps[0]
+          if addr in active or self._blocked(tx_addr, active, functional_left):
+            continue
+
+          steps.popleft()
+          if not steps:
+            del pending[addr]
+          active[addr] = self._start_request(tx_addr, query_idx, timeout)
+          if len(active) >= MAX_PARALLEL_ADDRS:
+            break
+        self.functional_active = any(self._is_functional(r.tx_addr) for r in active.values())
+
+      if not active:
         break
 
-      for tx_addr, msg in msgs.items():
-        dat = msg.recv()
-
-        if not dat:
-          continue
+      next_deadline = min(r.deadline for r in active.values())
+      updated = self.rx(next_deadline - time.monotonic())
 
-        counter = request_counter[tx_addr]
-        expected_response = self.response[counter]
-        response_valid = dat[:len(expected_response)] == expected_response
+      done = [req for req in updated if self._step(req)]
+      now = time.monotonic()
+      if now >= next_deadline:
+        done += [req for req in active.values() if req.deadline <= now and req not in updated]
 
-        if response_valid:
-          if counter + 1 < len(self.request):
-            msg.send(self.request[counter + 1])
-            request_counter[tx_addr] += 1
-          else:
-            results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
-        else:
-          request_done[tx_addr] = True
-          cloudlog.warning(f"iso-tp query bad response: 0x{bytes.hex(dat)}")
-
-      if time.time() - start_time > timeout:
-        break
+      for req in done:
+        del active[req.tx_addr]
+        del self.active_rx[(req.rx_id, req.tx_addr[1])]
+        if self._is_functional(req.tx_addr):
+          functional_left -= 1
+        if request_done is not None:
+          request_done()
 
-    return results
+    return self.results
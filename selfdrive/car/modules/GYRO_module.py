@@ -1,6 +1,5 @@
 from cereal.services import service_list
 from collections import deque
-import cereal.messaging as messaging
 import cereal
 import math
 from common.realtime import sec_since_boot
@@ -20,8 +19,9 @@ S2NS = 1e9
 EPSILON = 0.0000001
 
 class GYROController:
-  def __init__(self):
-    self.sensorEvents = messaging.sub_sock('sensorEvents', conflate=True)
+  def __init__(self, messages):
+    # reader of sensorEvents
+    self.messages = messages
     self.roll = 0.
     self.pitch = 0.01
     self.yaw = 9.8
@@ -103,7 +103,7 @@ class GYROController:
       d = str_angl / abs(str_angl)
       r = wb / math.sqrt(2-2*math.cos(2*str_angl/str_ratio))
       lat_a = d * v * v /  r
-    se_list = messaging.recv_sock(self.sensorEvents,wait=False)
+    se_list = self.messages.recv('sensorEvents')
     if se_list is not None:
         for se in se_list.sensorEvents:
             if se.which == cereal_SensorEventData_acceleration:
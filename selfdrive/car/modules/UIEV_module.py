@@ -10,7 +10,6 @@ class UIEvents():
         self.uiSetCar = messaging.pub_sock('uiSetCar')
         self.uiPlaySound = messaging.pub_sock('uiPlaySound')
         self.uiGyroInfo = messaging.pub_sock('uiGyroInfo')
-        self.uiButtonStatus = messaging.sub_sock('uiButtonStatus', conflate=True)
         self.prev_cstm_message = ""
         self.prev_cstm_status = -1
 
@@ -85,11 +84,8 @@ class UIEvents():
         self.prev_cstm_message = message
         self.prev_cstm_status = status
 
-    def update_custom_ui(self):
-        btn_message = None
-        btn_messageMsg = self.uiButtonStatus.receive(non_blocking=True)
-        if btn_messageMsg is not None:
-            btn_message = ui.UIButtonStatus.from_bytes(btn_messageMsg)
+    def update_custom_ui(self, btn_message=None):
+        # btn_message is a new UIButtonStatus, if there is one
         if btn_message is not None:
             btn_id = btn_message.btnId
             self.CS.cstm_btns.set_button_status_from_ui(btn_id,btn_message.btnStatus)
@@ -1,7 +1,6 @@
 from selfdrive.car.tesla.speed_utils.fleet_speed import FleetSpeed
 from selfdrive.car.tesla.values import CruiseButtons, CruiseState
 from selfdrive.config import Conversions as CV
-import cereal.messaging as messaging
 import sys
 import time
 
@@ -69,7 +68,7 @@ class ACCController:
         self.CC = carcontroller
         self.human_cruise_action_time = 0
         self.automated_cruise_action_time = 0
-        self.radarState = messaging.sub_sock("radarState", conflate=True)
+        self.messages = carcontroller.intake.reader()
         self.last_update_time = 0
         self.enable_adaptive_cruise = False
         self.prev_enable_adaptive_cruise = False
@@ -288,7 +287,7 @@ class ACCController:
             button_to_press = CruiseButtons.CANCEL
         lead_1 = None
         # if enabled:
-        lead = messaging.recv_one_or_none(self.radarState)
+        lead = self.messages.recv("radarState")
         if lead is not None:
             lead_1 = lead.radarState.leadOne
             if lead_1.dRel:
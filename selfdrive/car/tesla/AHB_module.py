@@ -1,6 +1,5 @@
 from selfdrive.config import Conversions as CV
-from cereal import tesla, log
-import cereal.messaging as messaging
+from cereal import log
 import time
 
 DEBUG = False
@@ -41,10 +40,9 @@ class AHBController:
         self.prev_light_stalk_position = 0
         self.prev_high_beam_on = False
         self.prev_lights_on = False
-        self.ahbInfo = messaging.sub_sock("ahbInfo", conflate=True)
+        self.messages = carcontroller.intake.reader()
         self.ahbInfoData = None
         self.ahbIsEnabled = False
-        self.frameInfo = messaging.sub_sock("frame", conflate=True)
         self.frameInfoData = None
         self.frameInfoGain = 0
 
@@ -63,15 +61,15 @@ class AHBController:
 
     def update(self, CS, frame, ahbLead1):
         tms_now = _current_time_millis()
-        ahbInfoMsg = self.ahbInfo.receive(non_blocking=True)
-        frameInfoMsg = messaging.recv_one_or_none(self.frameInfo)
+        ahbInfoMsg = self.messages.recv("ahbInfo")
+        frameInfoMsg = self.messages.recv("frame")
         if ahbInfoMsg is not None:
-            self.ahbInfoData = tesla.AHBinfo.from_bytes(ahbInfoMsg)
+            self.ahbInfoData = ahbInfoMsg
         if frameInfoMsg is not None:
-            self.frameInfoData = frameInfoMsg.frame
+            self.frameInfoData = frameInfoMsg
             frameInfoGain = self.frameInfoData.globalGain
-            exposureTime = self.frameInfoData.androidCaptureResult.exposureTime
-            frameDuration = self.frameInfoData.androidCaptureResult.frameDuration
+            exposureTime = self.frameInfoData.exposureTime
+            frameDuration = self.frameInfoData.frameDuration
             if frameInfoGain != self.frameInfoGain:
                 self.frameInfoGain = frameInfoGain
             _debug(
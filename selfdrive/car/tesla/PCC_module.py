@@ -10,7 +10,6 @@ from selfdrive.controls.lib.planner import (
     calc_cruise_accel_limits,
     limit_accel_in_turns,
 )
-import cereal.messaging as messaging
 import time
 import math
 from collections import OrderedDict
@@ -141,8 +140,7 @@ class PCCController:
         self.accelerator_pedal_pressed = self.prev_accelerator_pedal_pressed = False
         self.automated_cruise_action_time = 0
         self.last_angle = 0.0
-        self.radarState = messaging.sub_sock("radarState", conflate=True)
-        self.live_map_data = messaging.sub_sock("liveMapData", conflate=True)
+        self.messages = carcontroller.intake.reader()
         self.lead_1 = None
         self.last_update_time = 0
         self.enable_pedal_cruise = False
@@ -417,8 +415,8 @@ class PCCController:
         # Alternative speed decision logic that uses the lead car's distance
         # and speed more directly.
         # Bring in the lead car distance from the radarState feed
-        radSt = messaging.recv_one_or_none(self.radarState)
-        mapd = messaging.recv_one_or_none(self.live_map_data)
+        radSt = self.messages.recv("radarState")
+        mapd = self.messages.recv("liveMapData")
         if radSt is not None:
             self.lead_1 = radSt.radarState.leadOne
             if _is_present(self.lead_1):
@@ -1,6 +1,7 @@
 import datetime
-from cereal import log, tesla
+from cereal import log
 from common.params import Params
+from common.profiler import latency_profiler
 from collections import namedtuple
 from common.numpy_fast import clip, interp
 from common import realtime
@@ -17,6 +18,7 @@ from selfdrive.car.tesla.PCC_module import PCCController
 from selfdrive.car.tesla.HSO_module import HSOController
 from selfdrive.car.tesla.speed_utils.movingaverage import MovingAverage
 from selfdrive.car.tesla.AHB_module import AHBController
+from selfdrive.car.tesla.intake import MessageIntake
 import cereal.messaging as messaging
 
 # Steer angle limits
@@ -107,6 +109,9 @@ class CarController:
         self.epas_disabled = True
         self.last_angle = 0.0
         self.last_accel = 0.0
+        # the messages of all the modules, received once per iteration
+        self.intake = MessageIntake()
+        self.messages = self.intake.reader()
         self.blinker = Blinker()
         self.ALCA = ALCAController(
             self, True, True
@@ -114,16 +119,10 @@ class CarController:
         self.ACC = ACCController(self)
         self.PCC = PCCController(self)
         self.HSO = HSOController(self)
-        self.GYRO = GYROController()
+        self.GYRO = GYROController(self.intake.reader())
         self.AHB = AHBController(self)
+        self.prof = latency_profiler("tesla_carcontroller")
         self.sent_DAS_bootID = False
-        self.speedlimit = None
-        self.trafficevents = messaging.sub_sock("trafficEvents", conflate=True)
-        self.pathPlan = messaging.sub_sock("pathPlan", conflate=True)
-        self.radarState = messaging.sub_sock("radarState", conflate=True)
-        self.icLeads = messaging.sub_sock("uiIcLeads", conflate=True)
-        self.icCarLR = messaging.sub_sock("uiIcCarLR", conflate=True)
-        self.alcaState = messaging.sub_sock("alcaState", conflate=True)
         self.gpsLocationExternal = None
         self.opState = 0  # 0-disabled, 1-enabled, 2-disabling, 3-unavailable, 5-warning
         self.accPitch = 0.0
@@ -274,6 +273,8 @@ class CarController:
         leftLaneVisible,
         rightLaneVisible,
     ):
+        self.prof.start()
+        self.intake.update()
         if frame % 33 == 0:
           print("\t\tactuators.steerAngle: {:.1f} actuators.steer: {:.1f}".format(actuators.steerAngle, actuators.steer))
 
@@ -306,10 +307,6 @@ class CarController:
                 CS.cstm_btns.set_button_status("dsp", 1)
         # """ Controls thread """
 
-        if not CS.useTeslaMapData:
-            if self.speedlimit is None:
-                self.speedlimit = messaging.sub_sock("liveMapData", conflate=True)
-
         # *** no output if not enabled ***
         if not enabled and CS.pcm_acc_status:
             # send pcm acc cancel cmd if drive is disabled but pcm is still on, or if the system can't be activated
@@ -363,7 +360,7 @@ class CarController:
         vehicle_moving = CS.v_ego >= MIN_STEERING_VEHICLE_VELOCITY
 
         # upodate custom UI buttons and alerts
-        CS.UE.update_custom_ui()
+        CS.UE.update_custom_ui(self.messages.recv("uiButtonStatus"))
 
         if frame % 100 == 0:
             CS.cstm_btns.send_button_info()
@@ -417,7 +414,9 @@ class CarController:
                 )
             )
 
+        self.prof.checkpoint("messages")
         self.blinker.update_state(CS, frame)
+        self.prof.checkpoint("blinker")
 
         # update PCC module info
         pedal_can_sends = self.PCC.update_stat(CS, frame)
@@ -427,6 +426,7 @@ class CarController:
             # Update ACC module info.
             self.ACC.update_stat(CS, True)
             self.PCC.enable_pedal_cruise = False
+        self.prof.checkpoint("cruise_stat")
 
         # update CS.v_cruise_pcm based on module selected.
         speed_uom_kph = 1.0
@@ -441,10 +441,12 @@ class CarController:
         self.alca_enabled = self.ALCA.update(
             enabled, CS, actuators, self.alcaStateData, frame, self.blinker
         )
+        self.prof.checkpoint("alca")
         self.should_ldw = self._should_ldw(CS, frame)
         apply_angle = -actuators.steerAngle  # Tesla is reversed vs OP.
         # Update HSO module info.
         human_control = self.HSO.update_stat(self, CS, enabled, actuators, frame)
+        self.prof.checkpoint("hso")
         human_lane_changing = CS.turn_signal_stalk_state > 0 and not self.alca_enabled
         enable_steer_control = (
             enabled and not human_lane_changing and not human_control and vehicle_moving
@@ -499,24 +501,20 @@ class CarController:
         # TODO: forward collision warning
 
         if frame % 10 == 0:
-            speedlimitMsg = None
-            if self.speedlimit is not None:
-                speedlimitMsg = messaging.recv_one_or_none(self.speedlimit)
-            icLeadsMsg = self.icLeads.receive(non_blocking=True)
-            radarStateMsg = messaging.recv_one_or_none(self.radarState)
-            alcaStateMsg = self.alcaState.receive(non_blocking=True)
-            pathPlanMsg = messaging.recv_one_or_none(self.pathPlan)
-            icCarLRMsg = self.icCarLR.receive(non_blocking=True)
-            trafficeventsMsgs = None
-            if self.trafficevents is not None:
-                trafficeventsMsgs = messaging.recv_sock(self.trafficevents)
+            speedlimitMsg = self.messages.recv("liveMapData")
+            icLeadsMsg = self.messages.recv("uiIcLeads")
+            radarStateMsg = self.messages.recv("radarState")
+            alcaStateMsg = self.messages.recv("alcaState")
+            pathPlanMsg = self.messages.recv("pathPlan")
+            icCarLRMsg = self.messages.recv("uiIcCarLR")
+            trafficeventsMsgs = self.messages.recv("trafficEvents")
             if CS.hasTeslaIcIntegration:
                 self.speed_limit_ms = CS.speed_limit_ms
             if (speedlimitMsg is not None) and not CS.useTeslaMapData:
                 lmd = speedlimitMsg.liveMapData
                 self.speed_limit_ms = lmd.speedLimit if lmd.speedLimitValid else 0
             if icLeadsMsg is not None:
-                self.icLeadsData = tesla.ICLeads.from_bytes(icLeadsMsg)
+                self.icLeadsData = icLeadsMsg
             if radarStateMsg is not None:
                 # to show lead car on IC
                 if self.icLeadsData is not None:
@@ -525,7 +523,7 @@ class CarController:
                     )
                     can_sends.extend(can_messages)
             if alcaStateMsg is not None:
-                self.alcaStateData = tesla.ALCAState.from_bytes(alcaStateMsg)
+                self.alcaStateData = alcaStateMsg
             if pathPlanMsg is not None:
                 # to show curvature and lanes on IC
                 if self.alcaStateData is not None:
@@ -534,7 +532,7 @@ class CarController:
                     )
             if icCarLRMsg is not None:
                 can_messages = self.showLeftAndRightCarsOnICCanMessages(
-                    icCarLRMsg=tesla.ICCarsLR.from_bytes(icCarLRMsg)
+                    icCarLRMsg=icCarLRMsg
                 )
                 can_sends.extend(can_messages)
             if trafficeventsMsgs is not None:
@@ -671,10 +669,12 @@ class CarController:
             self.DAS_221_lcAborting = 1
             self.warningCounter = 300
             self.warningNeeded = 1
+        self.prof.checkpoint("steering")
         if CS.hasTeslaIcIntegration:
             highLowBeamStatus, highLowBeamReason, ahbIsEnabled = self.AHB.update(
                 CS, frame, self.ahbLead1
             )
+            self.prof.checkpoint("ahb")
             if frame % 5 == 0:
                 self.cc_counter = (
                     self.cc_counter + 1
@@ -778,6 +778,7 @@ class CarController:
         # send enabled ethernet every 0.2 sec
         if frame % 20 == 0:
             can_sends.append(teslacan.create_enabled_eth_msg(1))
+        self.prof.checkpoint("das")
         if (not self.PCC.pcc_available) and frame % 5 == 0:  # acc processed at 20Hz
             cruise_btn = self.ACC.update_acc(
                 enabled,
@@ -797,6 +798,7 @@ class CarController:
                 )
                 # Send this CAN msg first because it is racing against the real stalk.
                 can_sends.insert(0, cruise_msg)
+        self.prof.checkpoint("acc")
         apply_accel = 0.0
         if self.PCC.pcc_available and frame % 5 == 0:  # pedal processed at 20Hz
             pedalcan = 2
@@ -821,6 +823,8 @@ class CarController:
             )
         self.last_angle = apply_angle
         self.last_accel = apply_accel
+        self.prof.checkpoint("pcc")
+        self.prof.end()
 
         return pedal_can_sends + can_sends
 
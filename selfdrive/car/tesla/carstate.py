@@ -10,7 +10,104 @@ from selfdrive.car.tesla.readconfig import read_config_file
 from selfdrive.car.interfaces import CarStateBase
 import os
 import subprocess
-from common.params import Params
+from common.params import Params, put_nonblocking
+
+# CarState attribute, message, signal of the signals that are copied as they are. The
+# SignalMap copies the signals of a message only when it was received since the last
+# update, the signals that need more than a copy are read in CarState.update
+PT_SIGNAL_MAP = [
+    ("real_dasHw", "GTW_carConfig", "GTW_dasHw"),
+    ("cruise_buttons", "STW_ACTN_RQ", "SpdCtrlLvr_Stat"),
+    # Nav Map Data
+    ("csaRoadCurvC3", "UI_csaRoadCurvature", "UI_csaRoadCurvC3"),
+    ("csaRoadCurvC2", "UI_csaRoadCurvature", "UI_csaRoadCurvC2"),
+    ("csaRoadCurvRange", "UI_csaRoadCurvature", "UI_csaRoadCurvRange"),
+    ("csaRoadCurvUsingTspline", "UI_csaRoadCurvature", "UI_csaRoadCurvUsingTspline"),
+    ("csaOfframpCurvC3", "UI_csaOfframpCurvature", "UI_csaOfframpCurvC3"),
+    ("csaOfframpCurvC2", "UI_csaOfframpCurvature", "UI_csaOfframpCurvC2"),
+    ("csaOfframpCurvRange", "UI_csaOfframpCurvature", "UI_csaOfframpCurvRange"),
+    ("csaOfframpCurvUsingTspline", "UI_csaOfframpCurvature", "UI_csaOfframpCurvUsingTspline"),
+    ("roadCurvHealth", "UI_roadCurvature", "UI_roadCurvHealth"),
+    ("roadCurvRange", "UI_roadCurvature", "UI_roadCurvRange"),
+    ("roadCurvC0", "UI_roadCurvature", "UI_roadCurvC0"),
+    ("roadCurvC1", "UI_roadCurvature", "UI_roadCurvC1"),
+    ("roadCurvC2", "UI_roadCurvature", "UI_roadCurvC2"),
+    ("roadCurvC3", "UI_roadCurvature", "UI_roadCurvC3"),
+    ("gpsLongitude", "MCU_locationStatus", "MCU_longitude"),
+    ("gpsLatitude", "MCU_locationStatus", "MCU_latitude"),
+    ("gpsAccuracy", "MCU_locationStatus", "MCU_gpsAccuracy"),
+    ("gpsElevation", "MCU_locationStatus2", "MCU_elevation"),
+    ("gpsHeading", "UI_gpsVehicleSpeed", "UI_gpsVehicleHeading"),
+    ("turn_signal_state_left", "GTW_carState", "BC_indicatorLStatus"),
+    ("turn_signal_state_right", "GTW_carState", "BC_indicatorRStatus"),
+    ("brake_switch", "DI_torque2", "DI_brakePedal"),
+    ("brake_pressed", "DI_torque2", "DI_brakePedal"),
+    ("torqueMotor", "DI_torque1", "DI_torqueMotor"),
+    ("pcm_acc_status", "DI_state", "DI_cruiseState"),
+]
+
+# on the EPAS bus with the A pillar harness
+SEATBELT_SIGNAL_MAP = [
+    ("seatbelt", "SDM1", "SDM_bcklDrivStatus"),
+]
+
+PEDAL_SIGNAL_MAP = [
+    ("pedal_interceptor_state", "GAS_SENSOR", "STATE"),
+    ("pedal_interceptor_value", "GAS_SENSOR", "INTERCEPTOR_GAS"),
+    ("pedal_interceptor_value2", "GAS_SENSOR", "INTERCEPTOR_GAS2"),
+    ("pedal_idx", "GAS_SENSOR", "IDX"),
+]
+
+# AHB info, only with IC integration
+AHB_SIGNAL_MAP = [
+    ("ahbHighBeamStalkPosition", "STW_ACTN_RQ", "HiBmLvr_Stat"),
+    ("ahbEnabled", "MCU_chassisControl", "MCU_ahlbEnable"),
+]
+
+# on the EPAS bus with the A pillar harness
+LIGHTS_SIGNAL_MAP = [
+    ("ahbLoBeamOn", "BODY_R1", "LoBm_On_Rq"),
+    ("ahbHiBeamOn", "BODY_R1", "HiBm_On"),
+    ("ahbNightMode", "BODY_R1", "LgtSens_Night"),
+]
+
+
+class SignalMap:
+    """Copies signals of CANParsers to attributes. The parsers keep the values and
+    timestamps of a message in dicts they update in place, so the dicts are looked up
+    once. A message is only copied when the timestamp of its first signal changed.
+    The copies are compiled into one function, a loop over the messages costs more
+    than the copies it saves."""
+
+    def __init__(self, signal_maps):
+        """signal_maps: list of (parser, signal map)"""
+        env = {"last_ts": []}
+        src = ["def update(into):"]
+        for cp, signal_map in signal_maps:
+            signals = {}
+            for attr, msg, sig in signal_map:
+                signals.setdefault(msg, []).append((attr, sig))
+            for msg, msg_signals in signals.items():
+                i = len(env["last_ts"])
+                env["last_ts"].append(None)
+                env["values_%d" % i] = cp.vl[msg]
+                env["ts_%d" % i] = cp.ts[msg]
+                src += [
+                    "    t = ts_%d[%r]" % (i, msg_signals[0][1]),
+                    "    if t != last_ts[%d]:" % i,
+                    "        last_ts[%d] = t" % i,
+                ]
+                src += [
+                    "        into.%s = values_%d[%r]" % (attr, i, sig)
+                    for attr, sig in msg_signals
+                ]
+        exec("\n".join(src), env)
+        self.last_ts = env["last_ts"]
+        self.update = env["update"]
+
+    def reset(self):
+        """Copies every message on the next update"""
+        self.last_ts[:] = [None] * len(self.last_ts)
 
 
 def parse_gear_shifter(can_gear_shifter, car_fingerprint):
@@ -427,6 +524,9 @@ class CarState(CarStateBase):
         self.angle_offset = 0.0
         self.init_angle_offset = False
 
+        # SignalMap of the parsers given to update
+        self.signal_map = None
+        self.signal_map_parsers = None
         # AHB params
         self.ahbHighBeamStalkPosition = 0
         self.ahbEnabled = 0
@@ -548,150 +648,109 @@ class CarState(CarStateBase):
                 close_fds=True,
             )
 
+    def _compile_signal_maps(self, cp, epas_cp, pedal_cp):
+        # the A pillar harness moves the body and seatbelt messages to the EPAS bus
+        body_cp = epas_cp if self.usesApillarHarness else cp
+        signal_maps = [
+            (cp, PT_SIGNAL_MAP),
+            (body_cp, SEATBELT_SIGNAL_MAP),
+            (pedal_cp, PEDAL_SIGNAL_MAP),
+        ]
+        if self.hasTeslaIcIntegration:
+            signal_maps += [(cp, AHB_SIGNAL_MAP), (body_cp, LIGHTS_SIGNAL_MAP)]
+        self.signal_map = SignalMap(signal_maps)
+        self.signal_map_parsers = (cp, epas_cp, pedal_cp)
+
     def update(self, cp, epas_cp, pedal_cp):
+        if self.signal_map_parsers != (cp, epas_cp, pedal_cp):
+            self._compile_signal_maps(cp, epas_cp, pedal_cp)
 
-        self.steering_wheel_stalk = cp.vl["STW_ACTN_RQ"]
-        self.real_carConfig = cp.vl["GTW_carConfig"]
-        self.real_dasHw = cp.vl["GTW_carConfig"]["GTW_dasHw"]
         self.prev_cruise_buttons = self.cruise_buttons
-        self.cruise_buttons = cp.vl["STW_ACTN_RQ"]["SpdCtrlLvr_Stat"]
+        self.prev_pedal_interceptor_state = self.pedal_interceptor_state
+        self.prev_pedal_idx = self.pedal_idx
+        self.signal_map.update(self)
+
+        stw_actn_rq = cp.vl["STW_ACTN_RQ"]
+        gtw_car_config = cp.vl["GTW_carConfig"]
+        gtw_car_state = cp.vl["GTW_carState"]
+        ui_gps_vehicle_speed = cp.vl["UI_gpsVehicleSpeed"]
+        ui_road_sign = cp.vl["UI_driverAssistRoadSign"]
+        di_state = cp.vl["DI_state"]
+        epas_sys_status = epas_cp.vl["EPAS_sysStatus"]
+
+        self.steering_wheel_stalk = stw_actn_rq
+        self.real_carConfig = gtw_car_config
 
         # ******************* parse out can *******************
         self.door_all_closed = not any(
             [
-                cp.vl["GTW_carState"]["DOOR_STATE_FL"],
-                cp.vl["GTW_carState"]["DOOR_STATE_FR"],
-                cp.vl["GTW_carState"]["DOOR_STATE_RL"],
-                cp.vl["GTW_carState"]["DOOR_STATE_RR"],
+                gtw_car_state["DOOR_STATE_FL"],
+                gtw_car_state["DOOR_STATE_FR"],
+                gtw_car_state["DOOR_STATE_RL"],
+                gtw_car_state["DOOR_STATE_RR"],
             ]
         )  # JCT
-        if self.usesApillarHarness:
-            self.seatbelt = epas_cp.vl["SDM1"]["SDM_bcklDrivStatus"]
-        else:
-            self.seatbelt = cp.vl["SDM1"]["SDM_bcklDrivStatus"]
         # self.seatbelt = cp.vl["SDM1"]['SDM_bcklDrivStatus'] and cp.vl["GTW_status"]['GTW_driverPresent']
-        if (cp.vl["GTW_carConfig"]["GTW_performanceConfig"]) and (
-            cp.vl["GTW_carConfig"]["GTW_performanceConfig"] > 0
+        if (gtw_car_config["GTW_performanceConfig"]) and (
+            gtw_car_config["GTW_performanceConfig"] > 0
         ):
             prev_teslaModel = self.teslaModel
             self.teslaModel = "S"
-            if cp.vl["GTW_carConfig"]["GTW_performanceConfig"] > 1:
+            if gtw_car_config["GTW_performanceConfig"] > 1:
                 self.teslaModel = self.teslaModel + "P"
-            if cp.vl["GTW_carConfig"]["GTW_fourWheelDrive"] == 1:
+            if gtw_car_config["GTW_fourWheelDrive"] == 1:
                 self.teslaModel = self.teslaModel + "D"
             if (self.teslaModelDetected == 0) or (prev_teslaModel != self.teslaModel):
-                self.params.put("TeslaModel", self.teslaModel)
+                put_nonblocking("TeslaModel", self.teslaModel)
                 self.teslaModelDetected = 1
 
-        # Nav Map Data
-        self.csaRoadCurvC3 = cp.vl["UI_csaRoadCurvature"]["UI_csaRoadCurvC3"]
-        self.csaRoadCurvC2 = cp.vl["UI_csaRoadCurvature"]["UI_csaRoadCurvC2"]
-        self.csaRoadCurvRange = cp.vl["UI_csaRoadCurvature"]["UI_csaRoadCurvRange"]
-        self.csaRoadCurvUsingTspline = cp.vl["UI_csaRoadCurvature"][
-            "UI_csaRoadCurvUsingTspline"
-        ]
-
-        self.csaOfframpCurvC3 = cp.vl["UI_csaOfframpCurvature"]["UI_csaOfframpCurvC3"]
-        self.csaOfframpCurvC2 = cp.vl["UI_csaOfframpCurvature"]["UI_csaOfframpCurvC2"]
-        self.csaOfframpCurvRange = cp.vl["UI_csaOfframpCurvature"][
-            "UI_csaOfframpCurvRange"
-        ]
-        self.csaOfframpCurvUsingTspline = cp.vl["UI_csaOfframpCurvature"][
-            "UI_csaOfframpCurvUsingTspline"
-        ]
-
-        self.roadCurvHealth = cp.vl["UI_roadCurvature"]["UI_roadCurvHealth"]
-        self.roadCurvRange = cp.vl["UI_roadCurvature"]["UI_roadCurvRange"]
-        self.roadCurvC0 = cp.vl["UI_roadCurvature"]["UI_roadCurvC0"]
-        self.roadCurvC1 = cp.vl["UI_roadCurvature"]["UI_roadCurvC1"]
-        self.roadCurvC2 = cp.vl["UI_roadCurvature"]["UI_roadCurvC2"]
-        self.roadCurvC3 = cp.vl["UI_roadCurvature"]["UI_roadCurvC3"]
-
-        self.gpsLongitude = cp.vl["MCU_locationStatus"]["MCU_longitude"]
-        self.gpsLatitude = cp.vl["MCU_locationStatus"]["MCU_latitude"]
-        self.gpsAccuracy = cp.vl["MCU_locationStatus"]["MCU_gpsAccuracy"]
-        self.gpsElevation = cp.vl["MCU_locationStatus2"]["MCU_elevation"]
-        self.gpsHeading = cp.vl["UI_gpsVehicleSpeed"]["UI_gpsVehicleHeading"]
-        self.gpsVehicleSpeed = (
-            cp.vl["UI_gpsVehicleSpeed"]["UI_gpsVehicleSpeed"] * CV.KPH_TO_MS
-        )
+        self.gpsVehicleSpeed = ui_gps_vehicle_speed["UI_gpsVehicleSpeed"] * CV.KPH_TO_MS
 
         if self.hasTeslaIcIntegration:
+            mcu_chassis_control = cp.vl["MCU_chassisControl"]
             # BB: AutoSteer enabled does not work unless we do old style port mapping on MCU
             # self.apEnabled = (cp.vl["MCU_chassisControl"]["MCU_latControlEnable"] == 1)
             self.summonButton = int(
                 cp.vl["UI_driverAssistControl"]["UI_autoSummonEnable"]
             )
-            self.apFollowTimeInS = (
-                1 + cp.vl["MCU_chassisControl"]["MCU_fcwSensitivity"] * 0.5
-            )
-            self.keepEonOff = cp.vl["MCU_chassisControl"]["MCU_ldwEnable"] == 1
-            self.alcaEnabled = cp.vl["MCU_chassisControl"]["MCU_pedalSafetyEnable"] == 1
+            self.apFollowTimeInS = 1 + mcu_chassis_control["MCU_fcwSensitivity"] * 0.5
+            self.keepEonOff = mcu_chassis_control["MCU_ldwEnable"] == 1
+            self.alcaEnabled = mcu_chassis_control["MCU_pedalSafetyEnable"] == 1
             self.mapAwareSpeed = (
-                cp.vl["MCU_chassisControl"]["MCU_aebEnable"] == 1
-                and self.useTeslaMapData
+                mcu_chassis_control["MCU_aebEnable"] == 1 and self.useTeslaMapData
             )
-            # AHB info
-            self.ahbHighBeamStalkPosition = cp.vl["STW_ACTN_RQ"]["HiBmLvr_Stat"]
-            self.ahbEnabled = cp.vl["MCU_chassisControl"]["MCU_ahlbEnable"]
-            if self.usesApillarHarness:
-                self.ahbLoBeamOn = epas_cp.vl["BODY_R1"]["LoBm_On_Rq"]
-                self.ahbHiBeamOn = epas_cp.vl["BODY_R1"]["HiBm_On"]
-                self.ahbNightMode = epas_cp.vl["BODY_R1"]["LgtSens_Night"]
-            else:
-                self.ahbLoBeamOn = cp.vl["BODY_R1"]["LoBm_On_Rq"]
-                self.ahbHiBeamOn = cp.vl["BODY_R1"]["HiBm_On"]
-                self.ahbNightMode = cp.vl["BODY_R1"]["LgtSens_Night"]
 
-        usu = cp.vl["UI_gpsVehicleSpeed"]["UI_userSpeedOffsetUnits"]
+        usu = ui_gps_vehicle_speed["UI_userSpeedOffsetUnits"]
         if usu == 1:
-            self.userSpeedLimitOffsetKph = cp.vl["UI_gpsVehicleSpeed"][
-                "UI_userSpeedOffset"
-            ]
+            self.userSpeedLimitOffsetKph = ui_gps_vehicle_speed["UI_userSpeedOffset"]
         else:
             self.userSpeedLimitOffsetKph = (
-                cp.vl["UI_gpsVehicleSpeed"]["UI_userSpeedOffset"] * CV.MPH_TO_KPH
+                ui_gps_vehicle_speed["UI_userSpeedOffset"] * CV.MPH_TO_KPH
             )
-        msu = cp.vl["UI_gpsVehicleSpeed"]["UI_mapSpeedLimitUnits"]
+        msu = ui_gps_vehicle_speed["UI_mapSpeedLimitUnits"]
         map_speed_uom_to_ms = CV.KPH_TO_MS if msu == 1 else CV.MPH_TO_MS
         map_speed_ms_to_uom = CV.MS_TO_KPH if msu == 1 else CV.MS_TO_MPH
         speed_limit_type = int(cp.vl["UI_driverAssistMapData"]["UI_mapSpeedLimit"])
 
-        rdSignMsg = cp.vl["UI_driverAssistRoadSign"]["UI_roadSign"]
+        rdSignMsg = ui_road_sign["UI_roadSign"]
         if rdSignMsg == 4:  # ROAD_SIGN_SPEED_SPLINE
-            self.meanFleetSplineSpeedMPS = cp.vl["UI_driverAssistRoadSign"][
-                "UI_meanFleetSplineSpeedMPS"
-            ]
-            self.meanFleetSplineAccelMPS2 = cp.vl["UI_driverAssistRoadSign"][
-                "UI_meanFleetSplineAccelMPS2"
-            ]
-            self.medianFleetSpeedMPS = cp.vl["UI_driverAssistRoadSign"][
-                "UI_medianFleetSpeedMPS"
-            ]
-            self.splineLocConfidence = cp.vl["UI_driverAssistRoadSign"][
-                "UI_splineLocConfidence"
-            ]
-            self.UI_splineID = cp.vl["UI_driverAssistRoadSign"]["UI_splineID"]
-            self.rampType = cp.vl["UI_driverAssistRoadSign"]["UI_rampType"]
+            self.meanFleetSplineSpeedMPS = ui_road_sign["UI_meanFleetSplineSpeedMPS"]
+            self.meanFleetSplineAccelMPS2 = ui_road_sign["UI_meanFleetSplineAccelMPS2"]
+            self.medianFleetSpeedMPS = ui_road_sign["UI_medianFleetSpeedMPS"]
+            self.splineLocConfidence = ui_road_sign["UI_splineLocConfidence"]
+            self.UI_splineID = ui_road_sign["UI_splineID"]
+            self.rampType = ui_road_sign["UI_rampType"]
 
         elif rdSignMsg == 3:  # ROAD_SIGN_SPEED_LIMIT
-            self.topQrtlFleetSplineSpeedMPS = cp.vl["UI_driverAssistRoadSign"][
-                "UI_topQrtlFleetSpeedMPS"
-            ]
-            self.splineLocConfidence = cp.vl["UI_driverAssistRoadSign"][
-                "UI_splineLocConfidence"
-            ]
-            self.baseMapSpeedLimitMPS = cp.vl["UI_driverAssistRoadSign"][
-                "UI_baseMapSpeedLimitMPS"
-            ]
+            self.topQrtlFleetSplineSpeedMPS = ui_road_sign["UI_topQrtlFleetSpeedMPS"]
+            self.splineLocConfidence = ui_road_sign["UI_splineLocConfidence"]
+            self.baseMapSpeedLimitMPS = ui_road_sign["UI_baseMapSpeedLimitMPS"]
             # we round the speed limit in the map's units of measurement to fix noisy data (there are no signs with a limit of 79.2 kph)
             self.baseMapSpeedLimitMPS = (
                 int(self.baseMapSpeedLimitMPS * map_speed_ms_to_uom + 0.99)
                 / map_speed_ms_to_uom
             )
-            self.bottomQrtlFleetSpeedMPS = cp.vl["UI_driverAssistRoadSign"][
-                "UI_bottomQrtlFleetSpeedMPS"
-            ]
+            self.bottomQrtlFleetSpeedMPS = ui_road_sign["UI_bottomQrtlFleetSpeedMPS"]
 
         if self.baseMapSpeedLimitMPS > 0 and (
             speed_limit_type != 0x1F or self.baseMapSpeedLimitMPS <= 5.56
@@ -701,7 +760,7 @@ class CarState(CarStateBase):
             )  # this one is earlier than the actual sign but can also be unreliable, so we ignore it on SNA at higher speeds
         else:
             self.speed_limit_ms = (
-                cp.vl["UI_gpsVehicleSpeed"]["UI_mppSpeedLimit"] * map_speed_uom_to_ms
+                ui_gps_vehicle_speed["UI_mppSpeedLimit"] * map_speed_uom_to_ms
             )
         self.DAS_fusedSpeedLimit = self._convert_to_DAS_fusedSpeedLimit(
             self.speed_limit_ms * map_speed_ms_to_uom, speed_limit_type
@@ -711,8 +770,8 @@ class CarState(CarStateBase):
 
         # 2 = temporary 3= TBD 4 = temporary, hit a bump 5 (permanent) 6 = temporary 7 (permanent)
         # TODO: Use values from DBC to parse this field
-        self.steer_error = epas_cp.vl["EPAS_sysStatus"]["EPAS_steeringFault"] == 1
-        self.steer_not_allowed = epas_cp.vl["EPAS_sysStatus"]["EPAS_eacStatus"] not in [
+        self.steer_error = epas_sys_status["EPAS_steeringFault"] == 1
+        self.steer_not_allowed = epas_sys_status["EPAS_eacStatus"] not in [
             2,
             1,
         ]  # 2 "EAC_ACTIVE" 1 "EAC_AVAILABLE" 3 "EAC_FAULT" 0 "EAC_INHIBITED"
@@ -728,8 +787,8 @@ class CarState(CarStateBase):
         self.v_wheel_rr = 0  # JCT
         self.v_wheel = 0  # JCT
         self.v_weight = 0  # JCT
-        self.imperial_speed_units = cp.vl["DI_state"]["DI_speedUnits"] == 0
-        speed_ms = cp.vl["DI_state"]["DI_analogSpeed"] * (
+        self.imperial_speed_units = di_state["DI_speedUnits"] == 0
+        speed_ms = di_state["DI_analogSpeed"] * (
             CV.MPH_TO_MS if self.imperial_speed_units else CV.KPH_TO_MS
         )  # car's displayed speed in m/s
 
@@ -743,25 +802,15 @@ class CarState(CarStateBase):
         self.v_ego = float(v_ego_x[0])
         self.a_ego = float(v_ego_x[1])
 
-        # BB use this set for pedal work as the user_gas_xx is used in other places
-        self.prev_pedal_interceptor_state = self.pedal_interceptor_state
-        self.pedal_interceptor_state = pedal_cp.vl["GAS_SENSOR"]["STATE"]
-        self.pedal_interceptor_value = pedal_cp.vl["GAS_SENSOR"]["INTERCEPTOR_GAS"]
-        self.pedal_interceptor_value2 = pedal_cp.vl["GAS_SENSOR"]["INTERCEPTOR_GAS2"]
-        self.prev_pedal_idx = self.pedal_idx
-        self.pedal_idx = pedal_cp.vl["GAS_SENSOR"]["IDX"]
-
         can_gear_shifter = cp.vl["DI_torque2"]["DI_gear"]
 
         # self.angle_steers  = -(cp.vl["STW_ANGLHP_STAT"]['StW_AnglHP']) #JCT polarity reversed from Honda/Acura
         self.angle_steers = -(
-            epas_cp.vl["EPAS_sysStatus"]["EPAS_internalSAS"]
+            epas_sys_status["EPAS_internalSAS"]
         )  # BB see if this works better than STW_ANGLHP_STAT for angle
 
         self.angle_steers_rate = 0  # JCT
 
-        self.turn_signal_state_left = cp.vl["GTW_carState"]["BC_indicatorLStatus"]
-        self.turn_signal_state_right = cp.vl["GTW_carState"]["BC_indicatorRStatus"]
         self.prev_turn_signal_blinking = self.turn_signal_blinking
         self.turn_signal_blinking = (
             self.turn_signal_state_left == 1 or self.turn_signal_state_right == 1
@@ -769,14 +818,14 @@ class CarState(CarStateBase):
         self.prev_turn_signal_stalk_state = self.turn_signal_stalk_state
         self.turn_signal_stalk_state = (
             0
-            if cp.vl["STW_ACTN_RQ"]["TurnIndLvr_Stat"] == 3
-            else int(cp.vl["STW_ACTN_RQ"]["TurnIndLvr_Stat"])
+            if stw_actn_rq["TurnIndLvr_Stat"] == 3
+            else int(stw_actn_rq["TurnIndLvr_Stat"])
         )
 
         self.brake_hold = 0  # TODO
 
         self.main_on = 1  # cp.vl["SCM_BUTTONS"]['MAIN_ON']
-        self.DI_cruiseSet = cp.vl["DI_state"]["DI_cruiseSet"]
+        self.DI_cruiseSet = di_state["DI_cruiseSet"]
         if self.imperial_speed_units:
             self.DI_cruiseSet = self.DI_cruiseSet * CV.MPH_TO_KPH
         self.gear_shifter = parse_gear_shifter(can_gear_shifter, self.CP.carFingerprint)
@@ -787,21 +836,16 @@ class CarState(CarStateBase):
         )
         self.car_gas = self.pedal_gas
 
-        self.steer_override = abs(epas_cp.vl["EPAS_sysStatus"]["EPAS_handsOnLevel"]) > 0
+        self.steer_override = abs(epas_sys_status["EPAS_handsOnLevel"]) > 0
         self.steer_torque_driver = 0  # JCT
 
         # brake switch has shown some single time step noise, so only considered when
         # switch is on for at least 2 consecutive CAN samples
         # Todo / refactor: This shouldn't have to do with epas == 3..
         # was wrongly set to epas_cp.vl["EPAS_sysStatus"]['EPAS_eacErrorCode'] == 3 and epas_cp.vl["EPAS_sysStatus"]['EPAS_eacStatus'] == 0
-        self.brake_switch = cp.vl["DI_torque2"]["DI_brakePedal"]
-        self.brake_pressed = cp.vl["DI_torque2"]["DI_brakePedal"]
-
         self.standstill = cp.vl["DI_torque2"]["DI_vehicleSpeed"] == 0
-        self.torqueMotor = cp.vl["DI_torque1"]["DI_torqueMotor"]
-        self.pcm_acc_status = cp.vl["DI_state"]["DI_cruiseState"]
 
-        self.regenLight = cp.vl["DI_state"]["DI_regenLight"] == 1
+        self.regenLight = di_state["DI_regenLight"] == 1
 
         self.v_cruise_actual = self.DI_cruiseSet
 
@@ -0,0 +1,116 @@
+"""Messages the Tesla car modules read inside controlsd.
+
+Instead of every module polling conflated sockets of its own, CarController updates one
+MessageIntake at the start of every iteration, which polls all the sockets at once. A
+message is received and deserialized once, the first time a module reads its service.
+The modules read through an IntakeReader of their own, which returns a message once,
+like their own conflated socket did. Messages are shared, so they must not be changed.
+
+Only AHB reads frame, for the gain and exposure of the camera, which change slowly. A frame
+is received at most every CAMERA_META_INTERVAL iterations and only its metadata is kept;
+the conflated socket drops the frames in between without them being received.
+"""
+from collections import namedtuple
+
+from cereal import log, tesla, ui
+import cereal.messaging as messaging
+
+CAMERA_META_INTERVAL = 50  # controlsd iterations, 2 Hz
+
+CameraMeta = namedtuple("CameraMeta", ["frameId", "globalGain", "exposureTime", "frameDuration"])
+
+
+def camera_meta(dat):
+    """The fields of a frame event AHB uses"""
+    frame = log.Event.from_bytes(dat).frame
+    capture = frame.androidCaptureResult
+    return CameraMeta(frame.frameId, frame.globalGain, capture.exposureTime, capture.frameDuration)
+
+
+# service -> what deserializes its messages
+TESLA_SERVICES = {
+    "radarState": log.Event.from_bytes,
+    "pathPlan": log.Event.from_bytes,
+    "liveMapData": log.Event.from_bytes,
+    "trafficEvents": log.Event.from_bytes,
+    "frame": camera_meta,
+    "sensorEvents": log.Event.from_bytes,
+    "uiIcLeads": tesla.ICLeads.from_bytes,
+    "uiIcCarLR": tesla.ICCarsLR.from_bytes,
+    "alcaState": tesla.ALCAState.from_bytes,
+    "ahbInfo": tesla.AHBinfo.from_bytes,
+    "uiButtonStatus": ui.UIButtonStatus.from_bytes,
+}
+
+# service -> received at most every this many iterations
+TESLA_SERVICE_INTERVALS = {
+    "frame": CAMERA_META_INTERVAL,
+}
+
+
+class MessageIntake():
+    def __init__(self, services=TESLA_SERVICES, intervals=TESLA_SERVICE_INTERVALS):
+        self.decoders = services
+        self.intervals = intervals
+        self.poller = messaging.Poller()
+        self.socks = {}
+        self.services = {}
+        for service in services:
+            sock = messaging.sub_sock(service, poller=self.poller, conflate=True)
+            self.socks[service] = sock
+            self.services[sock] = service
+
+        # services with a message waiting, it's received when someone reads the service
+        self.ready = set()
+        self.raw = dict.fromkeys(services)
+        self.msgs = dict.fromkeys(services)
+        # number of messages received per service, readers compare it to the last one they saw
+        self.counts = dict.fromkeys(services, 0)
+        self.iteration = 0
+        self.last_receive = dict.fromkeys(services, None)
+
+    def update(self):
+        """Polls all the sockets once, without blocking"""
+        self.ready = {self.services[sock] for sock in self.poller.poll(0)}
+        self.iteration += 1
+
+    def receive(self, service):
+        if service in self.ready:
+            self.ready.discard(service)
+            last = self.last_receive[service]
+            if last is not None and self.iteration - last < self.intervals.get(service, 1):
+                return
+            dat = self.socks[service].receive(non_blocking=True)
+            if dat is not None:
+                self.last_receive[service] = self.iteration
+                self.raw[service] = dat
+                self.msgs[service] = None
+                self.counts[service] += 1
+
+    def get(self, service):
+        """The latest message of a service, None before the first one"""
+        self.receive(service)
+        msg = self.msgs[service]
+        if msg is None and self.raw[service] is not None:
+            msg = self.msgs[service] = self.decoders[service](self.raw[service])
+            self.raw[service] = None
+        return msg
+
+    def reader(self):
+        return IntakeReader(self)
+
+
+class IntakeReader():
+    def __init__(self, intake):
+        self.intake = intake
+        self.seen = dict.fromkeys(intake.counts, 0)
+
+    def recv(self, service):
+        """The latest message of a service if it's new since the last recv, like
+        recv_one_or_none on a conflated socket"""
+        self.intake.receive(service)
+        count = self.intake.counts[service]
+        if count == self.seen[service]:
+            return None
+        self.seen[service] = count
+        return self.intake.get(service)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3.7
 import os
 import time
+import operator
 from cereal import car, tesla
 from opendbc.can.parser import CANParser
 from cereal.services import service_list
@@ -38,53 +39,48 @@ AHB_MAX_DISTANCE = 100  # ignore if more than 100m
 USE_ALL_OBJECTS = True
 
 
+# signals and their defaults for the A and B message of every point
+RADAR_A_SIGNALS = [
+    ("LongDist", 255.0),
+    ("LatDist", 0.0),
+    ("LongSpeed", 0.0),
+    ("LongAccel", 0.0),
+    ("Valid", 0),
+    ("Tracked", 0),
+    ("Meas", 0),
+    ("ProbExist", 0.0),
+    ("Index", 0),
+    ("ProbObstacle", 0.0),
+]
+RADAR_B_SIGNALS = [
+    ("LatSpeed", 0.0),
+    ("Index2", 0),
+    ("Class", 0),
+    ("ProbClass", 0.0),
+    ("Length", 0.0),
+    ("dZ", 0.0),
+    ("MovingState", 0),
+]
+# fetch all signals of a message in one call, in the order of the tables above
+_get_a_signals = operator.itemgetter(*[name for name, _ in RADAR_A_SIGNALS])
+_get_b_signals = operator.itemgetter(*[name for name, _ in RADAR_B_SIGNALS])
+_RADAR_MSG_PAIRS = list(zip(RADAR_A_MSGS, RADAR_B_MSGS))
+
+
 def _create_radard_can_parser():
     dbc_f = "teslaradar.dbc"
 
-    msg_a_n = len(RADAR_A_MSGS)
-    msg_b_n = len(RADAR_B_MSGS)
+    signals = [
+        (name, msg, default)
+        for name, default in RADAR_A_SIGNALS
+        for msg in RADAR_A_MSGS
+    ] + [
+        (name, msg, default)
+        for name, default in RADAR_B_SIGNALS
+        for msg in RADAR_B_MSGS
+    ]
 
-    signals = list(
-        zip(
-            ["LongDist"] * msg_a_n
-            + ["LatDist"] * msg_a_n
-            + ["LongSpeed"] * msg_a_n
-            + ["LongAccel"] * msg_a_n
-            + ["Valid"] * msg_a_n
-            + ["Tracked"] * msg_a_n
-            + ["Meas"] * msg_a_n
-            + ["ProbExist"] * msg_a_n
-            + ["Index"] * msg_a_n
-            + ["ProbObstacle"] * msg_a_n
-            + ["LatSpeed"] * msg_b_n
-            + ["Index2"] * msg_b_n
-            + ["Class"] * msg_b_n
-            + ["ProbClass"] * msg_b_n
-            + ["Length"] * msg_b_n
-            + ["dZ"] * msg_b_n
-            + ["MovingState"] * msg_b_n,
-            RADAR_A_MSGS * 10 + RADAR_B_MSGS * 7,
-            [255.0] * msg_a_n
-            + [0.0] * msg_a_n
-            + [0.0] * msg_a_n
-            + [0.0] * msg_a_n
-            + [0] * msg_a_n
-            + [0] * msg_a_n
-            + [0] * msg_a_n
-            + [0.0] * msg_a_n
-            + [0] * msg_a_n
-            + [0.0] * msg_a_n
-            + [0.0] * msg_b_n
-            + [0] * msg_b_n
-            + [0] * msg_b_n
-            + [0.0] * msg_b_n
-            + [0.0] * msg_b_n
-            + [0.0] * msg_b_n
-            + [0] * msg_b_n,
-        )
-    )
-
-    checks = list(zip(RADAR_A_MSGS + RADAR_B_MSGS, [6] * (msg_a_n + msg_b_n)))
+    checks = list(zip(RADAR_A_MSGS + RADAR_B_MSGS, [6] * (len(RADAR_A_MSGS) + len(RADAR_B_MSGS))))
 
     return CANParser(os.path.splitext(dbc_f)[0].encode("utf8"), signals, checks, 1)
 
@@ -147,113 +143,89 @@ class RadarInterface(RadarInterfaceBase):
 
     def _update(self, updated_messages, v_ego):
         ret = car.RadarData.new_message()
+        vl = self.rcp.vl
         AHB_car_detected = False
-        for message in updated_messages:
-            if not (message in RADAR_A_MSGS):
-                if message in self.pts:
-                    del self.pts[message]
-                    del self.extPts[message]
-                continue
-            cpt = self.rcp.vl[message]
-            if not (message + 1 in updated_messages):
+        # relative speeds beyond these are not stationary objects
+        moving_away_speed = AHB_STATIONARY_MARGIN - v_ego
+        moving_towards_speed = -AHB_STATIONARY_MARGIN - v_ego
+        for message, message2 in _RADAR_MSG_PAIRS:
+            if message not in updated_messages or message2 not in updated_messages:
                 continue
-            cpt2 = self.rcp.vl[message + 1]
+            (dist, lat_dist, speed, accel, valid, tracked, meas, prob_exist, index, prob_obstacle) = _get_a_signals(vl[message])
+            (lat_speed, index2, cls, prob_class, length, dz, moving_state) = _get_b_signals(vl[message2])
             # ensure the two messages are from the same frame reading
-            if cpt["Index"] != cpt2["Index2"]:
+            if index != index2:
                 continue
-            if (
-                (cpt["LongDist"] >= BOSCH_MAX_DIST)
-                or (cpt["LongDist"] == 0)
-                or (not cpt["Tracked"])
-                or (not cpt["Valid"])
-            ):
-                self.valid_cnt[message] = 0  # reset counter
-                if message in self.pts:
-                    del self.pts[message]
-                    del self.extPts[message]
-            elif (
-                cpt["Valid"]
-                and (cpt["LongDist"] < BOSCH_MAX_DIST)
-                and (cpt["LongDist"] > 0)
-                and (cpt["ProbExist"] >= OBJECT_MIN_PROBABILITY)
-            ):
-                self.valid_cnt[message] += 1
+            if dist >= BOSCH_MAX_DIST or dist == 0 or not tracked or not valid:
+                valid_cnt = 0  # reset counter
+            elif dist > 0 and prob_exist >= OBJECT_MIN_PROBABILITY:
+                valid_cnt = self.valid_cnt[message] + 1
             else:
-                self.valid_cnt[message] = max(self.valid_cnt[message] - 20, 0)
-                if (self.valid_cnt[message] == 0) and (message in self.pts):
-                    del self.pts[message]
-                    del self.extPts[message]
+                valid_cnt = max(self.valid_cnt[message] - 20, 0)
+            self.valid_cnt[message] = valid_cnt
+            if valid_cnt == 0 and message in self.pts:
+                del self.pts[message]
+                del self.extPts[message]
 
+            if not ((valid or tracked) and 0 < dist < BOSCH_MAX_DIST and cls < 4):
+                continue
             # this is the logic used for Auto High Beam (AHB) car detection
             if (
-                (cpt["Valid"] or cpt["Tracked"])
-                and (abs(cpt["LongSpeed"]) < 80)
-                and (cpt["LongDist"] > 0)
-                and (cpt["LongDist"] < AHB_MAX_DISTANCE)
-                and (cpt["LongDist"] < BOSCH_MAX_DIST)
-                and (self.valid_cnt[message] > AHB_VALID_MESSAGE_COUNT_THRESHOLD)
-                and (cpt["ProbExist"] >= AHB_OBJECT_MIN_PROBABILITY)
-                and (cpt2["Class"] < 4)
-                and (cpt2["ProbClass"] >= AHB_CLASS_MIN_PROBABILITY)
-            ):
+                abs(speed) < 80
+                and dist < AHB_MAX_DISTANCE
+                and valid_cnt > AHB_VALID_MESSAGE_COUNT_THRESHOLD
+                and prob_exist >= AHB_OBJECT_MIN_PROBABILITY
+                and prob_class >= AHB_CLASS_MIN_PROBABILITY
                 # if moving or the relative speed is x% larger than our speed then use to turn high beam off
-                if (cpt["LongSpeed"] <= -AHB_STATIONARY_MARGIN - v_ego) or (
-                    cpt["LongSpeed"] >= AHB_STATIONARY_MARGIN - v_ego
-                ):
-                    AHB_car_detected = True
-                    if AHB_DEBUG:
-                        print(cpt, cpt2)
+                and (speed <= moving_towards_speed or speed >= moving_away_speed)
+            ):
+                AHB_car_detected = True
+                if AHB_DEBUG:
+                    print(vl[message], vl[message2])
             # radar point only valid if it's a valid measurement and score is above 50
             # bosch radar data needs to match Index and Index2 for validity
             # also for now ignore construction elements
-            if (
-                (cpt["Valid"] or cpt["Tracked"])
-                and (cpt["LongDist"] > 0)
-                and (cpt["LongDist"] < BOSCH_MAX_DIST)
-                and (self.valid_cnt[message] > VALID_MESSAGE_COUNT_THRESHOLD)
-                and (cpt["ProbExist"] >= OBJECT_MIN_PROBABILITY)
-                and (cpt2["Class"] < 4)
-                and ((cpt["LongSpeed"] >= AHB_STATIONARY_MARGIN - v_ego) or (v_ego < 2))
+            if not (
+                valid_cnt > VALID_MESSAGE_COUNT_THRESHOLD
+                and prob_exist >= OBJECT_MIN_PROBABILITY
+                and (speed >= moving_away_speed or v_ego < 2)
             ):
-                if message not in self.pts and (cpt["Tracked"]):
-                    self.pts[message] = car.RadarData.RadarPoint.new_message()
-                    self.pts[message].trackId = self.trackId
-                    self.extPts[message] = tesla.TeslaRadarPoint.new_message()
-                    self.extPts[message].trackId = self.trackId
-                    self.trackId = (self.trackId + 1) & 0xFFFFFFFFFFFFFFFF
-                    if self.trackId == 0:
-                        self.trackId = 1
-                if message in self.pts:
-                    self.pts[message].dRel = cpt["LongDist"]  # from front of car
-                    self.pts[message].yRel = (
-                        cpt["LatDist"] - self.radarOffset
-                    )  # in car frame's y axis, left is positive
-                    self.pts[message].vRel = cpt["LongSpeed"]
-                    self.pts[message].aRel = cpt["LongAccel"]
-                    self.pts[message].yvRel = cpt2["LatSpeed"]
-                    self.pts[message].measured = bool(cpt["Meas"])
-                    self.extPts[message].dz = cpt2["dZ"]
-                    self.extPts[message].movingState = cpt2["MovingState"]
-                    self.extPts[message].length = cpt2["Length"]
-                    self.extPts[message].obstacleProb = cpt["ProbObstacle"]
-                    self.extPts[message].timeStamp = int(
-                        self.rcp.ts[message + 1]["Index2"]
-                    )
-                    if cpt2["ProbClass"] >= CLASS_MIN_PROBABILITY:
-                        self.extPts[message].objectClass = cpt2["Class"]
-                        # for now we will use class 0- unknown stuff to show trucks
-                        # we will base that on being a class 1 and length of 2 (hoping they meant width not length, but as germans could not decide)
-                        # 0-unknown 1-four wheel vehicle 2-two wheel vehicle 3-pedestrian 4-construction element
-                        # going to 0-unknown 1-truck 2-car 3/4-motorcycle/bicycle 5 pedestrian - we have two bits so
-                        if cpt2["Class"] == 0:
-                            self.extPts[message].objectClass = 1
-                        if (cpt2["Class"] == 1) and (
-                            (self.extPts[message].length >= 1.8)
-                            or (0.6 < self.extPts[message].dz < 4.5)
-                        ):
-                            self.extPts[message].objectClass = 0
-                    else:
-                        self.extPts[message].objectClass = 1
+                continue
+            if message not in self.pts:
+                if not tracked:
+                    continue
+                self.pts[message] = car.RadarData.RadarPoint.new_message()
+                self.pts[message].trackId = self.trackId
+                self.extPts[message] = tesla.TeslaRadarPoint.new_message()
+                self.extPts[message].trackId = self.trackId
+                self.trackId = (self.trackId + 1) & 0xFFFFFFFFFFFFFFFF
+                if self.trackId == 0:
+                    self.trackId = 1
+            pt = self.pts[message]
+            pt.dRel = dist  # from front of car
+            pt.yRel = lat_dist - self.radarOffset  # in car frame's y axis, left is positive
+            pt.vRel = speed
+            pt.aRel = accel
+            pt.yvRel = lat_speed
+            pt.measured = bool(meas)
+            ext = self.extPts[message]
+            ext.dz = dz
+            ext.movingState = moving_state
+            ext.length = length
+            ext.obstacleProb = prob_obstacle
+            ext.timeStamp = int(self.rcp.ts[message2]["Index2"])
+            if prob_class >= CLASS_MIN_PROBABILITY:
+                ext.objectClass = cls
+                # for now we will use class 0- unknown stuff to show trucks
+                # we will base that on being a class 1 and length of 2 (hoping they meant width not length, but as germans could not decide)
+                # 0-unknown 1-four wheel vehicle 2-two wheel vehicle 3-pedestrian 4-construction element
+                # going to 0-unknown 1-truck 2-car 3/4-motorcycle/bicycle 5 pedestrian - we have two bits so
+                if cls == 0:
+                    ext.objectClass = 1
+                if cls == 1 and (ext.length >= 1.8 or 0.6 < ext.dz < 4.5):
+                    ext.objectClass = 0
+            else:
+                ext.objectClass = 1
 
         ret.points = list(self.pts.values())
         errors = []
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3.7
+# Replays the can messages of a log through the Tesla RadarInterface and
+# reports the time spent per radar cycle.
+#   ./benchmarkRadar.py <rlog.bz2 or route name> [v_ego]
+import sys
+import time
+import numpy as np
+
+from cereal import car
+from tools.lib.logreader import LogReader, MultiLogIterator
+from tools.lib.route import Route
+from selfdrive.car.tesla.radar_interface import RadarInterface
+
+
+def can_strings_from_log(log_path):
+  if log_path.endswith(".bz2"):
+    lr = LogReader(log_path)
+  else:
+    lr = MultiLogIterator([p for p in Route(log_path).log_paths() if p is not None], wraparound=False)
+  return [m.as_builder().to_bytes() for m in lr if m.which() == "can"]
+
+
+if __name__ == "__main__":
+  can_strings = can_strings_from_log(sys.argv[1])
+  v_ego = float(sys.argv[2]) if len(sys.argv) > 2 else 20.
+
+  CP = car.CarParams.new_message()
+  CP.radarTimeStep = 0.05
+  RI = RadarInterface(CP)
+
+  cycle_times = []
+  num_points = []
+  t_cycle = 0.
+  for s in can_strings:
+    t = time.perf_counter()
+    rr, _, _ = RI.update([s], v_ego)
+    t_cycle += time.perf_counter() - t
+    if rr is not None:
+      cycle_times.append(t_cycle)
+      num_points.append(len(rr.points))
+      t_cycle = 0.
+
+  if not cycle_times:
+    print("no radar data in %s" % sys.argv[1])
+    sys.exit(1)
+
+  cycle_times = np.array(cycle_times) * 1e3
+  print("%d radar cycles, %.1f points on average" % (len(cycle_times), np.mean(num_points)))
+  print("per cycle: mean %.3f ms, median %.3f ms, p99 %.3f ms, max %.3f ms" %
+        (np.mean(cycle_times), np.median(cycle_times), np.percentile(cycle_times, 99), np.max(cycle_times)))
@@ -1,10 +1,19 @@
 import configparser
+import hashlib
+import os
+import threading
+from types import MappingProxyType
 from common.params import Params
 import subprocess
 from common.basedir import BASEDIR
 
 default_config_file_path = "%s/../bb_openpilot.cfg" % BASEDIR
 
+# config path -> _CachedSettings, the settings are parsed once per process and only
+# parsed again when the file changes
+_settings_cache = {}
+_settings_lock = threading.Lock()
+
 
 class ConfigFile:
     config_file_r = "r"
@@ -669,7 +678,70 @@ class ConfigFile:
         return updated
 
 
+class _Settings:
+    pass
+
+
+class _CachedSettings:
+    def __init__(self, stat_key, digest, values):
+        self.stat_key = stat_key
+        self.digest = digest
+        self.values = values
+
+
+def _stat_key(config_path):
+    try:
+        st = os.stat(config_path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _file_digest(config_path):
+    try:
+        with open(config_path, "rb") as f:
+            return hashlib.sha1(f.read()).digest()
+    except IOError:
+        return None
+
+
+def load_settings(config_path=default_config_file_path):
+    """Returns the settings of a config file as a read-only dict, and whether the
+    file was written. The file is only read when its mtime, size or inode changed
+    since the last time, and only parsed again when its contents changed."""
+    with _settings_lock:
+        stat_key = _stat_key(config_path)
+        cached = _settings_cache.get(config_path)
+        if cached is not None and stat_key is not None:
+            if stat_key == cached.stat_key:
+                return cached.values, False
+            if _file_digest(config_path) == cached.digest:
+                cached.stat_key = stat_key
+                return cached.values, False
+
+        into = _Settings()
+        did_write = ConfigFile().read(into, config_path)
+        values = MappingProxyType(vars(into))
+        _settings_cache[config_path] = _CachedSettings(
+            _stat_key(config_path), _file_digest(config_path), values
+        )
+        return values, did_write
+
+
+def reload_settings(config_path=None):
+    """Forgets the parsed settings of config_path, or of every file, so the next
+    CarSettings() parses the file again"""
+    with _settings_lock:
+        if config_path is None:
+            _settings_cache.clear()
+        else:
+            _settings_cache.pop(config_path, None)
+
+
 class CarSettings:
+    """The settings of bb_openpilot.cfg. All instances of a file copy the settings
+    parsed by load_settings, so making one is cheap. Changing an instance only
+    changes that instance."""
 
     userHandle = None
     forceFingerprintTesla = None
@@ -716,10 +788,15 @@ class CarSettings:
     monitorForcedRes = None
 
     def __init__(self, optional_config_file_path=default_config_file_path):
-        config_file = ConfigFile()
-        self.did_write_file = config_file.read(
-            self, config_path=optional_config_file_path
-        )
+        values, did_write_file = load_settings(optional_config_file_path)
+        self.__dict__.update(values)
+        self.did_write_file = did_write_file
+
+    @classmethod
+    def reload(cls, optional_config_file_path=default_config_file_path):
+        """Parses the config file again, for when it was changed in a way its mtime doesn't show"""
+        reload_settings(optional_config_file_path)
+        return cls(optional_config_file_path)
 
     def get_value(self, name_of_variable):
         return self.__dict__[name_of_variable]
@@ -727,5 +804,6 @@ class CarSettings:
 
 # Legacy support
 def read_config_file(into, config_path=default_config_file_path):
-    config_file = ConfigFile()
-    config_file.read(into, config_path)
+    values, _ = load_settings(config_path)
+    for name, value in values.items():
+        setattr(into, name, value)
@@ -1,290 +1,59 @@
 import struct
-from ctypes import create_string_buffer
 from common.numpy_fast import clip
 
 IC_LANE_SCALE = 2.0
 
+# Frames are built dozens of times per controls tick, so everything that does
+# not depend on the signal values is computed once at import: the CRC table,
+# one struct.Struct per frame layout and the constant payloads.
+
+
+def _crc8_table(poly):
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+TESLA_CRC8_TABLE = _crc8_table(0x1D)
+
+_PACK_1B = struct.Struct("B")
+_PACK_3B = struct.Struct("BBB")
+_PACK_4B = struct.Struct("BBBB")
+_PACK_6B = struct.Struct("BBBBBB")
+_PACK_8B = struct.Struct("BBBBBBBB")
+
+_FAKE_IC_DATA = _PACK_8B.pack(0xFF, 0xFF, 0x01, 0x02, 0x03, 0x04, 0xFF, 0x00)
+_EMPTY_8B = bytes(8)
+
+
+def tesla_crc8(data):
+    """CRC8 using 1D poly, FF start, FF end over an iterable of byte values"""
+    crc = 0xFF
+    for b in data:
+        crc = TESLA_CRC8_TABLE[crc ^ b]
+    return crc ^ 0xFF
+
 
 def add_tesla_crc(msg, msg_len):
     """Calculate CRC8 using 1D poly, FF start, FF end"""
-    crc_lookup = [
-        0x00,
-        0x1D,
-        0x3A,
-        0x27,
-        0x74,
-        0x69,
-        0x4E,
-        0x53,
-        0xE8,
-        0xF5,
-        0xD2,
-        0xCF,
-        0x9C,
-        0x81,
-        0xA6,
-        0xBB,
-        0xCD,
-        0xD0,
-        0xF7,
-        0xEA,
-        0xB9,
-        0xA4,
-        0x83,
-        0x9E,
-        0x25,
-        0x38,
-        0x1F,
-        0x02,
-        0x51,
-        0x4C,
-        0x6B,
-        0x76,
-        0x87,
-        0x9A,
-        0xBD,
-        0xA0,
-        0xF3,
-        0xEE,
-        0xC9,
-        0xD4,
-        0x6F,
-        0x72,
-        0x55,
-        0x48,
-        0x1B,
-        0x06,
-        0x21,
-        0x3C,
-        0x4A,
-        0x57,
-        0x70,
-        0x6D,
-        0x3E,
-        0x23,
-        0x04,
-        0x19,
-        0xA2,
-        0xBF,
-        0x98,
-        0x85,
-        0xD6,
-        0xCB,
-        0xEC,
-        0xF1,
-        0x13,
-        0x0E,
-        0x29,
-        0x34,
-        0x67,
-        0x7A,
-        0x5D,
-        0x40,
-        0xFB,
-        0xE6,
-        0xC1,
-        0xDC,
-        0x8F,
-        0x92,
-        0xB5,
-        0xA8,
-        0xDE,
-        0xC3,
-        0xE4,
-        0xF9,
-        0xAA,
-        0xB7,
-        0x90,
-        0x8D,
-        0x36,
-        0x2B,
-        0x0C,
-        0x11,
-        0x42,
-        0x5F,
-        0x78,
-        0x65,
-        0x94,
-        0x89,
-        0xAE,
-        0xB3,
-        0xE0,
-        0xFD,
-        0xDA,
-        0xC7,
-        0x7C,
-        0x61,
-        0x46,
-        0x5B,
-        0x08,
-        0x15,
-        0x32,
-        0x2F,
-        0x59,
-        0x44,
-        0x63,
-        0x7E,
-        0x2D,
-        0x30,
-        0x17,
-        0x0A,
-        0xB1,
-        0xAC,
-        0x8B,
-        0x96,
-        0xC5,
-        0xD8,
-        0xFF,
-        0xE2,
-        0x26,
-        0x3B,
-        0x1C,
-        0x01,
-        0x52,
-        0x4F,
-        0x68,
-        0x75,
-        0xCE,
-        0xD3,
-        0xF4,
-        0xE9,
-        0xBA,
-        0xA7,
-        0x80,
-        0x9D,
-        0xEB,
-        0xF6,
-        0xD1,
-        0xCC,
-        0x9F,
-        0x82,
-        0xA5,
-        0xB8,
-        0x03,
-        0x1E,
-        0x39,
-        0x24,
-        0x77,
-        0x6A,
-        0x4D,
-        0x50,
-        0xA1,
-        0xBC,
-        0x9B,
-        0x86,
-        0xD5,
-        0xC8,
-        0xEF,
-        0xF2,
-        0x49,
-        0x54,
-        0x73,
-        0x6E,
-        0x3D,
-        0x20,
-        0x07,
-        0x1A,
-        0x6C,
-        0x71,
-        0x56,
-        0x4B,
-        0x18,
-        0x05,
-        0x22,
-        0x3F,
-        0x84,
-        0x99,
-        0xBE,
-        0xA3,
-        0xF0,
-        0xED,
-        0xCA,
-        0xD7,
-        0x35,
-        0x28,
-        0x0F,
-        0x12,
-        0x41,
-        0x5C,
-        0x7B,
-        0x66,
-        0xDD,
-        0xC0,
-        0xE7,
-        0xFA,
-        0xA9,
-        0xB4,
-        0x93,
-        0x8E,
-        0xF8,
-        0xE5,
-        0xC2,
-        0xDF,
-        0x8C,
-        0x91,
-        0xB6,
-        0xAB,
-        0x10,
-        0x0D,
-        0x2A,
-        0x37,
-        0x64,
-        0x79,
-        0x5E,
-        0x43,
-        0xB2,
-        0xAF,
-        0x88,
-        0x95,
-        0xC6,
-        0xDB,
-        0xFC,
-        0xE1,
-        0x5A,
-        0x47,
-        0x60,
-        0x7D,
-        0x2E,
-        0x33,
-        0x14,
-        0x09,
-        0x7F,
-        0x62,
-        0x45,
-        0x58,
-        0x0B,
-        0x16,
-        0x31,
-        0x2C,
-        0x97,
-        0x8A,
-        0xAD,
-        0xB0,
-        0xE3,
-        0xFE,
-        0xD9,
-        0xC4,
-    ]
-    crc = 0xFF
-    for x in range(0, msg_len, 1):
-        crc = crc_lookup[crc ^ ord(msg[x])]
-    crc = crc ^ 0xFF
-    return crc
+    return tesla_crc8(bytes(msg[:msg_len]))
 
 
 def add_tesla_checksum(msg_id, msg):
     """Calculates the checksum for the data part of the Tesla message"""
-    checksum = ((msg_id) & 0xFF) + int((msg_id >> 8) & 0xFF)
-    for i in range(0, len(msg), 1):
-        checksum = (checksum + ord(msg[i])) & 0xFF
-    return checksum
+    return ((msg_id & 0xFF) + ((msg_id >> 8) & 0xFF) + sum(bytes(msg))) & 0xFF
+
+
+_PEDAL_MSG_ID = 0x551
+_PEDAL_CHECKSUM_BASE = (_PEDAL_MSG_ID & 0xFF) + ((_PEDAL_MSG_ID >> 8) & 0xFF)
 
 
 def create_pedal_command_msg(accelCommand, enable, idx, pedalcan):
     """Create GAS_COMMAND (0x551) message to comma pedal"""
-    msg_id = 0x551
-    msg_len = 6
-    msg = create_string_buffer(msg_len)
     m1 = 0.050796813
     m2 = 0.101593626
     d = -22.85856576
@@ -294,35 +63,21 @@ def create_pedal_command_msg(accelCommand, enable, idx, pedalcan):
     else:
         int_accelCommand = 0
         int_accelCommand2 = 0
-    msg = create_string_buffer(msg_len)
-    struct.pack_into(
-        "BBBBB",
-        msg,
-        0,
-        int((int_accelCommand >> 8) & 0xFF),
-        int_accelCommand & 0xFF,
-        int((int_accelCommand2 >> 8) & 0xFF),
-        int_accelCommand2 & 0xFF,
-        ((enable << 7) + idx) & 0xFF,
-    )
-    struct.pack_into("B", msg, msg_len - 1, add_tesla_checksum(msg_id, msg))
-    return [msg_id, 0, msg.raw, pedalcan]
+    b0 = (int_accelCommand >> 8) & 0xFF
+    b1 = int_accelCommand & 0xFF
+    b2 = (int_accelCommand2 >> 8) & 0xFF
+    b3 = int_accelCommand2 & 0xFF
+    b4 = ((enable << 7) + idx) & 0xFF
+    checksum = (_PEDAL_CHECKSUM_BASE + b0 + b1 + b2 + b3 + b4) & 0xFF
+    return [_PEDAL_MSG_ID, 0, _PACK_6B.pack(b0, b1, b2, b3, b4, checksum), pedalcan]
 
 
 def create_enabled_eth_msg(status):
-    msg_id = 0x018
-    msg_len = 1
-    msg = create_string_buffer(msg_len)
-    struct.pack_into("B", msg, 0, status)
-    return [msg_id, 0, msg.raw, 0]
+    return [0x018, 0, _PACK_1B.pack(status), 0]
 
 
 def create_fake_IC_msg():
-    msg_id = 0x649
-    msg_len = 8
-    msg = create_string_buffer(msg_len)
-    struct.pack_into("BBBBBBBB", msg, 0, 0xFF, 0xFF, 0x01, 0x02, 0x03, 0x04, 0xFF, 0x00)
-    return [msg_id, 0, msg.raw, 0]
+    return [0x649, 0, _FAKE_IC_DATA, 0]
 
 
 def create_radar_VIN_msg(
@@ -335,13 +90,8 @@ def create_radar_VIN_msg(
     radarEpasType,
 ):
     msg_id = 0x560
-    msg_len = 8
-    msg = create_string_buffer(msg_len)
     if radarId == 0:
-        struct.pack_into(
-            "BBBBBBBB",
-            msg,
-            0,
+        data = _PACK_8B.pack(
             radarId,
             radarCAN,
             useRadar + (radarPosition << 1) + (radarEpasType << 3),
@@ -351,43 +101,19 @@ def create_radar_VIN_msg(
             ord(radarVIN[1]),
             ord(radarVIN[2]),
         )
-    if radarId == 1:
-        struct.pack_into(
-            "BBBBBBBB",
-            msg,
-            0,
-            radarId,
-            ord(radarVIN[3]),
-            ord(radarVIN[4]),
-            ord(radarVIN[5]),
-            ord(radarVIN[6]),
-            ord(radarVIN[7]),
-            ord(radarVIN[8]),
-            ord(radarVIN[9]),
-        )
-    if radarId == 2:
-        struct.pack_into(
-            "BBBBBBBB",
-            msg,
-            0,
-            radarId,
-            ord(radarVIN[10]),
-            ord(radarVIN[11]),
-            ord(radarVIN[12]),
-            ord(radarVIN[13]),
-            ord(radarVIN[14]),
-            ord(radarVIN[15]),
-            ord(radarVIN[16]),
-        )
-    return [msg_id, 0, msg.raw, 0]
+    elif radarId == 1:
+        data = _PACK_8B.pack(radarId, *map(ord, radarVIN[3:10]))
+    elif radarId == 2:
+        data = _PACK_8B.pack(radarId, *map(ord, radarVIN[10:17]))
+    else:
+        data = _EMPTY_8B
+    return [msg_id, 0, data, 0]
 
 
 def create_DAS_LR_object_msg(
     lane, v1Class, v1Id, v1Dx, v1Dy, v1V, v2Class, v2Id, v2Dx, v2Dy, v2V
 ):
     msg_id = 0x559
-    msg_len = 8
-    msg = create_string_buffer(msg_len)
     important1 = 0
     important2 = 0
     if (v1Dx > 0) and (v1Id >= 0):
@@ -425,10 +151,7 @@ def create_DAS_LR_object_msg(
         v2v = 0x0F
         important2 = 0
         v2Class = 0
-    struct.pack_into(
-        "BBBBBBBB",
-        msg,
-        0,
+    data = _PACK_8B.pack(
         lane + (v1Class << 3) + (important1 << 7),
         v1x,
         v1v + ((v1y << 4) & 0xF0),
@@ -441,24 +164,19 @@ def create_DAS_LR_object_msg(
         int((v2v >> 1) & 0x07) + ((v2y << 3) & 0xF8),
         int((v2y >> 5) & 0x03) + ((v2Id << 2) & 0xFC),
     )
-    return [msg_id, 0, msg.raw, 0]
+    return [msg_id, 0, data, 0]
 
 
 def create_fake_DAS_msg2(
     hiLoBeamStatus, hiLoBeamReason, ahbIsEnabled, fleet_speed_state
 ):
     msg_id = 0x65A
-    msg_len = 3
-    msg = create_string_buffer(msg_len)
-    struct.pack_into(
-        "BBB",
-        msg,
-        0,
+    data = _PACK_3B.pack(
         hiLoBeamStatus,
         hiLoBeamReason,
         (1 if ahbIsEnabled else 0) + (fleet_speed_state << 1),
     )
-    return [msg_id, 0, msg.raw, 0]
+    return [msg_id, 0, data, 0]
 
 
 def create_fake_DAS_msg(
@@ -482,16 +200,11 @@ def create_fake_DAS_msg(
     park_brake_request,
 ):
     msg_id = 0x659  # we will use DAS_udsRequest to send this info to IC
-    msg_len = 8
-    msg = create_string_buffer(msg_len)
     units_included = 1
     c_apply_steer = int(
         ((int(apply_angle * 10 + 0x4000)) & 0x7FFF) + (enable_steer_control << 15)
     )
-    struct.pack_into(
-        "BBBBBBBB",
-        msg,
-        0,
+    data = _PACK_8B.pack(
         int(
             (speed_control_enabled << 7)
             + (speed_override << 6)
@@ -517,7 +230,7 @@ def create_fake_DAS_msg(
         int(c_apply_steer & 0xFF),
         int((c_apply_steer >> 8) & 0xFF),
     )
-    return [msg_id, 0, msg.raw, 0]
+    return [msg_id, 0, data, 0]
 
 
 def create_fake_DAS_obj_lane_msg(
@@ -534,7 +247,6 @@ def create_fake_DAS_obj_lane_msg(
     laneWidth,
 ):
     msg_id = 0x557
-    msg_len = 8
     f = IC_LANE_SCALE
     f2 = f * f
     f3 = f2 * f
@@ -553,11 +265,7 @@ def create_fake_DAS_obj_lane_msg(
     tCurv2 = (int((clip(curv2 * f2, -0.0025, 0.0025) + 0.0025) / 0.00002)) & 0xFF
     tCurv3 = (int((clip(curv3 * f3, -0.00003, 0.00003) + 0.00003) / 0.00000024)) & 0xFF
     lWidth = (int((laneWidth - 2.0) / 0.3125)) & 0x0F
-    msg = create_string_buffer(msg_len)
-    struct.pack_into(
-        "BBBBBBBB",
-        msg,
-        0,
+    data = _PACK_8B.pack(
         tLeadDx,
         tLeadDy,
         (lWidth << 4) + (lLine << 2) + rLine,
@@ -567,25 +275,22 @@ def create_fake_DAS_obj_lane_msg(
         tCurv3,
         ((leadClass & 0x03) << 6) + int(laneRange / 4),
     )
-    return [msg_id, 0, msg.raw, 0]
+    return [msg_id, 0, data, 0]
 
 
 def create_fake_DAS_sign_msg(
     roadSignType, roadSignStopDist, roadSignColor, roadSignControlActive
 ):
     msg_id = 0x556
-    msg_len = 4
     orientation = 0x00  # unknown
     arrow = 0x04  # unknown
     source = 0x02  # vision
-    roadSignStopDist_t = ((roadSignStopDist + 20) / 0.2) & 0x3FF
+    roadSignStopDist_t = int((roadSignStopDist + 20) / 0.2) & 0x3FF
     sign1 = ((roadSignType & 0x03) << 6) + (roadSignColor << 3) + 0x04
     sign2 = ((roadSignStopDist_t & 0x03) << 6) + int((roadSignType >> 2) & 0xFF)
     sign3 = int(roadSignStopDist_t >> 2)
     sign4 = (orientation << 6) + (arrow << 3) + (source << 1) + roadSignControlActive
-    msg = create_string_buffer(msg_len)
-    struct.pack_into("BBBB", msg, 0, sign1, sign2, sign3, sign4)
-    return [msg_id, 0, msg.raw, 0]
+    return [msg_id, 0, _PACK_4B.pack(sign1, sign2, sign3, sign4), 0]
 
 
 def create_fake_DAS_warning(
@@ -610,7 +315,6 @@ def create_fake_DAS_warning(
     usesApillarHarness,
 ):
     msg_id = 0x554
-    msg_len = 3
     fd = 0
     rd = 0
     if enableDasEmulation:
@@ -645,9 +349,7 @@ def create_fake_DAS_warning(
         + (DAS_025_steeringOverride << 7)
     )
     warn3 = ldwStatus + (autoPilotAborting << 3) + (wh << 4) + (aph << 5)
-    msg = create_string_buffer(msg_len)
-    struct.pack_into("BBB", msg, 0, warn1, warn2, warn3)
-    return [msg_id, 0, msg.raw, 0]
+    return [msg_id, 0, _PACK_3B.pack(warn1, warn2, warn3), 0]
 
 
 def create_steering_wheel_stalk_msg(
@@ -682,69 +384,46 @@ def create_steering_wheel_stalk_msg(
 
     """
     msg_id = 0x045  # 69 in hex, STW_ACTN_RQ
-    msg_len = 8
-    msg = create_string_buffer(msg_len)
     # Do not send messages that conflict with the driver's actual actions on the
     # steering wheel stalk. To ensure this, copy all the fields you can from the
     # real cruise stalk message.
-    fake_stalk = real_steering_wheel_stalk.copy()
-
-    if spdCtrlLvr_stat is not None:
+    stalk = real_steering_wheel_stalk
+    vsl_enbl_rq = int(round(stalk["VSL_Enbl_Rq"]))
+    if spdCtrlLvr_stat is None:
+        spdCtrlLvr_stat = int(round(stalk["SpdCtrlLvr_Stat"]))
+    elif spdCtrlLvr_stat in [4, 16]:
         # if accelerating, override VSL_Enbl_Rq to 1.
-        if spdCtrlLvr_stat in [4, 16]:
-            fake_stalk["VSL_Enbl_Rq"] = 1
-        fake_stalk["SpdCtrlLvr_Stat"] = spdCtrlLvr_stat
-    if turnIndLvr_stat is not None:
-        fake_stalk["TurnIndLvr_Stat"] = turnIndLvr_stat
-    if hiBmLvr_stat is not None:
-        fake_stalk["HiBmLvr_Stat"] = hiBmLvr_stat
-    if hrnSw_psd is not None:
-        fake_stalk["HrnSw_Psd"] = hrnSw_psd
+        vsl_enbl_rq = 1
+    if turnIndLvr_stat is None:
+        turnIndLvr_stat = int(round(stalk["TurnIndLvr_Stat"]))
+    if hiBmLvr_stat is None:
+        hiBmLvr_stat = int(round(stalk["HiBmLvr_Stat"]))
+    if hrnSw_psd is None:
+        hrnSw_psd = int(round(stalk["HrnSw_Psd"]))
     # message count should be 1 more than the previous (and loop after 16)
-    fake_stalk["MC_STW_ACTN_RQ"] = (int(round(fake_stalk["MC_STW_ACTN_RQ"])) + 1) % 16
-    # CRC should initially be 0 before a new one is calculated.
-    fake_stalk["CRC_STW_ACTN_RQ"] = 0
-
-    # Set the first byte, containing cruise control
-    struct.pack_into(
-        "B",
-        msg,
-        0,
-        int(round(fake_stalk["SpdCtrlLvr_Stat"]))
-        + (int(round(fake_stalk["VSL_Enbl_Rq"])) << 6),
-    )
-    # Set the 2nd byte, containing DTR_Dist_Rq
-    struct.pack_into("B", msg, 1, int(fake_stalk["DTR_Dist_Rq"]))
-    # Set the 3rd byte, containing turn indicator, highbeams, and wiper wash
-    struct.pack_into(
-        "B",
-        msg,
-        2,
-        int(round(fake_stalk["TurnIndLvr_Stat"]))
-        + (int(round(fake_stalk["HiBmLvr_Stat"])) << 2)
-        + (int(round(fake_stalk["WprWashSw_Psd"])) << 4)
-        + (int(round(fake_stalk["WprWash_R_Sw_Posn_V2"])) << 6),
+    counter = (int(round(stalk["MC_STW_ACTN_RQ"])) + 1) % 16
+
+    # 1st byte: cruise control
+    b0 = spdCtrlLvr_stat + (vsl_enbl_rq << 6)
+    # 2nd byte: DTR_Dist_Rq
+    b1 = int(stalk["DTR_Dist_Rq"])
+    # 3rd byte: turn indicator, highbeams, and wiper wash
+    b2 = (
+        turnIndLvr_stat
+        + (hiBmLvr_stat << 2)
+        + (int(round(stalk["WprWashSw_Psd"])) << 4)
+        + (int(round(stalk["WprWash_R_Sw_Posn_V2"])) << 6)
     )
-    # Set the 4th byte, containing the car horn (and steering wheel adjust lever)?
-    struct.pack_into(
-        "B",
-        msg,
-        3,
-        int(round(fake_stalk["StW_Lvr_Stat"]))
-        + (int(round(fake_stalk["StW_Cond_Flt"])) << 3)
-        + (int(round(fake_stalk["StW_Cond_Psd"])) << 4)
-        + (int(round(fake_stalk["HrnSw_Psd"])) << 6),
+    # 4th byte: the car horn (and steering wheel adjust lever)?
+    b3 = (
+        int(round(stalk["StW_Lvr_Stat"]))
+        + (int(round(stalk["StW_Cond_Flt"])) << 3)
+        + (int(round(stalk["StW_Cond_Psd"])) << 4)
+        + (hrnSw_psd << 6)
     )
-    # Set the 7th byte, containing the wipers and message counter.
-    struct.pack_into(
-        "B",
-        msg,
-        6,
-        int(round(fake_stalk["WprSw6Posn"])) + (fake_stalk["MC_STW_ACTN_RQ"] << 4),
-    )
-
-    # Finally, set the CRC for the message. Must be calculated last!
-    fake_stalk["CRC_STW_ACTN_RQ"] = add_tesla_crc(msg=msg, msg_len=7)
-    struct.pack_into("B", msg, msg_len - 1, int(fake_stalk["CRC_STW_ACTN_RQ"]))
+    # 7th byte: the wipers and message counter.
+    b6 = int(round(stalk["WprSw6Posn"])) + (counter << 4)
 
-    return [msg_id, 0, msg.raw, 0]
+    # Finally, the CRC over the first 7 bytes. Must be calculated last!
+    crc = tesla_crc8((b0, b1, b2, b3, 0, 0, b6))
+    return [msg_id, 0, _PACK_8B.pack(b0, b1, b2, b3, 0, 0, b6, crc), 0]
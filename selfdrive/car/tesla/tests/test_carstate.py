@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import unittest
+from types import SimpleNamespace
+
+from selfdrive.car.tesla.carstate import SignalMap, PT_SIGNAL_MAP, PEDAL_SIGNAL_MAP
+
+
+def fake_parser(signal_map):
+  """The vl and ts of a CANParser with the signals of signal_map"""
+  cp = SimpleNamespace(vl={}, ts={})
+  for _, msg, sig in signal_map:
+    cp.vl.setdefault(msg, {})[sig] = 0
+    cp.ts.setdefault(msg, {})[sig] = 0
+  return cp
+
+
+def receive(cp, msg, t, **values):
+  # like the parser, every signal of the message gets the new timestamp
+  cp.vl[msg].update(values)
+  for sig in cp.ts[msg]:
+    cp.ts[msg][sig] = t
+
+
+class TestSignalMap(unittest.TestCase):
+  def setUp(self):
+    self.cp = fake_parser(PT_SIGNAL_MAP)
+    self.pedal_cp = fake_parser(PEDAL_SIGNAL_MAP)
+    self.signal_map = SignalMap([(self.cp, PT_SIGNAL_MAP), (self.pedal_cp, PEDAL_SIGNAL_MAP)])
+    self.cs = SimpleNamespace()
+
+  def test_first_update_copies_everything(self):
+    self.signal_map.update(self.cs)
+    for attr, _, _ in PT_SIGNAL_MAP + PEDAL_SIGNAL_MAP:
+      self.assertEqual(getattr(self.cs, attr), 0)
+
+  def test_copies_received_messages(self):
+    self.signal_map.update(self.cs)
+    receive(self.cp, "DI_torque2", 1, DI_brakePedal=1)
+    receive(self.pedal_cp, "GAS_SENSOR", 1, INTERCEPTOR_GAS=42.5, IDX=3)
+    self.signal_map.update(self.cs)
+    self.assertEqual(self.cs.brake_switch, 1)
+    self.assertEqual(self.cs.brake_pressed, 1)
+    self.assertEqual(self.cs.pedal_interceptor_value, 42.5)
+    self.assertEqual(self.cs.pedal_idx, 3)
+
+  def test_skips_messages_not_received(self):
+    self.signal_map.update(self.cs)
+    # a value that changed without the message being received isn't copied
+    self.cp.vl["DI_state"]["DI_cruiseState"] = 2
+    self.cs.pcm_acc_status = -1
+    self.signal_map.update(self.cs)
+    self.assertEqual(self.cs.pcm_acc_status, -1)
+
+    self.signal_map.reset()
+    self.signal_map.update(self.cs)
+    self.assertEqual(self.cs.pcm_acc_status, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
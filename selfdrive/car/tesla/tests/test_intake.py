@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+from selfdrive.car.tesla import intake
+
+
+class FakeSocket():
+  """A conflated socket, only the last message sent is kept"""
+  def __init__(self):
+    self.dat = None
+    self.receives = 0
+
+  def send(self, dat):
+    self.dat = dat
+
+  def receive(self, non_blocking=False):
+    self.receives += 1
+    dat, self.dat = self.dat, None
+    return dat
+
+
+class FakePoller():
+  def __init__(self):
+    self.socks = []
+
+  def registerSocket(self, sock):
+    self.socks.append(sock)
+
+  def poll(self, timeout):
+    return [sock for sock in self.socks if sock.dat is not None]
+
+
+def sub_sock(service, poller=None, conflate=False):
+  sock = FakeSocket()
+  poller.registerSocket(sock)
+  return sock
+
+
+class TestMessageIntake(unittest.TestCase):
+  def setUp(self):
+    self.decoded = []
+    def decode(dat):
+      self.decoded.append(dat)
+      return dat.decode()
+
+    with mock.patch.object(intake.messaging, "Poller", FakePoller), \
+         mock.patch.object(intake.messaging, "sub_sock", sub_sock):
+      self.intake = intake.MessageIntake({"radarState": decode, "frame": decode}, {"frame": 3})
+    self.radar = self.intake.socks["radarState"]
+    self.frame = self.intake.socks["frame"]
+
+  def test_receive_once(self):
+    readers = [self.intake.reader() for _ in range(3)]
+    self.radar.send(b"a")
+    self.intake.update()
+    self.assertEqual([r.recv("radarState") for r in readers], ["a"] * 3)
+    self.assertEqual(self.intake.get("radarState"), "a")
+    self.assertEqual(self.radar.receives, 1)
+    self.assertEqual(self.decoded, [b"a"])
+
+    # nothing new, the socket isn't read without the poller saying so
+    self.intake.update()
+    self.assertEqual([r.recv("radarState") for r in readers], [None] * 3)
+    self.assertEqual(self.radar.receives, 1)
+
+  def test_new_messages(self):
+    reader = self.intake.reader()
+    self.intake.update()
+    self.assertIsNone(reader.recv("radarState"))
+    self.assertIsNone(self.intake.get("radarState"))
+
+    self.radar.send(b"a")
+    self.intake.update()
+    self.assertEqual(reader.recv("radarState"), "a")
+    self.assertIsNone(reader.recv("radarState"))
+
+    # the latest message stays around for get, recv returns it once
+    self.intake.update()
+    self.assertIsNone(reader.recv("radarState"))
+    self.assertEqual(self.intake.get("radarState"), "a")
+
+    # a message equal to the last one is new all the same
+    self.radar.send(b"a")
+    self.intake.update()
+    self.assertEqual(reader.recv("radarState"), "a")
+
+  def test_missed_messages(self):
+    every, sometimes = self.intake.reader(), self.intake.reader()
+    for dat in (b"a", b"b", b"c"):
+      self.radar.send(dat)
+      self.intake.update()
+      self.assertEqual(every.recv("radarState"), dat.decode())
+
+    # reading every few iterations only gets the latest message, like a conflated socket
+    self.assertEqual(sometimes.recv("radarState"), "c")
+    self.assertIsNone(sometimes.recv("radarState"))
+
+    # without a reader of the service in between, the ones before the last aren't received at all
+    for dat in (b"d", b"e"):
+      self.radar.send(dat)
+      self.intake.update()
+    self.assertEqual(sometimes.recv("radarState"), "e")
+    self.assertEqual(every.recv("radarState"), "e")
+    self.assertEqual(self.decoded, [b"a", b"b", b"c", b"e"])
+
+  def test_interval(self):
+    reader = self.intake.reader()
+    received = []
+    for i in range(7):
+      self.frame.send(b"%d" % i)
+      self.intake.update()
+      received.append(reader.recv("frame"))
+    self.assertEqual(received, ["0", None, None, "3", None, None, "6"])
+    self.assertEqual(self.frame.receives, 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -2,7 +2,8 @@
 
 import unittest
 import os
-from selfdrive.car.tesla.readconfig import read_config_file, CarSettings
+from unittest import mock
+from selfdrive.car.tesla.readconfig import read_config_file, CarSettings, ConfigFile, reload_settings
 
 
 class CarSettingsTestClass():
@@ -176,6 +177,48 @@ class ReadConfigTests(unittest.TestCase):
     self.assertEqual(value, True)
     os.remove(config_file_path)
 
+  # CarSettings() is made in loops, it must not parse the file every time
+  def test_construction_cost(self):
+    cs = CarSettings(optional_config_file_path=self.test_config_file)
+    self.assertEqual(cs.did_write_file, True)
+
+    # parsed only the first time, later constructions use the cached values
+    with mock.patch.object(ConfigFile, "read", wraps=ConfigFile().read) as read:
+      for _ in range(100):
+        cs = CarSettings(optional_config_file_path=self.test_config_file)
+      self.assertEqual(read.call_count, 0)
+
+      reload_settings(self.test_config_file)
+      for _ in range(100):
+        cs = CarSettings(optional_config_file_path=self.test_config_file)
+      self.assertEqual(read.call_count, 1)
+    self.assertEqual(cs.did_write_file, False)
+    self.check_defaults(cs)
+
+  def test_parsed_again_only_on_change(self):
+    CarSettings(optional_config_file_path=self.test_config_file)
+    with mock.patch.object(ConfigFile, "read", wraps=ConfigFile().read) as read:
+      # same contents, new mtime
+      os.utime(self.test_config_file, ns=(0, 0))
+      CarSettings(optional_config_file_path=self.test_config_file)
+      self.assertEqual(read.call_count, 0)
+
+      with open(self.test_config_file) as f:
+        contents = f.read()
+      with open(self.test_config_file, "w") as f:
+        f.write(contents.replace("force_pedal_over_cc = False", "force_pedal_over_cc = True"))
+      cs = CarSettings(optional_config_file_path=self.test_config_file)
+      self.assertEqual(read.call_count, 1)
+      self.assertEqual(cs.forcePedalOverCC, True)
+
+      cs = CarSettings.reload(self.test_config_file)
+      self.assertEqual(read.call_count, 2)
+      self.assertEqual(cs.forcePedalOverCC, True)
+
+    # an instance can be changed, the others keep the settings of the file
+    cs.forcePedalOverCC = False
+    self.assertEqual(CarSettings(optional_config_file_path=self.test_config_file).forcePedalOverCC, True)
+
   def check_defaults(self, cs):
     self.assertEqual(cs.userHandle, 'your_tinkla_username')
     self.assertEqual(cs.forceFingerprintTesla, False)
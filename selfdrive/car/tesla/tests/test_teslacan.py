@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import unittest
+
+from selfdrive.car.tesla import teslacan
+
+STALK = {
+  "SpdCtrlLvr_Stat": 0.0, "VSL_Enbl_Rq": 1.0, "DTR_Dist_Rq": 255.0, "TurnIndLvr_Stat": 0.0,
+  "HiBmLvr_Stat": 0.0, "WprWashSw_Psd": 0.0, "WprWash_R_Sw_Posn_V2": 0.0, "StW_Lvr_Stat": 0.0,
+  "StW_Cond_Flt": 0.0, "StW_Cond_Psd": 0.0, "HrnSw_Psd": 0.0, "WprSw6Posn": 0.0,
+  "MC_STW_ACTN_RQ": 15.0, "CRC_STW_ACTN_RQ": 0.0,
+}
+VIN = "5YJSA1H21FFP12345"
+
+
+def tick_send_set():
+  """Every frame CarController can send in one tick on an IC integrated car"""
+  return [
+    teslacan.create_pedal_command_msg(0.37, 1, 5, 2),
+    teslacan.create_enabled_eth_msg(1),
+    teslacan.create_fake_IC_msg(),
+    teslacan.create_radar_VIN_msg(0, VIN, 1, 0x2B9, 1, 0, 1),
+    teslacan.create_DAS_LR_object_msg(0, 0, 12, 45.3, -1.2, 3.4, 1, 40, 80.1, 3.3, -4.0),
+    teslacan.create_DAS_LR_object_msg(1, 0, -1, 0, 0, 0, 0, -1, 0, 0, 0),
+    teslacan.create_DAS_LR_object_msg(2, 0, -1, 0, 0, 0, 0, -1, 0, 0, 0),
+    teslacan.create_fake_DAS_msg2(1, 3, True, 2),
+    teslacan.create_fake_DAS_msg(1, 0, 0, 1, 3, 88.0, 1, 0, 1, 5, 2, 1, 9, 64.6, 17, -12.34, 1, 0),
+    teslacan.create_fake_DAS_obj_lane_msg(42.0, 1.5, 1, 3, 2, 0.1, 0.01, 0.0004, 0.000001, 120, 3.6),
+    teslacan.create_fake_DAS_sign_msg(0x01, 35, 1, 0),
+    teslacan.create_fake_DAS_warning(0, 0, 1, 0, 1, 1, 1, 0, 0, 1, 0, 1, 0, 0, 1, 0, 2, 0, 1),
+    teslacan.create_steering_wheel_stalk_msg(STALK, spdCtrlLvr_stat=16, turnIndLvr_stat=0),
+  ]
+
+
+def crc8_bitwise(data):
+  crc = 0xFF
+  for b in data:
+    crc ^= b
+    for _ in range(8):
+      crc = ((crc << 1) ^ 0x1D) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+  return crc ^ 0xFF
+
+
+class TestTeslaCan(unittest.TestCase):
+  def test_crc(self):
+    for data in [b"", b"\x00" * 7, b"\xff" * 7, bytes(range(7)), b"\x50\xff\x00\x00\x00\x00\x00"]:
+      self.assertEqual(teslacan.tesla_crc8(data), crc8_bitwise(data))
+      self.assertEqual(teslacan.add_tesla_crc(bytearray(data) + b"\xaa", len(data)), crc8_bitwise(data))
+
+  def test_frames(self):
+    # payloads produced by the per-frame create_string_buffer encoders
+    expected = {
+      (0x551, 2): "01c900e48589",
+      (0x018, 0): "01",
+      (0x649, 0): "ffff01020304ff00",
+      (0x560, 0): "00010902b935594a",
+      (0x65A, 0): "010305",
+      (0x659, 0): "93586da9411184bf",
+      (0x557, 0): "54445b6689cd9e5e",
+      (0x554, 0): "654a22",
+      (0x045, 0): "50ff000000000064",
+    }
+    for msg_id, _, dat, bus in tick_send_set():
+      self.assertIsInstance(dat, bytes)
+      if (msg_id, bus) in expected:
+        self.assertEqual(dat.hex(), expected[(msg_id, bus)], hex(msg_id))
+
+    self.assertEqual(teslacan.create_radar_VIN_msg(1, VIN, 1, 0x2B9, 1, 0, 1)[2].hex(), "0153413148323146")
+    self.assertEqual(teslacan.create_radar_VIN_msg(2, VIN, 1, 0x2B9, 1, 0, 1)[2].hex(), "0246503132333435")
+    self.assertEqual(teslacan.create_DAS_LR_object_msg(0, 0, 12, 45.3, -1.2, 3.4, 1, 40, 80.1, 3.3, -4.0)[2].hex(), "882db76308a843a2")
+    self.assertEqual(teslacan.create_steering_wheel_stalk_msg(STALK, hiBmLvr_stat=1, hrnSw_psd=1)[2].hex(), "40ff0440000000fc")
+
+
+if __name__ == "__main__":
+  unittest.main()
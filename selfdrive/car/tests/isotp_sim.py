@@ -0,0 +1,216 @@
+"""Simulated ECUs for running IsoTpParallelQuery without a car.
+
+SimCanBus delivers the frames of the simulated ECUs in real time, SimIsoTpParallelQuery
+talks to it instead of the can sockets. ECUs can be made up or rebuilt from the UDS
+traffic recorded in a log, which replays the responses with their original latency:
+
+  bus = SimCanBus(1)
+  for ecu in ecus_from_frames(*frames_from_log(LogReader(path), 1)):
+    bus.add_ecu(ecu)
+  with sim_queries():
+    vin, car_fw = get_vin_and_fw_versions(bus, bus, 1)
+"""
+import heapq
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+from panda.python.uds import FUNCTIONAL_ADDRS, get_rx_addr_for_tx_addr
+from selfdrive.car.fingerprints import FW_VERSIONS
+from selfdrive.car.isotp_parallel_query import IsoTpParallelQuery, is_functional_rx_addr
+
+# delay between the frames of one multi frame message
+FRAME_SEPARATION = 0.0005
+
+
+def sub_addressed_tx_addrs():
+  return {addr for fws in FW_VERSIONS.values() for _, addr, sub_addr in fws if sub_addr is not None}
+
+
+class SimEcu():
+  """ISO-TP responder on tx_addr. responses maps request to response bytes, or to
+  (response, delay) to answer after a different delay than the default."""
+  def __init__(self, tx_addr, rx_addr, responses, delay=0.005, sub_addr=None):
+    self.tx_addr = tx_addr
+    self.rx_addr = rx_addr
+    self.responses = responses
+    self.delay = delay
+    self.sub_addr = sub_addr
+    self.max_len = 8 if sub_addr is None else 7
+    self.bus = None
+
+    self.rx_dat = b""
+    self.rx_len = 0
+    self.tx_frames = []
+
+  def _send(self, frames, delay):
+    for i, f in enumerate(frames):
+      if self.sub_addr is not None:
+        f = bytes([self.sub_addr]) + f
+      self.bus.schedule(delay + i * FRAME_SEPARATION, self.rx_addr, f.ljust(8, b"\x00"))
+
+  def _respond(self, request):
+    response = self.responses.get(bytes(request))
+    if response is None:
+      return
+    response, delay = response if isinstance(response, tuple) else (response, self.delay)
+
+    if len(response) < self.max_len:
+      self._send([bytes([len(response)]) + response], delay)
+      return
+
+    # first frame now, the consecutive frames once the tester sent flow control
+    n = self.max_len - 2
+    self._send([bytes([0x10 | (len(response) >> 8), len(response) & 0xFF]) + response[:n]], delay)
+    self.tx_frames = []
+    for i, idx in enumerate(range(n, len(response), self.max_len - 1)):
+      self.tx_frames.append(bytes([0x20 | ((i + 1) & 0xF)]) + response[idx:idx + self.max_len - 1])
+
+  def on_frame(self, dat):
+    if self.sub_addr is not None:
+      if dat[0] != self.sub_addr:
+        return
+      dat = dat[1:]
+
+    frame_type = dat[0] >> 4
+    if frame_type == 0x0:
+      self._respond(dat[1:1 + dat[0]])
+    elif frame_type == 0x1:
+      self.rx_len = ((dat[0] & 0xF) << 8) + dat[1]
+      self.rx_dat = dat[2:]
+      self._send([b"\x30\x00\x00"], FRAME_SEPARATION)
+    elif frame_type == 0x2:
+      self.rx_dat += dat[1:]
+      if len(self.rx_dat) >= self.rx_len:
+        self._respond(self.rx_dat[:self.rx_len])
+    elif frame_type == 0x3 and self.tx_frames:
+      self._send(self.tx_frames, FRAME_SEPARATION)
+      self.tx_frames = []
+
+
+class SimCanBus():
+  def __init__(self, bus):
+    self.bus = bus
+    self.ecus = {}
+    self.queue = []
+    self.seq = 0
+    # every frame as (time, address, dat), for checking what went over the bus
+    self.sent = []
+    self.received = []
+
+  def add_ecu(self, ecu):
+    ecu.bus = self
+    self.ecus.setdefault(ecu.tx_addr, []).append(ecu)
+
+  def schedule(self, delay, addr, dat):
+    self.seq += 1
+    heapq.heappush(self.queue, (time.monotonic() + delay, self.seq, addr, bytes(dat)))
+
+  def send(self, addr, dat):
+    self.sent.append((time.monotonic(), addr, bytes(dat)))
+    for ecu in self.ecus.get(addr, []):
+      ecu.on_frame(bytes(dat))
+
+  def recv(self, timeout):
+    """Waits up to timeout seconds for frames, returns them as (address, busTime, dat, src)"""
+    end = time.monotonic() + max(timeout, 0)
+    while True:
+      now = time.monotonic()
+      msgs = []
+      while self.queue and self.queue[0][0] <= now:
+        t, _, addr, dat = heapq.heappop(self.queue)
+        self.received.append((t, addr, dat))
+        msgs.append((addr, 0, dat, self.bus))
+      if msgs or now >= end:
+        return msgs
+      time.sleep(min(self.queue[0][0] if self.queue else end, end) - now)
+
+
+class SimIsoTpParallelQuery(IsoTpParallelQuery):
+  """IsoTpParallelQuery on a SimCanBus, which is passed as both sendcan and logcan"""
+  def _can_tx(self, tx_addr, dat, bus):
+    self.sendcan.send(tx_addr, dat)
+
+  def _recv_can(self, timeout):
+    return self.logcan.recv(timeout)
+
+
+@contextmanager
+def sim_queries():
+  """Makes the FW and VIN queries use SimIsoTpParallelQuery"""
+  with mock.patch("selfdrive.car.fw_versions.IsoTpParallelQuery", SimIsoTpParallelQuery), \
+       mock.patch("selfdrive.car.vin.IsoTpParallelQuery", SimIsoTpParallelQuery):
+    yield
+
+
+def frames_from_log(lr, bus):
+  """Returns the (time, address, dat) frames sent to and received from bus in a log"""
+  sent, received = [], []
+  for msg in lr:
+    if msg.which() in ("sendcan", "can"):
+      frames = sent if msg.which() == "sendcan" else received
+      for c in getattr(msg, msg.which()):
+        if c.src == bus:
+          frames.append((msg.logMonoTime * 1e-9, c.address, bytes(c.dat)))
+  return sent, received
+
+
+def _isotp_payloads(frames, sub_addr_tx):
+  """Reassembles ISO-TP messages, returns {(address, sub_addr): [(time of first frame, payload)]}"""
+  ret = {}
+  state = {}
+  for t, addr, dat in frames:
+    sub_addr = None
+    if addr in sub_addr_tx and len(dat) > 0:
+      sub_addr, dat = dat[0], dat[1:]
+    if len(dat) == 0:
+      continue
+
+    key = (addr, sub_addr)
+    frame_type = dat[0] >> 4
+    if frame_type == 0x0:
+      ret.setdefault(key, []).append((t, dat[1:1 + dat[0]]))
+    elif frame_type == 0x1:
+      state[key] = [t, ((dat[0] & 0xF) << 8) + dat[1], dat[2:]]
+    elif frame_type == 0x2 and key in state:
+      state[key][2] += dat[1:]
+      if len(state[key][2]) >= state[key][1]:
+        t0, length, payload = state.pop(key)
+        ret.setdefault(key, []).append((t0, payload[:length]))
+  return ret
+
+
+def ecus_from_frames(sent, received, sub_addr_tx=None):
+  """Builds SimEcus that answer the requests in sent like the recorded responses in received"""
+  if sub_addr_tx is None:
+    sub_addr_tx = sub_addressed_tx_addrs()
+  # responses carry the sub address of the ECU on its rx address too
+  sub_addr_rx = {get_rx_addr_for_tx_addr(a) for a in sub_addr_tx}
+
+  requests = _isotp_payloads(sent, sub_addr_tx)
+  responses = _isotp_payloads(received, sub_addr_rx)
+
+  ecus = {}
+  for (rx_addr, sub_addr), payloads in responses.items():
+    # the request the response is for is the last one that could be answered on its address
+    candidates = []
+    if is_functional_rx_addr(rx_addr):
+      candidates.append((next(a for a in FUNCTIONAL_ADDRS if rx_addr - a <= 32), None))
+    candidates += [(tx_addr, s) for (tx_addr, s) in requests if s == sub_addr and tx_addr not in FUNCTIONAL_ADDRS and
+                   get_rx_addr_for_tx_addr(tx_addr) == rx_addr]
+
+    for t_response, response in payloads:
+      last = None
+      for key in candidates:
+        for t_request, request in requests.get(key, []):
+          if t_request <= t_response and (last is None or t_request > last[0]):
+            last = (t_request, key, request)
+      if last is None:
+        continue
+
+      t_request, (tx_addr, _), request = last
+      if (tx_addr, rx_addr, sub_addr) not in ecus:
+        ecus[(tx_addr, rx_addr, sub_addr)] = SimEcu(tx_addr, rx_addr, {}, sub_addr=sub_addr)
+      ecus[(tx_addr, rx_addr, sub_addr)].responses[request] = (response, t_response - t_request)
+
+  return list(ecus.values())
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from selfdrive.car.fingerprints import _FINGERPRINTS, IGNORED_FINGERPRINTS, _DEBUG_ADDRESS, all_known_cars, \
+                                       eliminate_incompatible_cars, is_valid_for_fingerprint
+
+
+class Msg():
+  def __init__(self, address, length):
+    self.address = address
+    self.dat = b"\x00" * length
+
+
+def eliminate_by_scanning(msg, candidate_cars):
+  compatible_cars = []
+  for car_name in candidate_cars:
+    if car_name in IGNORED_FINGERPRINTS:
+      continue
+    if any(is_valid_for_fingerprint(msg, {**f, **_DEBUG_ADDRESS}) for f in _FINGERPRINTS[car_name]):
+      compatible_cars.append(car_name)
+  return compatible_cars
+
+
+class TestFingerprintIndex(unittest.TestCase):
+  def test_matches_scanning(self):
+    random.seed(0)
+    msgs = [(adr, ln) for fingerprints in _FINGERPRINTS.values() for f in fingerprints for adr, ln in f.items()]
+    for car_name in all_known_cars():
+      # a car's own fingerprint always keeps it, with a few other messages mixed in
+      fingerprint = random.choice(_FINGERPRINTS[car_name])
+      stream = list(fingerprint.items()) + random.sample(msgs, 5) + [(0x800, 8), (1880, 8)]
+      expected = actual = all_known_cars()
+      for adr, ln in stream:
+        expected = eliminate_by_scanning(Msg(adr, ln), expected)
+        actual = eliminate_incompatible_cars(Msg(adr, ln), actual)
+        self.assertEqual(actual, expected)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 import unittest
 from cereal import car
-from selfdrive.car.fw_versions import match_fw_to_car
+from selfdrive.car.fingerprints import FW_VERSIONS
+from selfdrive.car.fw_versions import match_fw_to_car, match_fw_to_car_scores
 from selfdrive.car.toyota.values import CAR as TOYOTA
 
 CarFw = car.CarParams.CarFw
@@ -41,6 +42,20 @@ class TestFwFingerprint(unittest.TestCase):
 
     self.assertFingerprints(match_fw_to_car(CP.carFw), TOYOTA.RAV4_TSS2)
 
+  def test_every_car_matches_itself(self):
+    for car_name, fws in FW_VERSIONS.items():
+      car_fw = [CarFw.new_message(ecu=ecu, fwVersion=versions[-1], address=addr, subAddress=sub_addr or 0)
+                for (ecu, addr, sub_addr), versions in fws.items()]
+      self.assertIn(car_name, match_fw_to_car(car_fw))
+      matched, checked = match_fw_to_car_scores(car_fw)[car_name]
+      self.assertEqual(matched, len(fws))
+      self.assertEqual(checked, len(fws))
+
+      # a version nobody has rules the car out, but it still scores as a partial match
+      car_fw[0].fwVersion = b"\x00unknown"
+      self.assertNotIn(car_name, match_fw_to_car(car_fw))
+      self.assertEqual(match_fw_to_car_scores(car_fw)[car_name], (len(fws) - 1, len(fws)))
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import time
+import unittest
+
+from selfdrive.car.fw_versions import get_fw_versions, get_vin_and_fw_versions, match_fw_to_car
+from selfdrive.car.toyota.values import CAR as TOYOTA
+from selfdrive.car.tests.isotp_sim import SimCanBus, SimEcu, SimIsoTpParallelQuery, ecus_from_frames, sim_queries
+
+VIN = "JTMW1RFV0KD012345"
+RAV4_TSS2_FW = {
+  (0x7b0, None): b"\x01F15260R210\x00\x00\x00\x00\x00\x00",
+  (0x700, None): b"\x028966342Y8000\x00\x00\x00\x00897CF1201001\x00\x00\x00\x00",
+  (0x7a1, None): b"\x028965B0R01200\x00\x00\x00\x008965B0R02200\x00\x00\x00\x00",
+  (0x750, 0xf): b"\x018821F3301200\x00\x00\x00\x00",
+  (0x750, 0x6d): b"\x028646F4203300\x00\x00\x00\x008646G26011A0\x00\x00\x00\x00",
+}
+
+
+def toyota_ecu(tx_addr, sub_addr, version, delay=0.005):
+  responses = {b"\x3e": b"\x7e", b"\x1a\x88\x01": b"\x5a\x88\x01" + version}
+  return SimEcu(tx_addr, tx_addr + 8, responses, delay=delay, sub_addr=sub_addr)
+
+
+def rav4_bus():
+  bus = SimCanBus(1)
+  for (addr, sub_addr), version in RAV4_TSS2_FW.items():
+    bus.add_ecu(toyota_ecu(addr, sub_addr, version))
+  bus.add_ecu(SimEcu(0x7df, 0x7e8, {b"\x09\x02": b"\x49\x02\x01" + VIN.encode()}))
+  return bus
+
+
+class TestIsoTpParallelQuery(unittest.TestCase):
+  def test_fw_versions(self):
+    bus = rav4_bus()
+    with sim_queries():
+      vin, car_fw = get_vin_and_fw_versions(bus, bus, 1)
+
+    self.assertEqual(vin, VIN)
+    self.assertEqual({(f.address, f.subAddress or None): f.fwVersion for f in car_fw}, RAV4_TSS2_FW)
+    self.assertEqual(match_fw_to_car(car_fw), {TOYOTA.RAV4_TSS2})
+
+  def test_early_completion(self):
+    bus = rav4_bus()
+    query = SimIsoTpParallelQuery(bus, bus, 1, [0x7b0, 0x700, 0x7a1], [b"\x1a\x88\x01"], [b"\x5a\x88\x01"])
+    t = time.monotonic()
+    results = query.get_data(1.)
+    self.assertLess(time.monotonic() - t, 0.1)
+    self.assertEqual(len(results), 3)
+
+  def test_slow_ecu(self):
+    # a slow ECU only holds up its own address
+    bus = rav4_bus()
+    bus.add_ecu(toyota_ecu(0x7c0, None, b"slow", delay=0.3))
+    query = SimIsoTpParallelQuery(bus, bus, 1, [0x7b0, 0x700, 0x7c0, 0x7d0], [b"\x1a\x88\x01"], [b"\x5a\x88\x01"])
+    results = query.get_data(0.5)
+    self.assertEqual(set(results), {(0x7b0, None), (0x700, None), (0x7c0, None)})
+    self.assertLess(query.response_times[(0, (0x700, None))], 0.1)
+    self.assertGreater(query.response_times[(0, (0x7c0, None))], 0.29)
+
+  def test_sub_addresses_one_by_one(self):
+    # sub addresses of one tx address take turns, other addresses don't wait for them
+    bus = SimCanBus(1)
+    bus.add_ecu(toyota_ecu(0x750, 0xf, b"abc", delay=0.2))
+    bus.add_ecu(toyota_ecu(0x750, 0x6d, b"def", delay=0.2))
+    bus.add_ecu(toyota_ecu(0x7b0, None, b"ghi", delay=0.2))
+    query = SimIsoTpParallelQuery(bus, bus, 1, [(0x750, 0xf), (0x750, 0x6d), 0x7b0], [b"\x1a\x88\x01"], [b"\x5a\x88\x01"])
+    t = time.monotonic()
+    results = query.get_data(0.5)
+    self.assertGreater(time.monotonic() - t, 0.39)
+    self.assertLess(query.response_times[(0, (0x7b0, None))], 0.3)
+    self.assertEqual(results, {(0x750, 0xf): b"abc", (0x750, 0x6d): b"def", (0x7b0, None): b"ghi"})
+
+  def test_replay(self):
+    # record a query, rebuild the ECUs from the traffic and get the same answers
+    bus = rav4_bus()
+    with sim_queries():
+      expected = get_fw_versions(bus, bus, 1)
+
+    replay_bus = SimCanBus(1)
+    for ecu in ecus_from_frames(bus.sent, bus.received):
+      replay_bus.add_ecu(ecu)
+    with sim_queries():
+      car_fw = get_fw_versions(replay_bus, replay_bus, 1)
+
+    self.assertEqual({(f.address, f.subAddress, f.fwVersion) for f in car_fw},
+                     {(f.address, f.subAddress, f.fwVersion) for f in expected})
+
+
+if __name__ == "__main__":
+  unittest.main()
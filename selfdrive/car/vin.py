@@ -11,12 +11,25 @@ VIN_RESPONSE = b'\x49\x02\x01'
 VIN_UNKNOWN = "0" * 17
 
 
+def add_vin_query(query):
+  """Queues the VIN request on an IsoTpParallelQuery, returns the index of its results"""
+  return query.add_query(FUNCTIONAL_ADDRS, [VIN_REQUEST], [VIN_RESPONSE], functional_addr=True)
+
+
+def vin_from_results(results):
+  for addr, vin in results.items():
+    return addr[0], vin.decode()
+  return None
+
+
 def get_vin(logcan, sendcan, bus, timeout=0.1, retry=5, debug=False):
   for i in range(retry):
     try:
-      query = IsoTpParallelQuery(sendcan, logcan, bus, FUNCTIONAL_ADDRS, [VIN_REQUEST], [VIN_RESPONSE], functional_addr=True, debug=debug)
-      for addr, vin in query.get_data(timeout).items():
-        return addr[0], vin.decode()
+      query = IsoTpParallelQuery(sendcan, logcan, bus, debug=debug)
+      add_vin_query(query)
+      ret = vin_from_results(query.get_data(timeout))
+      if ret is not None:
+        return ret
       print(f"vin query retry ({i+1}) ...")
     except Exception:
       cloudlog.warning(f"VIN query exception: {traceback.format_exc()}")
@@ -4,7 +4,7 @@ from cereal import car, log
 from common.hardware import HARDWARE
 from common.numpy_fast import clip
 from common.realtime import sec_since_boot, config_rt_process, Priority, Ratekeeper, DT_CTRL
-from common.profiler import Profiler
+from common.profiler import latency_profiler
 from common.params import Params, put_nonblocking
 import cereal.messaging as messaging
 from selfdrive.config import Conversions as CV
@@ -145,7 +145,7 @@ class Controls:
 
     # controlsd is driven by can recv, expected at 100Hz
     self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    self.prof = latency_profiler("controlsd")
 
   def update_events(self, CS):
     """Compute carEvents from carState"""
@@ -536,33 +536,39 @@ class Controls:
 
   def step(self):
     start_time = sec_since_boot()
-    self.prof.checkpoint("Ratekeeper", ignore=True)
+    self.prof.start()
 
     # Sample data from sockets and get a carState
     CS = self.data_sample()
-    self.prof.checkpoint("Sample")
+    self.prof.checkpoint("data_sample")
 
     self.update_events(CS)
+    self.prof.checkpoint("update_events")
 
     if not self.read_only:
       # Update control state
       self.state_transition(CS)
-      self.prof.checkpoint("State transition")
+      self.prof.checkpoint("state_transition")
 
     # Compute actuators (runs PID loops and lateral MPC)
     actuators, v_acc, a_acc, lac_log = self.state_control(CS)
 
-    self.prof.checkpoint("State Control")
+    self.prof.checkpoint("state_control")
 
     # Publish data
     self.publish_logs(CS, start_time, actuators, v_acc, a_acc, lac_log)
-    self.prof.checkpoint("Sent")
+    self.prof.checkpoint("publish_logs")
+    self.prof.end()
 
   def controlsd_thread(self):
     while True:
       self.step()
       self.rk.monitor_time()
-      self.prof.display()
+
+def make_step(sm=None, pm=None, logcan=None):
+  """Sets up controlsd, returns a function that runs one iteration of its loop"""
+  return Controls(sm, pm, logcan).step
+
 
 def main(sm=None, pm=None, logcan=None):
   controls = Controls(sm, pm, logcan)
@@ -1,6 +1,7 @@
 from functools import total_ordering
-from typing import Dict, Union, Callable, Any
+from typing import Dict, Tuple, Union, Callable, Any
 
+import numpy as np
 from cereal import log, car
 import cereal.messaging as messaging
 from common.realtime import DT_CTRL
@@ -35,12 +36,18 @@ class ET:
 
 # get event name from enum
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
+NUM_EVENTS = max(EVENT_NAME) + 1
 
 class Events:
   def __init__(self):
     self.events = []
     self.static_events = []
-    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+    # bitmask of the events, bit n is set when event n is in self.events
+    self.mask = 0
+    self.static_mask = 0
+    # number of iterations in a row each event has been active before this one
+    self.events_prev = np.zeros(NUM_EVENTS, dtype=np.int64)
+    self._active = np.zeros(NUM_EVENTS, dtype=bool)
 
   @property
   def names(self):
@@ -52,47 +59,68 @@ class Events:
   def add(self, event_name, static=False):
     if static:
       self.static_events.append(event_name)
+      self.static_mask |= 1 << event_name
     self.events.append(event_name)
+    self.mask |= 1 << event_name
 
   def clear(self):
-    self.events_prev = {k: (v+1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    self._active[:] = False
+    self._active[self.events] = True
+    self.events_prev += 1
+    self.events_prev *= self._active
+
     self.events = self.static_events.copy()
+    self.mask = self.static_mask
 
   def any(self, event_type):
-    for e in self.events:
-      if event_type in EVENTS.get(e, {}).keys():
-        return True
-    return False
+    return (self.mask & EVENT_TYPE_MASKS.get(event_type, 0)) != 0
 
   def create_alerts(self, event_types, callback_args=None):
     if callback_args is None:
       callback_args = []
 
+    types_mask = 0
+    for et in event_types:
+      types_mask |= EVENT_TYPE_MASKS.get(et, 0)
+
     ret = []
+    if not self.mask & types_mask:
+      return ret
+
     for e in self.events:
-      types = EVENTS[e].keys()
+      if not (1 << e) & types_mask:
+        continue
+
+      alerts = EVENTS[e]
       for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
-          if not isinstance(alert, Alert):
-            alert = alert(*callback_args)
-
-          if DT_CTRL * (self.events_prev[e] + 1) >= alert.creation_delay:
-            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
-            ret.append(alert)
+        alert = alerts.get(et)
+        if alert is None:
+          continue
+        if not isinstance(alert, Alert):
+          alert = alert(*callback_args)
+
+        if not alert.creation_delay or DT_CTRL * (self.events_prev.item(e) + 1) >= alert.creation_delay:
+          alert.alert_type = ALERT_TYPE_NAMES[(e, et)]
+          ret.append(alert)
     return ret
 
   def add_from_msg(self, events):
     for e in events:
-      self.events.append(e.name.raw)
+      name = e.name.raw
+      self.events.append(name)
+      self.mask |= 1 << name
 
   def to_msg(self):
+    """The CarEvents of the active events. They're shared between calls, so
+    they must not be changed"""
     ret = []
     for event_name in self.events:
-      event = car.CarEvent.new_message()
-      event.name = event_name
-      for event_type in EVENTS.get(event_name, {}).keys():
-        setattr(event, event_type , True)
+      event = EVENT_MSGS.get(event_name)
+      if event is None:
+        event = EVENT_MSGS[event_name] = car.CarEvent.new_message()
+        event.name = event_name
+        for event_type in EVENTS.get(event_name, {}).keys():
+          setattr(event, event_type, True)
       ret.append(event)
     return ret
 
@@ -792,3 +820,14 @@ EVENTS: Dict[int, Dict[str, Union[Alert, Callable[[Any, messaging.SubMaster, boo
   },
 
 }
+
+# bitmask of the events that have alerts of each event type
+EVENT_TYPE_MASKS: Dict[str, int] = {}
+ALERT_TYPE_NAMES: Dict[Tuple[int, str], str] = {}
+for _e, _alerts in EVENTS.items():
+  for _et in _alerts:
+    EVENT_TYPE_MASKS[_et] = EVENT_TYPE_MASKS.get(_et, 0) | (1 << _e)
+    ALERT_TYPE_NAMES[(_e, _et)] = f"{EVENT_NAME[_e]}/{_et}"
+
+# CarEvent of each event name, built the first time it's sent
+EVENT_MSGS: Dict[int, Any] = {}
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from cereal import car
 from common.params import Params
+from common.profiler import latency_profiler
 from common.realtime import Priority, config_rt_process
 from selfdrive.swaglog import cloudlog
 from selfdrive.controls.lib.planner import Planner
@@ -9,8 +10,8 @@ from selfdrive.controls.lib.pathplanner import PathPlanner
 import cereal.messaging as messaging
 
 
-def plannerd_thread(sm=None, pm=None):
-
+def make_step(sm=None, pm=None):
+  """Sets up plannerd, returns a function that runs one iteration of its loop"""
   config_rt_process(2, Priority.CTRL_LOW)
 
   cloudlog.info("plannerd is waiting for CarParams")
@@ -34,13 +35,28 @@ def plannerd_thread(sm=None, pm=None):
   sm['liveParameters'].steerRatio = CP.steerRatio
   sm['liveParameters'].stiffnessFactor = 1.0
 
-  while True:
+  prof = latency_profiler("plannerd")
+
+  def step():
     sm.update()
 
+    # time spent waiting for messages isn't part of the iteration
+    prof.start()
     if sm.updated['model']:
       PP.update(sm, pm, CP, VM)
+      prof.checkpoint("pathplanner")
     if sm.updated['radarState']:
       PL.update(sm, pm, CP, VM, PP)
+      prof.checkpoint("planner")
+    prof.end()
+
+  return step
+
+
+def plannerd_thread(sm=None, pm=None):
+  step = make_step(sm, pm)
+  while True:
+    step()
 
 
 def main(sm=None, pm=None):
@@ -7,6 +7,7 @@ import cereal.messaging as messaging
 from cereal import car
 from common.numpy_fast import interp
 from common.params import Params
+from common.profiler import latency_profiler
 from common.realtime import Ratekeeper, Priority, set_realtime_priority
 from selfdrive.config import RADAR_TO_CAMERA
 from selfdrive.controls.lib.cluster.fastcluster_py import cluster_points_centroid
@@ -173,7 +174,8 @@ class RadarD():
 
 
 # fuses camera and radar data for best lead detection
-def radard_thread(sm=None, pm=None, can_sock=None):
+def make_step(sm=None, pm=None, can_sock=None):
+  """Sets up radard, returns a function that runs one iteration of its loop"""
   set_realtime_priority(Priority.CTRL_LOW)
 
   # wait for stats about the car to come in from controls
@@ -203,21 +205,26 @@ def radard_thread(sm=None, pm=None, can_sock=None):
   # TODO: always log leads once we can hide them conditionally
   enable_lead = CP.openpilotLongitudinalControl or not CP.radarOffCan
 
-  while 1:
+  prof = latency_profiler("radard")
+
+  def step():
     can_strings = messaging.drain_sock_raw(can_sock, wait_for_one=True)
+    prof.start()
     # This looks like a useless tesla hack. See if it can be removed?
     if CP.carName == "tesla":
       rr, rrext, ahbCarDetected = RI.update(can_strings, v_ego=0)
     else:
       rr = RI.update(can_strings)
+    prof.checkpoint("radar_interface")
 
     if rr is None:
-      continue
+      return
 
     sm.update(0)
 
     dat = RD.update(rk.frame, sm, rr, enable_lead)
     dat.radarState.cumLagMs = -rk.remaining*1000.
+    prof.checkpoint("radard_update")
 
     pm.send('radarState', dat)
 
@@ -233,9 +240,19 @@ def radard_thread(sm=None, pm=None, can_sock=None):
         "vRel": float(tracks[ids].vRel),
       }
     pm.send('liveTracks', dat)
+    prof.checkpoint("publish")
+    prof.end()
 
     rk.monitor_time()
 
+  return step
+
+
+def radard_thread(sm=None, pm=None, can_sock=None):
+  step = make_step(sm, pm, can_sock)
+  while 1:
+    step()
+
 
 def main(sm=None, pm=None, can_sock=None):
   radard_thread(sm, pm, can_sock)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import unittest
+
+from cereal import car
+from selfdrive.controls.lib.events import Events, ET, EVENTS
+
+EventName = car.CarEvent.EventName
+
+
+class TestEvents(unittest.TestCase):
+
+  def test_any(self):
+    events = Events()
+    events.add(EventName.doorOpen)
+    for et in [ET.ENABLE, ET.PRE_ENABLE, ET.NO_ENTRY, ET.WARNING, ET.USER_DISABLE,
+               ET.SOFT_DISABLE, ET.IMMEDIATE_DISABLE, ET.PERMANENT]:
+      self.assertEqual(events.any(et), et in EVENTS[EventName.doorOpen], et)
+
+    events.clear()
+    self.assertFalse(events.any(ET.NO_ENTRY))
+
+  def test_clear_counts_iterations(self):
+    events = Events()
+    events.add(EventName.communityFeatureDisallowed, static=True)
+    for _ in range(3):
+      events.add(EventName.doorOpen)
+      events.clear()
+
+    self.assertEqual(events.names, [EventName.communityFeatureDisallowed])
+    self.assertEqual(events.events_prev[EventName.communityFeatureDisallowed], 3)
+    self.assertEqual(events.events_prev[EventName.doorOpen], 3)
+
+    events.clear()
+    self.assertEqual(events.events_prev[EventName.doorOpen], 0)
+    self.assertTrue(events.any(ET.PERMANENT))
+
+  def test_to_msg(self):
+    events = Events()
+    events.add(EventName.doorOpen)
+    events.add(EventName.pcmEnable)
+    for _ in range(2):
+      msgs = events.to_msg()
+      self.assertEqual([m.name for m in msgs], ["doorOpen", "pcmEnable"])
+      self.assertTrue(msgs[0].softDisable and msgs[0].noEntry and not msgs[0].enable)
+      self.assertTrue(msgs[1].enable)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Time what cloudlog calls cost the calling thread of a daemon that logs a few lines every
+# iteration of its loop, with records queued for the sender thread and with every record
+# formatted and sent inline like before. Runs its own logmessaged socket, so stop logmessaged first.
+#   ./benchmark_cloudlog.py [-n 20000]
+import argparse
+import os
+import time
+import threading
+
+import zmq
+
+from selfdrive.swaglog import cloudlog, outhandler, decode_batch, LogMessageHandler
+
+LINES_PER_STEP = 10
+STEP_TIME = 0.002
+
+
+class InlineLogMessageHandler(LogMessageHandler):
+  def emit(self, record):
+    if os.getpid() != self.pid:
+      self.connect()
+    try:
+      self.sock.send((chr(record.levelno) + self.format(record)).encode('utf8'), zmq.NOBLOCK)
+    except zmq.error.Again:
+      pass
+
+
+def bench(name, n, f):
+  """Times only the calls, the loop sleeps between steps like a daemon does"""
+  dt = 0.
+  for step in range(n // LINES_PER_STEP):
+    t = time.perf_counter()
+    for i in range(LINES_PER_STEP):
+      f(step * LINES_PER_STEP + i)
+    dt += time.perf_counter() - t
+    time.sleep(STEP_TIME)
+  print("%-40s %6.2f us per call" % (name, dt / n * 1e6))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark cloudlog on the calling thread")
+  parser.add_argument("-n", type=int, default=20000)
+  args = parser.parse_args()
+
+  received = [0]
+  sock = zmq.Context.instance().socket(zmq.PULL)
+  sock.bind("ipc:///tmp/logmessage")
+
+  def receiver():
+    while True:
+      received[0] += sum(1 for _ in decode_batch(sock.recv()))
+  threading.Thread(target=receiver, daemon=True).start()
+
+  # only the record going to logmessaged, not the one printed to stderr
+  cloudlog.removeHandler(outhandler)
+  handler = next(h for h in cloudlog.handlers if isinstance(h, LogMessageHandler))
+  rate_limit = cloudlog.filters[0]
+
+  info = lambda i: cloudlog.info("radard step %d", i)
+  event = lambda i: cloudlog.event("step", i=i, v_ego=1.5)
+
+  bench("cloudlog.info, same line (sampled)", args.n, info)
+  cloudlog.removeFilter(rate_limit)
+
+  bench("cloudlog.info (queued)", args.n, info)
+  bench("cloudlog.event (queued)", args.n, event)
+  handler.flush()
+
+  cloudlog.removeHandler(handler)
+  cloudlog.addHandler(InlineLogMessageHandler(handler.formatter))
+  bench("cloudlog.info (inline, before)", args.n, info)
+  bench("cloudlog.event (inline, before)", args.n, event)
+
+  time.sleep(0.5)
+  print("%d records received" % received[0])
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Time the event handling controlsd does every 10 ms: clearing the events, adding the ones
+# from carState and dMonitoringState and its own, the checks of the state machine, making
+# the alerts and building the events for carState.
+#   ./benchmark_events.py [-n 20000]
+import argparse
+import time
+from types import SimpleNamespace
+
+from cereal import car
+from selfdrive.controls.lib.events import Events, ET
+
+EventName = car.CarEvent.EventName
+
+STATIC_EVENTS = [EventName.communityFeatureDisallowed]
+# a car at a standstill with the door open and the driver looking away
+CAR_EVENTS = [EventName.doorOpen, EventName.seatbeltNotLatched, EventName.pcmDisable]
+DMON_EVENTS = [EventName.preDriverDistracted]
+CONTROLS_EVENTS = [EventName.calibrationIncomplete, EventName.outOfSpace]
+
+STATE_CHECKS = [ET.USER_DISABLE, ET.IMMEDIATE_DISABLE, ET.SOFT_DISABLE, ET.ENABLE, ET.NO_ENTRY, ET.PRE_ENABLE]
+ALERT_TYPES = [ET.PERMANENT, ET.WARNING]
+
+
+# what the alert callbacks of these events read
+CP = SimpleNamespace(carName="tesla")
+SM = {"liveCalibration": SimpleNamespace(calPerc=50)}
+
+
+def to_msg_list(names):
+  ret = []
+  for name in names:
+    e = car.CarEvent.new_message()
+    e.name = name
+    ret.append(e.as_reader())
+  return ret
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the event handling of a controlsd iteration")
+  parser.add_argument("-n", type=int, default=20000)
+  args = parser.parse_args()
+
+  events = Events()
+  for e in STATIC_EVENTS:
+    events.add(e, static=True)
+  car_events, dmon_events = to_msg_list(CAR_EVENTS), to_msg_list(DMON_EVENTS)
+  callback_args = [CP, SM, True]
+
+  dt = {name: 0. for name in ["clear + add", "any", "create_alerts", "to_msg"]}
+  for _ in range(args.n):
+    t0 = time.perf_counter()
+    events.clear()
+    events.add_from_msg(car_events)
+    events.add_from_msg(dmon_events)
+    for e in CONTROLS_EVENTS:
+      events.add(e)
+    t1 = time.perf_counter()
+    for et in STATE_CHECKS:
+      events.any(et)
+    t2 = time.perf_counter()
+    events.create_alerts(ALERT_TYPES, callback_args)
+    t3 = time.perf_counter()
+    events.to_msg()
+    t4 = time.perf_counter()
+
+    dt["clear + add"] += t1 - t0
+    dt["any"] += t2 - t1
+    dt["create_alerts"] += t3 - t2
+    dt["to_msg"] += t4 - t3
+
+  for name, t in dt.items():
+    print("%-20s %7.2f us per tick" % (name, t / args.n * 1e6))
+  print("%-20s %7.2f us per tick" % ("total", sum(dt.values()) / args.n * 1e6))
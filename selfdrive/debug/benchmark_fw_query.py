@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Replays the UDS traffic recorded at the start of a route against simulated ECUs
+# and times the VIN and FW queries on it, without a car.
+#   ./benchmark_fw_query.py <rlog.bz2 or route name> [--timeout 0.1]
+import argparse
+import time
+
+from tools.lib.logreader import LogReader, MultiLogIterator
+from tools.lib.route import Route
+from selfdrive.car.fw_versions import get_vin_and_fw_versions, match_fw_to_car
+from selfdrive.car.tests.isotp_sim import SimCanBus, ecus_from_frames, frames_from_log, sim_queries
+
+BUS = 1
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmark the FW query on the UDS traffic of a log')
+  parser.add_argument('log', help='rlog or route name, the queries run in the first segment')
+  parser.add_argument('--timeout', type=float, default=0.1)
+  args = parser.parse_args()
+
+  if args.log.endswith(".bz2"):
+    msgs = list(LogReader(args.log))
+  else:
+    msgs = list(MultiLogIterator(Route(args.log).log_paths()[:1], wraparound=False))
+
+  recorded_fw = None
+  for msg in msgs:
+    if msg.which() == "carParams":
+      recorded_fw = {(f.address, f.subAddress, f.fwVersion) for f in msg.carParams.carFw}
+      break
+
+  ecus = ecus_from_frames(*frames_from_log(msgs, BUS))
+  print(f"{len(ecus)} ECUs answered in the log")
+
+  bus = SimCanBus(BUS)
+  for ecu in ecus:
+    bus.add_ecu(ecu)
+
+  with sim_queries():
+    t = time.monotonic()
+    vin, car_fw = get_vin_and_fw_versions(bus, bus, BUS, timeout=args.timeout)
+    t = time.monotonic() - t
+
+  print(f"VIN {vin}, {len(car_fw)} FW versions, candidates {match_fw_to_car(car_fw)}")
+  print(f"VIN + FW query took {t:.3f} s, {len(bus.sent)} frames sent")
+  if recorded_fw is not None:
+    replayed_fw = {(f.address, f.subAddress, f.fwVersion) for f in car_fw}
+    print("same FW versions as the log" if replayed_fw == recorded_fw else
+          f"FW versions differ from the log: missing {recorded_fw - replayed_fw}, extra {replayed_fw - recorded_fw}")
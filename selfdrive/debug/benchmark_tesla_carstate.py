@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Replays the CAN messages of a recorded Tesla segment through the parsers of the Tesla
+# CarInterface and times CarState.update, with the signals copied only for the messages
+# received since the last update and with every signal copied every update like before.
+#   ./benchmark_tesla_carstate.py <rlog.bz2 or route name>
+import argparse
+import time
+
+from tools.lib.logreader import LogReader, MultiLogIterator
+from tools.lib.route import Route
+from selfdrive.car.tesla.interface import CarInterface
+from selfdrive.car.tesla.carstate import CarState
+from selfdrive.car.tesla.values import CAR
+
+
+def bench(name, CI, can_strings, copy_all):
+  CS, parsers = CI.CS, (CI.cp, CI.epas_cp, CI.pedal_cp)
+  dt = 0.
+  for dat in can_strings:
+    for cp in parsers:
+      cp.update_strings([dat])
+    if copy_all and CS.signal_map is not None:
+      CS.signal_map.reset()
+
+    t = time.perf_counter()
+    CS.update(*parsers)
+    dt += time.perf_counter() - t
+  print("%-30s %6.2f us per update" % (name, dt / len(can_strings) * 1e6))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the Tesla CarState on the CAN messages of a log")
+  parser.add_argument("log", help="rlog or route name, the first segment is replayed")
+  args = parser.parse_args()
+
+  if args.log.endswith(".bz2"):
+    msgs = LogReader(args.log)
+  else:
+    msgs = MultiLogIterator(Route(args.log).log_paths()[:1], wraparound=False)
+  # every can event is what controlsd gets in one iteration
+  can_strings = [m.as_builder().to_bytes() for m in msgs if m.which() == "can"]
+  print("%d updates" % len(can_strings))
+
+  CP = CarInterface.get_params(CAR.MODELS)
+  bench("received messages", CarInterface(CP, None, CarState), can_strings, False)
+  bench("every signal", CarInterface(CP, None, CarState), can_strings, True)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Compare how the Tesla car modules inside controlsd get their messages: every module polling
+# conflated sockets of its own like before, or one MessageIntake updated every iteration.
+# Publishes the services at about their real rates and counts the socket calls (polls and
+# receives, each at least one syscall) and the time spent on messages per iteration, also
+# with AHB getting every frame instead of the metadata of one every CAMERA_META_INTERVAL iterations.
+# Frames carry an image of --image-size bytes, like the ones of camerad on a PC.
+#   ./benchmark_tesla_intake.py [-n 1000] [--image-size 0]
+import argparse
+import time
+
+from cereal import log, tesla, ui
+import cereal.messaging as messaging
+from selfdrive.car.tesla.intake import MessageIntake, TESLA_SERVICES, TESLA_SERVICE_INTERVALS
+
+# service -> published every this many controlsd iterations
+RATES = {
+  "radarState": 5,
+  "pathPlan": 5,
+  "liveMapData": 100,
+  "trafficEvents": 10,
+  "frame": 5,
+  "sensorEvents": 1,
+  "uiIcLeads": 5,
+  "uiIcCarLR": 10,
+  "alcaState": 5,
+  "ahbInfo": 5,
+  "uiButtonStatus": 100,
+}
+
+TESLA_STRUCTS = {
+  "uiIcLeads": tesla.ICLeads,
+  "uiIcCarLR": tesla.ICCarsLR,
+  "alcaState": tesla.ALCAState,
+  "ahbInfo": tesla.AHBinfo,
+  "uiButtonStatus": ui.UIButtonStatus,
+}
+
+
+class CountingSocket():
+  def __init__(self, sock):
+    self.sock = sock
+    self.calls = 0
+
+  def receive(self, non_blocking=False):
+    self.calls += 1
+    return self.sock.receive(non_blocking=non_blocking)
+
+
+class CountingPoller():
+  def __init__(self, poller):
+    self.poller = poller
+    self.calls = 0
+
+  def poll(self, timeout):
+    self.calls += 1
+    return self.poller.poll(timeout)
+
+
+LIST_SERVICES = ["trafficEvents", "sensorEvents"]
+
+
+def make_msg(service, image_size):
+  if service in TESLA_STRUCTS:
+    return TESLA_STRUCTS[service].new_message().to_bytes()
+  msg = messaging.new_message(service, 1 if service in LIST_SERVICES else None)
+  if service == "frame":
+    msg.frame.globalGain = 510
+    msg.frame.image = bytes(image_size)
+  return msg.to_bytes()
+
+
+def recv_sock(sock):
+  # messaging.recv_sock without waiting, on a counting socket
+  dat = None
+  while True:
+    recv = sock.receive(non_blocking=True)
+    if recv is None:
+      break
+    dat = recv
+  return None if dat is None else log.Event.from_bytes(dat)
+
+
+def recv_one_or_none(sock):
+  dat = sock.receive(non_blocking=True)
+  return None if dat is None else log.Event.from_bytes(dat)
+
+
+def separate_sockets():
+  """What the modules did before: CarController, ACC, AHB, GYRO and UIEvents
+  with sockets of their own"""
+  socks = {}
+  def sub(owner, service):
+    socks[(owner, service)] = CountingSocket(messaging.sub_sock(service, conflate=True))
+
+  for service in ["liveMapData", "uiIcLeads", "radarState", "alcaState", "pathPlan", "uiIcCarLR", "trafficEvents"]:
+    sub("carcontroller", service)
+  sub("acc", "radarState")
+  sub("ahb", "ahbInfo")
+  sub("ahb", "frame")
+  sub("gyro", "sensorEvents")
+  sub("uiev", "uiButtonStatus")
+
+  def step(frame):
+    dat = socks[("uiev", "uiButtonStatus")].receive(non_blocking=True)
+    if dat is not None:
+      ui.UIButtonStatus.from_bytes(dat)
+    if frame % 10 == 0:
+      recv_sock(socks[("gyro", "sensorEvents")])
+
+    if frame % 10 == 0:
+      recv_one_or_none(socks[("carcontroller", "liveMapData")])
+      for service, struct in [("uiIcLeads", tesla.ICLeads), ("alcaState", tesla.ALCAState), ("uiIcCarLR", tesla.ICCarsLR)]:
+        dat = socks[("carcontroller", service)].receive(non_blocking=True)
+        if dat is not None:
+          struct.from_bytes(dat)
+      recv_one_or_none(socks[("carcontroller", "radarState")])
+      recv_one_or_none(socks[("carcontroller", "pathPlan")])
+      recv_sock(socks[("carcontroller", "trafficEvents")])
+
+    dat = socks[("ahb", "ahbInfo")].receive(non_blocking=True)
+    if dat is not None:
+      tesla.AHBinfo.from_bytes(dat)
+    msg = recv_one_or_none(socks[("ahb", "frame")])
+    if msg is not None:
+      msg.frame.globalGain
+
+    if frame % 5 == 0:
+      recv_one_or_none(socks[("acc", "radarState")])
+
+  return step, lambda: sum(s.calls for s in socks.values())
+
+
+def shared_intake(intervals):
+  intake = MessageIntake(TESLA_SERVICES, intervals)
+  poller = intake.poller = CountingPoller(intake.poller)
+  intake.socks = {service: CountingSocket(sock) for service, sock in intake.socks.items()}
+  readers = {owner: intake.reader() for owner in ["carcontroller", "acc", "ahb", "gyro", "uiev"]}
+
+  def step(frame):
+    intake.update()
+    readers["uiev"].recv("uiButtonStatus")
+    if frame % 10 == 0:
+      readers["gyro"].recv("sensorEvents")
+
+    if frame % 10 == 0:
+      for service in ["liveMapData", "uiIcLeads", "alcaState", "uiIcCarLR", "radarState", "pathPlan", "trafficEvents"]:
+        readers["carcontroller"].recv(service)
+
+    readers["ahb"].recv("ahbInfo")
+    readers["ahb"].recv("frame")
+
+    if frame % 5 == 0:
+      readers["acc"].recv("radarState")
+
+  return step, lambda: poller.calls + sum(s.calls for s in intake.socks.values())
+
+
+def bench(name, n, image_size, pubs, setup):
+  step, calls = setup()
+  time.sleep(0.5)  # let the subscribers connect
+
+  dt = 0.
+  for frame in range(n):
+    for service, pub in pubs.items():
+      if frame % RATES[service] == 0:
+        pub.send(make_msg(service, image_size))
+    time.sleep(0.01)
+
+    t = time.perf_counter()
+    step(frame)
+    dt += time.perf_counter() - t
+  print("%-30s %6.2f socket calls, %7.2f us per iteration" % (name, calls() / n, dt / n * 1e6))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the message intake of the Tesla car modules")
+  parser.add_argument("-n", type=int, default=1000)
+  parser.add_argument("--image-size", type=int, default=0)
+  args = parser.parse_args()
+
+  pubs = {service: messaging.pub_sock(service) for service in TESLA_SERVICES}
+  bench("separate sockets", args.n, args.image_size, pubs, separate_sockets)
+  bench("shared intake, every frame", args.n, args.image_size, pubs, lambda: shared_intake({}))
+  bench("shared intake", args.n, args.image_size, pubs, lambda: shared_intake(TESLA_SERVICE_INTERVALS))
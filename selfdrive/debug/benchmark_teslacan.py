@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# Times encoding every frame the Tesla CarController can send in one tick on an IC
+# integrated car. The whole send set has to fit in a small fraction of the 10 ms controls tick.
+#   ./benchmark_teslacan.py [-n 2000]
+import argparse
+import timeit
+
+from selfdrive.car.tesla.tests.test_teslacan import tick_send_set
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark encoding the teslacan frames of one tick")
+  parser.add_argument("-n", type=int, default=2000)
+  args = parser.parse_args()
+
+  t = timeit.timeit(tick_send_set, number=args.n) / args.n
+  print("teslacan: %.1f us to encode %d frames" % (t * 1e6, len(tick_send_set())))
@@ -176,7 +176,8 @@ class Calibrator():
     pm.send('liveCalibration', cal_send)
 
 
-def calibrationd_thread(sm=None, pm=None):
+def make_step(sm=None, pm=None):
+  """Sets up calibrationd, returns a function that runs one iteration of its loop"""
   if sm is None:
     sm = messaging.SubMaster(['cameraOdometry', 'carState'], poll=['cameraOdometry'])
 
@@ -185,7 +186,7 @@ def calibrationd_thread(sm=None, pm=None):
 
   calibrator = Calibrator(param_put=True)
 
-  while 1:
+  def step():
     timeout = 0 if sm.frame == -1 else 100
     sm.update(timeout)
 
@@ -203,6 +204,14 @@ def calibrationd_thread(sm=None, pm=None):
     if sm.frame % 5 == 0:
       calibrator.send_data(pm)
 
+  return step
+
+
+def calibrationd_thread(sm=None, pm=None):
+  step = make_step(sm, pm)
+  while 1:
+    step()
+
 
 def main(sm=None, pm=None):
   calibrationd_thread(sm, pm)
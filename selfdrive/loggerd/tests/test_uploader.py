@@ -1,8 +1,12 @@
+import os
+import errno
 import time
+import shutil
 import threading
 import unittest
 import logging
 import json
+from unittest import mock
 
 from selfdrive.swaglog import cloudlog
 import selfdrive.loggerd.uploader as uploader
@@ -136,6 +140,61 @@ class TestUploader(UploaderTestCase):
     for f_path in f_paths:
       self.assertFalse(getxattr(f_path, uploader.UPLOAD_ATTR_NAME), "File upload when locked")
 
+  def test_index_follows_changes(self):
+    up = uploader.Uploader("0000000000000000", self.root)
+    self.assertIsNone(up.next_file_to_upload(with_raw=True))
+
+    # a segment being recorded after the uploader started
+    self.seg_dir = self.seg_format.format(1)
+    f_paths = self.gen_files(lock=True)
+    self.assertIsNone(up.next_file_to_upload(with_raw=True))
+
+    for f_path in f_paths:
+      os.remove(f_path + ".lock")
+    key, fn = up.next_file_to_upload(with_raw=True)
+    self.assertEqual(key, f"{self.seg_dir}/qlog.bz2")
+
+    up.upload(key, fn)
+    key, _ = up.next_file_to_upload(with_raw=True)
+    self.assertEqual(key, f"{self.seg_dir}/rlog.bz2")
+
+    # deleted by the deleter
+    shutil.rmtree(os.path.join(self.root, self.seg_dir))
+    self.assertIsNone(up.next_file_to_upload(with_raw=True))
+    up.index.close()
+
+  def test_index_without_segment_watch(self):
+    add_watch = uploader.inotify.add_watch
+    def add_root_watch(fd, path, mask):
+      if path != self.root:
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+      return add_watch(fd, path, mask)
+
+    # out of watches, the segment is listed again instead
+    with mock.patch.object(uploader.inotify, "add_watch", side_effect=add_root_watch):
+      up = uploader.Uploader("0000000000000000", self.root)
+      self.seg_dir = self.seg_format.format(1)
+      f_paths = self.gen_files(lock=True)
+      self.assertIsNone(up.next_file_to_upload(with_raw=True))
+
+      up.index.RESYNC_INTERVAL = 0.
+      for f_path in f_paths:
+        os.remove(f_path + ".lock")
+      key, _ = up.next_file_to_upload(with_raw=True)
+      self.assertEqual(key, f"{self.seg_dir}/qlog.bz2")
+    up.index.close()
+
+  def test_index_retries_getxattr(self):
+    self.gen_files()
+    with mock.patch.object(uploader, "getxattr", side_effect=OSError(errno.EIO, os.strerror(errno.EIO))):
+      up = uploader.Uploader("0000000000000000", self.root)
+      self.assertIsNone(up.next_file_to_upload(with_raw=True))
+
+    up.index.RESYNC_INTERVAL = 0.
+    key, _ = up.next_file_to_upload(with_raw=True)
+    self.assertEqual(key, f"{self.seg_dir}/qlog.bz2")
+    up.index.close()
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import ctypes
+import heapq
 import inspect
 import json
 import os
@@ -13,9 +14,11 @@ import traceback
 import requests
 
 from cereal import log
+from common import inotify
 from common.hardware import HARDWARE
 from common.api import Api
 from common.params import Params
+from selfdrive.loggerd import xattr_cache
 from selfdrive.loggerd.xattr_cache import getxattr, setxattr
 from selfdrive.loggerd.config import ROOT
 from selfdrive.swaglog import cloudlog
@@ -71,6 +74,228 @@ def clear_locks(root):
     except OSError:
       cloudlog.exception("clear_locks failed")
 
+class _Segment():
+  def __init__(self, logname, wd):
+    self.order = tuple(get_directory_sort(logname))
+    self.wd = wd
+    self.locks = set()
+    # name -> priority of the files that aren't uploaded yet
+    self.pending = {}
+    # bumped when the segment is locked or unlocked, older heap entries don't count anymore
+    self.gen = 0
+    # files whose upload attribute couldn't be read, looked at again on the next resync
+    self.retry = set()
+
+class UploadIndex():
+  """Files under root that still have to be uploaded, by priority. After the first scan
+  it's kept up to date through inotify, so picking the next file doesn't touch the disk.
+  Without inotify everything is scanned again on every update, like before. Segments
+  that can't be watched are listed again every RESYNC_INTERVAL seconds."""
+  IMMEDIATE, HIGH, OTHER = range(3)
+  RESYNC_INTERVAL = 10.
+  ROOT_EVENTS = inotify.IN_CREATE | inotify.IN_MOVED_TO | inotify.IN_DELETE | inotify.IN_MOVED_FROM | \
+                inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_ONLYDIR
+  SEGMENT_EVENTS = inotify.IN_CREATE | inotify.IN_MOVED_TO | inotify.IN_DELETE | inotify.IN_MOVED_FROM | \
+                   inotify.IN_ATTRIB | inotify.IN_ONLYDIR
+
+  def __init__(self, root, immediate_priority, high_priority):
+    self.root = root
+    self.immediate_priority = immediate_priority
+    self.high_priority = high_priority
+
+    self.fd = None
+    self.root_wd = None
+    self.segments = {}
+    self.wds = {}
+    # per priority a heap of (segment order, order in the segment, name, logname, segment gen)
+    self.heaps = [[], [], []]
+    self.last_resync = 0.
+    self.rescan()
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+  def get_priority(self, name):
+    """Priority and order within the segment of a file, None for files that aren't uploaded"""
+    if name in self.immediate_priority:
+      return self.IMMEDIATE, self.immediate_priority[name]
+    if name in self.high_priority:
+      return self.HIGH, self.high_priority[name]
+    if name.endswith(".lock") or name.endswith(".tmp"):
+      return None
+    return self.OTHER, 0
+
+  def rescan(self):
+    self.close()
+    self.segments = {}
+    self.wds = {}
+    self.heaps = [[], [], []]
+    self.last_resync = time.monotonic()
+    if not os.path.isdir(self.root):
+      return
+
+    try:
+      self.fd = inotify.inotify_init(inotify.IN_CLOEXEC | inotify.IN_NONBLOCK)
+      self.root_wd = inotify.add_watch(self.fd, self.root, self.ROOT_EVENTS)
+    except OSError:
+      cloudlog.exception("uploader can't watch %s" % self.root)
+      self.close()
+
+    for logname in listdir_by_creation(self.root):
+      self.add_segment(logname)
+
+  def update(self):
+    """Applies the changes since the last update"""
+    if self.fd is None:
+      self.rescan()
+      return
+
+    if time.monotonic() - self.last_resync > self.RESYNC_INTERVAL:
+      self.last_resync = time.monotonic()
+      for logname, seg in list(self.segments.items()):
+        if seg.wd is None or seg.retry:
+          self.resync_segment(logname)
+
+    while True:
+      try:
+        events = inotify.read_events(self.fd)
+      except BlockingIOError:
+        return
+
+      for wd, mask, _, name in events:
+        if mask & inotify.IN_Q_OVERFLOW or (wd == self.root_wd and mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF)):
+          self.rescan()
+          return
+        elif wd == self.root_wd:
+          if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+            self.add_segment(name)
+          elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+            self.remove_segment(name)
+        elif wd in self.wds:
+          logname = self.wds[wd]
+          if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+            self.add_file(logname, name)
+          elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+            self.remove_file(logname, name)
+          elif mask & inotify.IN_ATTRIB:
+            # someone else (un)marked it
+            xattr_cache.invalidate(os.path.join(self.root, logname, name), UPLOAD_ATTR_NAME)
+            self.remove_file(logname, name)
+            self.add_file(logname, name)
+
+  def add_segment(self, logname):
+    path = os.path.join(self.root, logname)
+    if logname in self.segments or not os.path.isdir(path):
+      return
+
+    wd = None
+    if self.fd is not None:
+      try:
+        wd = inotify.add_watch(self.fd, path, self.SEGMENT_EVENTS)
+        self.wds[wd] = logname
+      except (FileNotFoundError, NotADirectoryError):
+        # removed already
+        return
+      except OSError:
+        # out of watches (ENOSPC), its files are picked up by the resyncs in update
+        cloudlog.exception("uploader can't watch %s" % path)
+
+    self.segments[logname] = _Segment(logname, wd)
+    # files created before the watch was added
+    self.resync_segment(logname)
+
+  def resync_segment(self, logname):
+    """Lists a segment again for the changes there were no events for"""
+    seg = self.segments[logname]
+    try:
+      names = set(os.listdir(os.path.join(self.root, logname)))
+    except OSError:
+      names = set()
+    for name in (seg.locks | set(seg.pending) | seg.retry) - names:
+      self.remove_file(logname, name)
+    seg.retry.clear()
+    for name in names:
+      self.add_file(logname, name)
+
+  def remove_segment(self, logname):
+    seg = self.segments.pop(logname, None)
+    if seg is not None and seg.wd is not None:
+      self.wds.pop(seg.wd, None)
+      try:
+        inotify.rm_watch(self.fd, seg.wd)
+      except OSError:
+        pass
+
+  def add_file(self, logname, name):
+    seg = self.segments.get(logname)
+    if seg is None:
+      return
+
+    if name.endswith(".lock"):
+      if not seg.locks:
+        seg.gen += 1
+      seg.locks.add(name)
+      return
+
+    priority = self.get_priority(name)
+    if priority is None or name in seg.pending:
+      return
+
+    fn = os.path.join(self.root, logname, name)
+    try:
+      is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
+    except FileNotFoundError:
+      # deleter could have deleted
+      return
+    except OSError:
+      cloudlog.event("uploader_getxattr_failed", key=os.path.join(logname, name), fn=fn)
+      seg.retry.add(name)
+      return
+    if is_uploaded:
+      return
+
+    seg.pending[name] = priority
+    if not seg.locks:
+      self._push(seg, logname, name, priority)
+
+  def remove_file(self, logname, name):
+    seg = self.segments.get(logname)
+    if seg is None:
+      return
+
+    if name in seg.locks:
+      seg.locks.discard(name)
+      if not seg.locks:
+        # unlocked, all of its files can go now
+        seg.gen += 1
+        for pending_name, priority in seg.pending.items():
+          self._push(seg, logname, pending_name, priority)
+    else:
+      seg.pending.pop(name, None)
+      seg.retry.discard(name)
+
+  def mark_uploaded(self, key):
+    logname, name = os.path.split(key)
+    seg = self.segments.get(logname)
+    if seg is not None:
+      seg.pending.pop(name, None)
+
+  def _push(self, seg, logname, name, priority):
+    heapq.heappush(self.heaps[priority[0]], (seg.order, priority[1], name, logname, seg.gen))
+
+  def first(self, priority):
+    """Key and path of the first file of a priority, files that are gone are dropped on the way"""
+    heap = self.heaps[priority]
+    while heap:
+      _, _, name, logname, gen = heap[0]
+      seg = self.segments.get(logname)
+      if seg is not None and seg.gen == gen and name in seg.pending:
+        return os.path.join(logname, name), os.path.join(self.root, logname, name)
+      heapq.heappop(heap)
+    return None
+
 def is_on_wifi():
   return HARDWARE.get_network_type() == NetworkType.wifi
 
@@ -97,58 +322,21 @@ class Uploader():
 
     self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
     self.high_priority = {"rlog.bz2": 0, "fcamera.hevc": 1, "dcamera.hevc": 2, "ecamera.hevc": 3}
-
-  def get_upload_sort(self, name):
-    if name in self.immediate_priority:
-      return self.immediate_priority[name]
-    if name in self.high_priority:
-      return self.high_priority[name] + 100
-    return 1000
-
-  def gen_upload_files(self):
-    if not os.path.isdir(self.root):
-      return
-    for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=self.get_upload_sort):
-        key = os.path.join(logname, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
-          is_uploaded = True  # deleter could have deleted
-        if is_uploaded:
-          continue
-        yield (name, key, fn)
+    self.index = UploadIndex(self.root, self.immediate_priority, self.high_priority)
 
   def next_file_to_upload(self, with_raw):
-    upload_files = list(self.gen_upload_files())
+    self.index.update()
 
     # try to upload qlog files first
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return (key, fn)
-
+    priorities = [UploadIndex.IMMEDIATE]
     if with_raw:
-      # then upload the full log files, rear and front camera files
-      for name, key, fn in upload_files:
-        if name in self.high_priority:
-          return (key, fn)
-
-      # then upload other files
-      for name, key, fn in upload_files:
-        if not name.endswith('.lock') and not name.endswith(".tmp"):
-          return (key, fn)
+      # then upload the full log files, rear and front camera files, then other files
+      priorities += [UploadIndex.HIGH, UploadIndex.OTHER]
 
+    for priority in priorities:
+      d = self.index.first(priority)
+      if d is not None:
+        return d
     return None
 
   def do_upload(self, key, fn):
@@ -206,6 +394,7 @@ class Uploader():
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+      self.index.mark_uploaded(key)
       success = True
     else:
       cloudlog.info("uploading %r", fn)
@@ -217,6 +406,7 @@ class Uploader():
           setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
         except OSError:
           cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+        self.index.mark_uploaded(key)
         success = True
       else:
         cloudlog.event("upload_failed", stat=stat, exc=self.last_exc, key=key, fn=fn, sz=sz)
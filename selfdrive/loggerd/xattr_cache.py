@@ -1,13 +1,23 @@
+from lru import LRU
+
 from common.xattr import getxattr as getattr1
 from common.xattr import setxattr as setattr1
 
-cached_attributes = {}
+# the uploader looks at every file once, only the recent ones need to stay
+XATTR_CACHE_SIZE = 4096
+
+cached_attributes = LRU(XATTR_CACHE_SIZE)
 def getxattr(path, attr_name):
-  if (path, attr_name) not in cached_attributes:
+  key = (path, attr_name)
+  if key not in cached_attributes:
     response = getattr1(path, attr_name)
-    cached_attributes[(path, attr_name)] = response
-  return cached_attributes[(path, attr_name)]
+    cached_attributes[key] = response
+    return response
+  return cached_attributes[key]
 
 def setxattr(path, attr_name, attr_value):
   cached_attributes.pop((path, attr_name), None)
   return setattr1(path, attr_name, attr_value)
+
+def invalidate(path, attr_name):
+  cached_attributes.pop((path, attr_name), None)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import zmq
 import cereal.messaging as messaging
-from selfdrive.swaglog import get_le_handler
+from selfdrive.swaglog import decode_batch, get_le_handler
 
 
 def main():
@@ -17,22 +17,22 @@ def main():
 
   while True:
     dat = b''.join(sock.recv_multipart())
-    dat = dat.decode('utf8')
 
-    # print "RECV", repr(dat)
+    # python processes send batches, native ones single records
+    for levelnum, record in decode_batch(dat):
+      record = record.decode('utf8')
 
-    levelnum = ord(dat[0])
-    dat = dat[1:]
+      # print "RECV", repr(record)
 
-    if levelnum >= le_level:
-      # push to logentries
-      # TODO: push to athena instead
-      le_handler.emit_raw(dat)
+      if levelnum >= le_level:
+        # push to logentries
+        # TODO: push to athena instead
+        le_handler.emit_raw(record)
 
-    # then we publish them
-    msg = messaging.new_message()
-    msg.logMessage = dat
-    pub_sock.send(msg.to_bytes())
+      # then we publish them
+      msg = messaging.new_message()
+      msg.logMessage = record
+      pub_sock.send(msg.to_bytes())
 
 
 if __name__ == "__main__":
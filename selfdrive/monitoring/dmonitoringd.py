@@ -7,7 +7,8 @@ from selfdrive.monitoring.driver_monitor import DriverStatus, MAX_TERMINAL_ALERT
 from selfdrive.locationd.calibrationd import Calibration
 
 
-def dmonitoringd_thread(sm=None, pm=None):
+def make_step(sm=None, pm=None):
+  """Sets up dmonitoringd, returns a function that runs one iteration of its loop"""
   if pm is None:
     pm = messaging.PubMaster(['dMonitoringState'])
 
@@ -33,11 +34,12 @@ def dmonitoringd_thread(sm=None, pm=None):
   driver_engaged = False
 
   # 10Hz <- dmonitoringmodeld
-  while True:
+  def step():
+    nonlocal v_cruise_last, driver_engaged
     sm.update()
 
     if not sm.updated['driverState']:
-      continue
+      return
 
     # Get interaction
     if sm.updated['carState']:
@@ -85,6 +87,13 @@ def dmonitoringd_thread(sm=None, pm=None):
     }
     pm.send('dMonitoringState', dat)
 
+  return step
+
+def dmonitoringd_thread(sm=None, pm=None):
+  step = make_step(sm, pm)
+  while True:
+    step()
+
 def main(sm=None, pm=None):
   dmonitoringd_thread(sm, pm)
 
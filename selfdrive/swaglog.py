@@ -1,10 +1,22 @@
 import os
+import struct
 import logging
+import threading
+from collections import deque
 
 from logentries import LogentriesHandler
 import zmq
 
-from common.logging_extra import SwagLogger, SwagFormatter
+from common.logging_extra import SwagLogger, SwagFormatter, SwagRateLimitFilter, NiceOrderedDict, json_compact_dumps
+
+# records go to logmessaged in batches: this marker, then level and length before every record.
+# Single records are the level as one character followed by the record, like the native swaglog sends
+BATCH_MARKER = b"\xff"
+_BATCH_HEADER = struct.Struct("<BI")
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 128
+LOG_FLUSH_INTERVAL = 0.05
 
 
 def get_le_handler():
@@ -13,12 +25,41 @@ def get_le_handler():
   return LogentriesHandler(le_token, use_tls=False, verbose=False)
 
 
+def encode_batch(records):
+  """Packs (levelno, record bytes) pairs into one message"""
+  return BATCH_MARKER + b"".join(_BATCH_HEADER.pack(level, len(dat)) + dat for level, dat in records)
+
+
+def decode_batch(dat):
+  """Yields the (levelno, record bytes) of a batch or of a single record"""
+  if dat[:1] != BATCH_MARKER:
+    yield dat[0], dat[1:]
+    return
+
+  pos = 1
+  while pos < len(dat):
+    level, length = _BATCH_HEADER.unpack_from(dat, pos)
+    pos += _BATCH_HEADER.size
+    yield level, dat[pos:pos + length]
+    pos += length
+
+
 class LogMessageHandler(logging.Handler):
+  """Queues records for a background thread that formats them and sends them to
+  logmessaged in batches. The calling thread only renders the message and copies the
+  context, so later changes to what was logged don't show up. Errors are sent right
+  away, the rest at least every LOG_FLUSH_INTERVAL seconds."""
   def __init__(self, formatter):
     logging.Handler.__init__(self)
     self.setFormatter(formatter)
     self.pid = None
 
+    self.queue = deque(maxlen=LOG_QUEUE_SIZE)
+    self.dropped = 0
+    self.wake = threading.Event()
+    self.send_lock = threading.Lock()
+    self.sender = None
+
   def connect(self):
     self.zctx = zmq.Context()
     self.sock = self.zctx.socket(zmq.PUSH)
@@ -26,18 +67,74 @@ class LogMessageHandler(logging.Handler):
     self.sock.connect("ipc:///tmp/logmessage")
     self.pid = os.getpid()
 
+    # after a fork the queue has the records of the parent, which sends them itself
+    self.queue.clear()
+    self.dropped = 0
+    self.send_lock = threading.Lock()
+    self.sender = threading.Thread(target=self._sender_thread, name="swaglog", daemon=True)
+    self.sender.start()
+
   def emit(self, record):
     if os.getpid() != self.pid:
       self.connect()
 
-    msg = self.format(record).rstrip('\n')
-    # print("SEND".format(repr(msg)))
     try:
-      s = chr(record.levelno)+msg
-      self.sock.send(s.encode('utf8'), zmq.NOBLOCK)
-    except zmq.error.Again:
-      # drop :/
-      pass
+      msg = json_compact_dumps(self.formatter.format_msg(record))
+      exc_info = self.formatter.formatException(record.exc_info) if record.exc_info else None
+    except Exception:
+      self.handleError(record)
+      return
+
+    # a full queue drops its oldest record, the sender logs how many were lost
+    if len(self.queue) == self.queue.maxlen:
+      self.dropped += 1
+    self.queue.append((record, msg, self.formatter.swaglogger.get_ctx(), exc_info))
+    if record.levelno >= logging.ERROR or len(self.queue) >= LOG_BATCH_SIZE:
+      self.wake.set()
+
+  def encode(self, record, msg, ctx, exc_info):
+    """The record as compact JSON, with the message rendered when it was logged"""
+    record_dict = NiceOrderedDict()
+    record_dict['ctx'] = ctx
+    if exc_info is not None:
+      record_dict['exc_info'] = exc_info
+    record_dict.update(self.formatter.format_fields(record))
+    return ('{"msg":' + msg + ',' + json_compact_dumps(record_dict)[1:]).encode('utf8')
+
+  def _dropped_record(self, dropped):
+    record = logging.LogRecord(self.formatter.swaglogger.name, logging.WARNING, __file__, 0, "", None, None, "_send_queued")
+    msg = NiceOrderedDict(event="swaglog_dropped", count=dropped)
+    return record.levelno, self.encode(record, json_compact_dumps(msg), {}, None)
+
+  def _sender_thread(self):
+    while True:
+      self.wake.wait(LOG_FLUSH_INTERVAL)
+      self.wake.clear()
+      self._send_queued()
+
+  def _send_queued(self):
+    with self.send_lock:
+      dropped, self.dropped = self.dropped, 0
+      pending = [self._dropped_record(dropped)] if dropped else []
+
+      while self.queue or pending:
+        batch, pending = pending, []
+        while self.queue and len(batch) < LOG_BATCH_SIZE:
+          queued = self.queue.popleft()
+          try:
+            batch.append((queued[0].levelno, self.encode(*queued)))
+          except Exception:
+            self.handleError(queued[0])
+
+        try:
+          self.sock.send(encode_batch(batch), zmq.NOBLOCK)
+        except zmq.error.Again:
+          # drop :/
+          pass
+
+  def flush(self):
+    if os.getpid() == self.pid:
+      self._send_queued()
 
 
 def add_logentries_handler(log):
@@ -50,6 +147,8 @@ def add_logentries_handler(log):
 
 cloudlog = log = SwagLogger()
 log.setLevel(logging.DEBUG)
+# lines logged in a loop are sampled, for every handler
+log.addFilter(SwagRateLimitFilter())
 
 outhandler = logging.StreamHandler()
 log.addHandler(outhandler)
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
+import argparse
 import bz2
 import os
-import sys
-import numbers
+import re
+from collections import namedtuple
+from itertools import zip_longest
+
+import capnp
 
-import dictdiffer
 if "CI" in os.environ:
   tqdm = lambda x: x
 else:
@@ -12,61 +15,211 @@ else:
 
 from tools.lib.logreader import LogReader
 
+# one difference between two messages, like dictdiffer's (kind, path, values) with
+# the time since the start of the log in seconds. kind is 'change', 'add' or 'remove'
+Diff = namedtuple('Diff', ['kind', 'path', 'values', 'time'])
+FieldSummary = namedtuple('FieldSummary', ['count', 'max_deviation', 'first_time'])
+
+_IGNORE = object()
+_TOLERANCE = object()
+_LEAF_TYPES = (bool, int, float, str, bytes, type(None))
+_STRUCT_TYPES = (capnp.lib.capnp._DynamicStructReader, capnp.lib.capnp._DynamicStructBuilder)
+_NUMBER_TYPES = (int, float)
+
 def save_log(dest, log_msgs):
-  dat = b""
-  for msg in tqdm(log_msgs):
-    dat += msg.as_builder().to_bytes()
-  dat = bz2.compress(dat)
-
-  with open(dest, "wb") as f:
-   f.write(dat)
-
-def remove_ignored_fields(msg, ignore):
-  msg = msg.as_builder()
-  for key in ignore:
-    attr = msg
-    keys = key.split(".")
-    if msg.which() not in key and len(keys) > 1:
-      continue
+  with bz2.open(dest, "wb") as f:
+    for msg in tqdm(log_msgs):
+      f.write(msg.as_builder().to_bytes())
 
+def field_rules(ignore_fields=(), tolerances=None):
+  """Nests the dotted paths into dicts, ending in _IGNORE or the absolute tolerance of
+  the numbers below that path. A path with a tolerance and rules below it keeps the
+  tolerance under _TOLERANCE. Paths start at the event and skip list indices."""
+  rules = {}
+  for path, tol in (tolerances or {}).items():
+    node = rules
+    for k in path.split("."):
+      node = node.setdefault(k, {})
+    node[_TOLERANCE] = tol
+
+  for path in ignore_fields:
+    node = rules
+    keys = path.split(".")
     for k in keys[:-1]:
-      try:
-        attr = getattr(msg, k)
-      except:
+      node = node.setdefault(k, {})
+      if node is _IGNORE:
+        # a parent already ignores everything below it
         break
     else:
-      v = getattr(attr, keys[-1])
-      if isinstance(v, bool):
-        val = False
-      elif isinstance(v, numbers.Number):
-        val = 0
+      node[keys[-1]] = _IGNORE
+
+  def collapse(node):
+    for k, v in node.items():
+      if isinstance(v, dict):
+        node[k] = v[_TOLERANCE] if v.keys() == {_TOLERANCE} else collapse(v)
+    return node
+  return collapse(rules)
+
+def _struct_bytes(s):
+  if isinstance(s, capnp.lib.capnp._DynamicStructBuilder):
+    s = s.as_reader()
+  return s.as_builder().to_bytes()
+
+_is_group_cache = {}
+def _is_group(s):
+  # groups (and named unions) live inside their parent, capnp can't copy them on their own
+  key = s.schema.node.id
+  if key not in _is_group_cache:
+    _is_group_cache[key] = s.schema.node.struct.isGroup
+  return _is_group_cache[key]
+
+_struct_fields_cache = {}
+def _struct_fields(s):
+  schema = s.schema
+  key = schema.node.id
+  if key not in _struct_fields_cache:
+    _struct_fields_cache[key] = (tuple(schema.non_union_fields), len(schema.union_fields) > 0)
+  return _struct_fields_cache[key]
+
+def _plain(v):
+  if isinstance(v, _STRUCT_TYPES):
+    return v.to_dict()
+  if hasattr(v, '_as_str'):
+    return v._as_str()
+  return v
+
+def _diff_value(a, b, path, rules, tol, t, out, check=False):
+  if type(a) in _LEAF_TYPES:
+    if a != b and not (a != a and b != b):  # nan is equal to nan, like the bytes of the message
+      if not (tol and type(a) in _NUMBER_TYPES and type(b) in _NUMBER_TYPES and abs(a - b) <= tol):
+        out.append(Diff('change', path, (a, b), t))
+
+  elif isinstance(a, _STRUCT_TYPES):
+    # the same bytes are the same fields. Without rules a difference in the bytes is in the
+    # fields too, so structs are only checked at the top and below structs with rules.
+    # Groups have no bytes of their own, the structs below them are checked instead
+    check_below = rules is not None
+    if check:
+      if _is_group(a):
+        check_below = True
+      elif _struct_bytes(a) == _struct_bytes(b):
+        return
+
+    fields, has_union = _struct_fields(a)
+    if has_union:
+      which_a, which_b = a.which(), b.which()
+      if which_a != which_b:
+        out.append(Diff('change', path, (which_a, which_b), t))
       else:
-        raise NotImplementedError
-      setattr(attr, keys[-1], val)
-  return msg.as_reader()
+        fields = fields + (which_a,)
 
-def compare_logs(log1, log2, ignore_fields=[], ignore_msgs=[]):
+    for f in fields:
+      sub_rules, sub_tol = None, tol
+      if rules is not None:
+        sub_rules = rules.get(f)
+        if sub_rules is _IGNORE:
+          continue
+        elif isinstance(sub_rules, dict):
+          sub_tol = sub_rules.get(_TOLERANCE, tol)
+        elif sub_rules is not None:
+          sub_rules, sub_tol = None, sub_rules
+      _diff_value(getattr(a, f), getattr(b, f), path + "." + f if path else f, sub_rules, sub_tol, t, out, check_below)
+
+  elif hasattr(a, '_as_str'):
+    a, b = a._as_str(), b._as_str()
+    if a != b:
+      out.append(Diff('change', path, (a, b), t))
+
+  else:
+    # lists of numbers are done in one go when they're exactly the same
+    if not tol and rules is None and list(a) == list(b):
+      return
+
+    len_a, len_b = len(a), len(b)
+    for i in range(min(len_a, len_b)):
+      _diff_value(a[i], b[i], "%s.%d" % (path, i), rules, tol, t, out, check)
+    if len_b > len_a:
+      out.append(Diff('add', path, [(i, _plain(b[i])) for i in range(len_a, len_b)], t))
+    elif len_a > len_b:
+      out.append(Diff('remove', path, [(i, _plain(a[i])) for i in range(len_b, len_a)], t))
+
+def diff_msgs(msg1, msg2, rules, tolerance=0, t=0.):
+  """Returns the Diffs between two events. rules come from field_rules, tolerance
+  applies to all numbers without a tolerance of their own."""
+  out = []
+  _diff_value(msg1, msg2, "", rules, tolerance, t, out, True)
+  return out
+
+def iter_diffs(log1, log2, ignore_fields=[], ignore_msgs=[], tolerance=0, tolerances=None):
+  """Compares two logs message by message and yields the Diffs as they're found"""
+  rules = field_rules(ignore_fields, tolerances)
   filter_msgs = lambda m: m.which() not in ignore_msgs
-  log1, log2 = [list(filter(filter_msgs, log)) for log in (log1, log2)]
-  assert len(log1) == len(log2), "logs are not same length: " + str(len(log1)) + " VS " + str(len(log2))
+  t0 = None
+  cnt1 = cnt2 = 0
+  for msg1, msg2 in tqdm(zip_longest(filter(filter_msgs, log1), filter(filter_msgs, log2))):
+    if msg1 is None or msg2 is None:
+      cnt1 += msg1 is not None
+      cnt2 += msg2 is not None
+      continue
+    cnt1 += 1
+    cnt2 += 1
 
-  diff = []
-  for msg1, msg2 in tqdm(zip(log1, log2)):
     if msg1.which() != msg2.which():
       print(msg1, msg2)
       raise Exception("msgs not aligned between logs")
 
-    msg1_bytes = remove_ignored_fields(msg1, ignore_fields).as_builder().to_bytes()
-    msg2_bytes = remove_ignored_fields(msg2, ignore_fields).as_builder().to_bytes()
+    if t0 is None:
+      t0 = msg1.logMonoTime
+    yield from diff_msgs(msg1, msg2, rules, tolerance, (msg1.logMonoTime - t0) * 1e-9)
 
-    if msg1_bytes != msg2_bytes:
-      msg1_dict = msg1.to_dict(verbose=True)
-      msg2_dict = msg2.to_dict(verbose=True)
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields, tolerance=0)
-      diff.extend(dd)
-  return diff
+  assert cnt1 == cnt2, "logs are not same length: " + str(cnt1) + " VS " + str(cnt2)
+
+def compare_logs(log1, log2, ignore_fields=[], ignore_msgs=[], tolerance=0, tolerances=None):
+  return list(iter_diffs(log1, log2, ignore_fields, ignore_msgs, tolerance, tolerances))
+
+def summarize_diffs(diffs):
+  """Per field (list indices left out): number of differences, the largest one for
+  numbers and the time of the first"""
+  ret = {}
+  for d in diffs:
+    path = re.sub(r"\.\d+(?=\.|$)", "", d.path)
+    dev = None
+    if d.kind == 'change' and all(type(v) in _NUMBER_TYPES for v in d.values):
+      dev = abs(d.values[0] - d.values[1])
+
+    if path not in ret:
+      ret[path] = FieldSummary(1, dev, d.time)
+    else:
+      s = ret[path]
+      max_dev = s.max_deviation if dev is None or (s.max_deviation is not None and s.max_deviation >= dev) else dev
+      ret[path] = FieldSummary(s.count + 1, max_dev, min(s.first_time, d.time))
+  return ret
+
+def format_summary(summary):
+  lines = []
+  for path, s in sorted(summary.items()):
+    dev = "" if s.max_deviation is None else ", max deviation %g" % s.max_deviation
+    lines.append("%s: %d%s, first at %.2f s" % (path, s.count, dev, s.first_time))
+  return lines
 
 if __name__ == "__main__":
-  log1 = list(LogReader(sys.argv[1]))
-  log2 = list(LogReader(sys.argv[2]))
-  print(compare_logs(log1, log2, sys.argv[3:]))
+  parser = argparse.ArgumentParser(description="Compare two logs field by field")
+  parser.add_argument("log1")
+  parser.add_argument("log2")
+  parser.add_argument("ignore_fields", nargs="*", default=[], help="Fields to ignore (e.g. logMonoTime)")
+  parser.add_argument("--ignore-msgs", nargs="*", default=[], help="Msgs to ignore (e.g. carEvents)")
+  parser.add_argument("--tolerance", type=float, default=0, help="Absolute tolerance of all numbers")
+  parser.add_argument("--tolerances", nargs="*", default=[], metavar="PATH=TOL",
+                      help="Absolute tolerance of the numbers below a path (e.g. controlsState.curvature=1e-6)")
+  parser.add_argument("--summary", action="store_true", help="Only print a summary per field")
+  args = parser.parse_args()
+
+  tolerances = {p: float(t) for p, t in (s.rsplit("=", 1) for s in args.tolerances)}
+  log1 = LogReader(args.log1, streaming=True)
+  log2 = LogReader(args.log2, streaming=True)
+  diffs = iter_diffs(log1, log2, args.ignore_fields, args.ignore_msgs, args.tolerance, tolerances)
+  if args.summary:
+    print("\n".join(format_summary(summarize_diffs(diffs))))
+  else:
+    for d in diffs:
+      print(d)
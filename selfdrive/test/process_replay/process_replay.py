@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 import os
-import sys
-import threading
 import importlib
 
 if "CI" in os.environ:
@@ -19,45 +17,26 @@ from collections import namedtuple
 
 ProcessConfig = namedtuple('ProcessConfig', ['proc_name', 'pub_sub', 'ignore', 'init_callback', 'should_recv_callback'])
 
-def wait_for_event(evt):
-  if not evt.wait(15):
-    if threading.currentThread().getName() == "MainThread":
-      # tested process likely died. don't let test just hang
-      raise Exception("Timeout reached. Tested process likely crashed.")
-    else:
-      # done testing this process, let it die
-      sys.exit(0)
+# can messages controlsd and get_car get to fingerprint the car
+FINGERPRINT_CAN_MSGS = 300
 
 class FakeSocket:
-  def __init__(self, wait=True):
+  """Holds the messages pushed by the replay until the process reads them"""
+  def __init__(self):
     self.data = []
-    self.wait = wait
-    self.recv_called = threading.Event()
-    self.recv_ready = threading.Event()
 
   def receive(self, non_blocking=False):
     if non_blocking:
       return None
 
-    if self.wait:
-      self.recv_called.set()
-      wait_for_event(self.recv_ready)
-      self.recv_ready.clear()
+    if not self.data:
+      # the real socket would block forever
+      raise Exception("Blocking receive on an empty socket, process is out of step with the replay.")
     return self.data.pop()
 
   def send(self, data):
-    if self.wait:
-      wait_for_event(self.recv_called)
-      self.recv_called.clear()
-
     self.data.append(data)
 
-    if self.wait:
-      self.recv_ready.set()
-
-  def wait_for_recv(self):
-    wait_for_event(self.recv_called)
-
 class DumbSocket:
   def __init__(self, s=None):
     if s is not None:
@@ -74,33 +53,12 @@ class FakeSubMaster(messaging.SubMaster):
   def __init__(self, services):
     super(FakeSubMaster, self).__init__(services, addr=None)
     self.sock = {s: DumbSocket(s) for s in services}
-    self.update_called = threading.Event()
-    self.update_ready = threading.Event()
-
-    self.wait_on_getitem = False
-
-  def __getitem__(self, s):
-    # hack to know when fingerprinting is done
-    if self.wait_on_getitem:
-      self.update_called.set()
-      wait_for_event(self.update_ready)
-      self.update_ready.clear()
-    return self.data[s]
+    # queued by the replay for the next update
+    self.msgs = []
 
   def update(self, timeout=-1):
-    self.update_called.set()
-    wait_for_event(self.update_ready)
-    self.update_ready.clear()
-
-
-  def update_msgs(self, cur_time, msgs):
-    wait_for_event(self.update_called)
-    self.update_called.clear()
-    super(FakeSubMaster, self).update_msgs(cur_time, msgs)
-    self.update_ready.set()
-
-  def wait_for_update(self):
-    wait_for_event(self.update_called)
+    msgs, self.msgs = self.msgs, []
+    self.update_msgs(0, msgs)
 
 class FakePubMaster(messaging.PubMaster):
   def __init__(self, services):
@@ -114,8 +72,8 @@ class FakePubMaster(messaging.PubMaster):
         data = messaging.new_message(s, 0)
       self.data[s] = data.as_reader()
       self.sock[s] = DumbSocket()
-    self.send_called = threading.Event()
-    self.get_called = threading.Event()
+    # everything sent, in order
+    self.sent = []
 
   def send(self, s, dat):
     self.last_updated = s
@@ -123,47 +81,17 @@ class FakePubMaster(messaging.PubMaster):
       self.data[s] = log.Event.from_bytes(dat)
     else:
       self.data[s] = dat.as_reader()
-    self.send_called.set()
-    wait_for_event(self.get_called)
-    self.get_called.clear()
-
-  def wait_for_msg(self):
-    wait_for_event(self.send_called)
-    self.send_called.clear()
-    dat = self.data[self.last_updated]
-    self.get_called.set()
-    return dat
-
-def fingerprint(msgs, fsm, can_sock):
-  print("start fingerprinting")
-  fsm.wait_on_getitem = True
-
-  # populate fake socket with data for fingerprinting
-  canmsgs = [msg for msg in msgs if msg.which() == "can"]
-  wait_for_event(can_sock.recv_called)
-  can_sock.recv_called.clear()
-  can_sock.data = [msg.as_builder().to_bytes() for msg in canmsgs[:300]]
-  can_sock.recv_ready.set()
-  can_sock.wait = False
-
-  # we know fingerprinting is done when controlsd sets sm['pathPlan'].sensorValid
-  wait_for_event(fsm.update_called)
-  fsm.update_called.clear()
-
-  fsm.wait_on_getitem = False
-  can_sock.wait = True
-  can_sock.data = []
-
-  fsm.update_ready.set()
-  print("finished fingerprinting")
-
-def get_car_params(msgs, fsm, can_sock):
-  can = FakeSocket(wait=False)
-  sendcan = FakeSocket(wait=False)
-
-  canmsgs = [msg for msg in msgs if msg.which() == 'can']
-  for m in canmsgs[:300]:
-    can.send(m.as_builder().to_bytes())
+    self.sent.append(self.data[s])
+
+def fingerprint(can_msgs, fsm, can_sock):
+  # controlsd fingerprints when it's set up, reading from the can socket
+  can_sock.data = list(can_msgs)
+
+def get_car_params(can_msgs, fsm, can_sock):
+  can = FakeSocket()
+  sendcan = FakeSocket()
+
+  can.data = list(can_msgs)
   _, CP = get_car(can, sendcan)
   Params().put("CarParams", CP.to_bytes())
 
@@ -251,19 +179,38 @@ CONFIGS = [
   ),
 ]
 
+def events_by_time(lr):
+  """Yields (Event, raw bytes) in logMonoTime order. Only the bytes of can messages are
+  used, so without LogReader.iter_raw those are the only ones serialized again."""
+  if hasattr(lr, "iter_raw"):
+    yield from lr.iter_raw(sort_by_time=True)
+  else:
+    for msg in sorted(lr, key=lambda msg: msg.logMonoTime):
+      yield msg, msg.as_builder().to_bytes() if msg.which() == "can" else None
+
 def replay_process(cfg, lr):
+  """Runs the process in lock-step with the log: every message the process should
+  receive is handed to it before it takes a step, and nothing runs in between.
+  Returns the messages it sent."""
   sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
   pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
 
   fsm = FakeSubMaster(pub_sockets)
   fpm = FakePubMaster(sub_sockets)
   args = (fsm, fpm)
-  if 'can' in list(cfg.pub_sub.keys()):
+  can_sock = None
+  if 'can' in cfg.pub_sub:
     can_sock = FakeSocket()
     args = (fsm, fpm, can_sock)
 
-  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
-  pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
+  # messages are passed on as readers of the log, no copies
+  pub_msgs, can_msgs = [], []
+  for msg, dat in events_by_time(lr):
+    which = msg.which()
+    if which == 'can' and len(can_msgs) < FINGERPRINT_CAN_MSGS:
+      can_msgs.append(dat)
+    if which in cfg.pub_sub:
+      pub_msgs.append((msg, dat))
 
   params = Params()
   params.clear_all()
@@ -275,25 +222,18 @@ def replay_process(cfg, lr):
   os.environ['NO_RADAR_SLEEP'] = "1"
   manager.prepare_managed_process(cfg.proc_name)
   mod = importlib.import_module(manager.managed_processes[cfg.proc_name])
-  thread = threading.Thread(target=mod.main, args=args)
-  thread.daemon = True
-  thread.start()
 
   if cfg.init_callback is not None:
-    if 'can' not in list(cfg.pub_sub.keys()):
-      can_sock = None
-    cfg.init_callback(all_msgs, fsm, can_sock)
+    cfg.init_callback(can_msgs, fsm, can_sock)
+  step = mod.make_step(*args)
+  if can_sock is not None:
+    # drop what fingerprinting didn't read
+    can_sock.data = []
 
   CP = car.CarParams.from_bytes(params.get("CarParams", block=True))
 
-  # wait for started process to be ready
-  if 'can' in list(cfg.pub_sub.keys()):
-    can_sock.wait_for_recv()
-  else:
-    fsm.wait_for_update()
-
-  log_msgs, msg_queue = [], []
-  for msg in tqdm(pub_msgs):
+  msg_queue = []
+  for msg, dat in tqdm(pub_msgs):
     if cfg.should_recv_callback is not None:
       recv_socks, should_recv = cfg.should_recv_callback(msg, CP, cfg, fsm)
     else:
@@ -301,19 +241,17 @@ def replay_process(cfg, lr):
                       (fsm.frame + 1) % int(service_list[msg.which()].frequency / service_list[s].frequency) == 0]
       should_recv = bool(len(recv_socks))
 
-    if msg.which() == 'can':
-      can_sock.send(msg.as_builder().to_bytes())
+    is_can = msg.which() == 'can'
+    if is_can:
+      can_sock.send(dat)
     else:
-      msg_queue.append(msg.as_builder())
+      msg_queue.append(msg)
 
     if should_recv:
-      fsm.update_msgs(0, msg_queue)
+      fsm.msgs += msg_queue
       msg_queue = []
 
-      recv_cnt = len(recv_socks)
-      while recv_cnt > 0:
-        m = fpm.wait_for_msg()
-        log_msgs.append(m)
-
-        recv_cnt -= m.which() in recv_socks
-  return log_msgs
+    # processes with a can socket read every can message, the others only run when updated
+    if is_can or should_recv:
+      step()
+  return fpm.sent
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+from cereal import log
+import selfdrive.test.process_replay.compare_logs as compare_logs_module
+from selfdrive.test.process_replay.compare_logs import Diff, FieldSummary, compare_logs, diff_msgs, field_rules, \
+                                                      format_summary, summarize_diffs
+
+
+def radar_state(t, d_rel, cum_lag_ms=0.):
+  msg = log.Event.new_message(logMonoTime=t)
+  msg.init('radarState')
+  msg.radarState.cumLagMs = cum_lag_ms
+  msg.radarState.leadOne.dRel = d_rel
+  return msg.as_reader()
+
+
+def controls_state(t, output):
+  msg = log.Event.new_message(logMonoTime=t)
+  msg.init('controlsState')
+  msg.controlsState.startMonoTime = t
+  msg.controlsState.lateralControlState.init('pidState').output = output
+  return msg.as_reader()
+
+
+class TestCompareLogs(unittest.TestCase):
+  def test_same(self):
+    self.assertEqual(diff_msgs(radar_state(0, 1.), radar_state(0, 1.), field_rules()), [])
+
+  def test_struct_without_union(self):
+    diffs = diff_msgs(radar_state(0, 1.), radar_state(0, 2.5), field_rules())
+    self.assertEqual(diffs, [Diff('change', 'radarState.leadOne.dRel', (1., 2.5), 0.)])
+
+  def test_union(self):
+    msg = log.Event.new_message(logMonoTime=0)
+    msg.init('pathPlan')
+    diffs = diff_msgs(radar_state(0, 1.), msg.as_reader(), field_rules())
+    self.assertEqual(diffs, [Diff('change', '', ('radarState', 'pathPlan'), 0.)])
+
+  def test_list(self):
+    msg1, msg2 = log.Event.new_message(), log.Event.new_message()
+    msg1.init('frame').sharpnessScore = [1, 2]
+    msg2.init('frame').sharpnessScore = [1, 3, 4]
+    diffs = diff_msgs(msg1.as_reader(), msg2.as_reader(), field_rules())
+    self.assertEqual(diffs, [Diff('change', 'frame.sharpnessScore.1', (2, 3), 0.),
+                             Diff('add', 'frame.sharpnessScore', [(2, 4)], 0.)])
+
+  def test_tolerance(self):
+    msg1, msg2 = radar_state(0, 1., 10.), radar_state(0, 1.5, 12.)
+    self.assertEqual(len(diff_msgs(msg1, msg2, field_rules())), 2)
+    self.assertEqual(diff_msgs(msg1, msg2, field_rules(), tolerance=2.), [])
+
+    # a tolerance of a path applies below it, and only there
+    diffs = diff_msgs(msg1, msg2, field_rules(tolerances={"radarState.leadOne": 0.5}))
+    self.assertEqual([d.path for d in diffs], ['radarState.cumLagMs'])
+    diffs = diff_msgs(msg1, msg2, field_rules(tolerances={"radarState.leadOne.dRel": 0.25}))
+    self.assertEqual([d.path for d in diffs], ['radarState.cumLagMs', 'radarState.leadOne.dRel'])
+
+  def test_ignore(self):
+    log1 = [radar_state(0, 1.), radar_state(10, 1.)]
+    log2 = [radar_state(5, 2.), radar_state(15, 1.)]
+    self.assertEqual([d.path for d in compare_logs(log1, log2)],
+                     ['logMonoTime', 'radarState.leadOne.dRel', 'logMonoTime'])
+    self.assertEqual(compare_logs(log1, log2, ignore_fields=['logMonoTime', 'radarState.leadOne']), [])
+    self.assertEqual(compare_logs(log1, log2, ignore_fields=['logMonoTime'], ignore_msgs=['radarState']), [])
+
+  def test_ignore_below_tolerance(self):
+    msg1, msg2 = radar_state(0, 1., 10.), radar_state(0, 1.5, 12.)
+    rules = field_rules(ignore_fields=['radarState.leadOne.dRel'], tolerances={"radarState": 1.})
+    self.assertEqual([d.path for d in diff_msgs(msg1, msg2, rules)], ['radarState.cumLagMs'])
+
+  def test_same_bytes_not_walked(self):
+    # only the event is walked, the radarState below it has the same bytes
+    with mock.patch.object(compare_logs_module, '_struct_fields', wraps=compare_logs_module._struct_fields) as struct_fields:
+      self.assertEqual(diff_msgs(radar_state(0, 1.), radar_state(5, 1.), field_rules(['logMonoTime'])), [])
+    self.assertEqual(struct_fields.call_count, 1)
+
+  def test_named_union(self):
+    # lateralControlState is a group, the structs in it are compared instead
+    rules = field_rules(['logMonoTime', 'controlsState.startMonoTime'])
+    self.assertEqual(diff_msgs(controls_state(0, 1.), controls_state(5, 1.), rules), [])
+    diffs = diff_msgs(controls_state(0, 1.), controls_state(5, 2.), rules)
+    self.assertEqual(diffs, [Diff('change', 'controlsState.lateralControlState.pidState.output', (1., 2.), 0.)])
+    self.assertEqual(len(diff_msgs(controls_state(0, 1.), controls_state(0, 2.), field_rules())), 1)
+
+  def test_summary(self):
+    log1 = [radar_state(int(1e9) * i, 1.) for i in range(4)]
+    log2 = [radar_state(int(1e9) * i, d_rel) for i, d_rel in enumerate([1., 2., 1.5, 4.])]
+    log2[3] = radar_state(int(3e9), 4., 1.)
+
+    summary = summarize_diffs(compare_logs(log1, log2))
+    self.assertEqual(summary, {
+      'radarState.leadOne.dRel': FieldSummary(3, 3., 1.),
+      'radarState.cumLagMs': FieldSummary(1, 1., 3.),
+    })
+    self.assertEqual(format_summary(summary), [
+      "radarState.cumLagMs: 1, max deviation 1, first at 3.00 s",
+      "radarState.leadOne.dRel: 3, max deviation 3, first at 1.00 s",
+    ])
+
+
+if __name__ == "__main__":
+  unittest.main()
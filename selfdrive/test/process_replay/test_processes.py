@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 import argparse
+import multiprocessing
 import os
 import requests
 import sys
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 from selfdrive.car.car_helpers import interface_names
 from selfdrive.test.process_replay.process_replay import replay_process, CONFIGS
-from selfdrive.test.process_replay.compare_logs import compare_logs
+from selfdrive.test.process_replay.compare_logs import compare_logs, format_summary, summarize_diffs
 from tools.lib.logreader import LogReader
 
 
@@ -57,7 +59,7 @@ def test_process(cfg, lr, cmp_log_fn, ignore_fields=[], ignore_msgs=[]):
     assert False, ("Failed to open %s" % cmp_log_fn)
   else:
     print("Opening file [%s]" % cmp_log_fn)
-    cmp_log_msgs = list(LogReader(cmp_log_fn))
+    cmp_log_msgs = LogReader(cmp_log_fn, streaming=True)
 
   log_msgs = replay_process(cfg, lr)
 
@@ -75,7 +77,17 @@ def test_process(cfg, lr, cmp_log_fn, ignore_fields=[], ignore_msgs=[]):
 
   return compare_logs(cmp_log_msgs, log_msgs, ignore_fields+cfg.ignore, ignore_msgs)
 
-def format_diff(results, ref_commit):
+def init_worker():
+  # replays clear and write params, every worker needs its own
+  os.environ["PARAMS_PATH"] = os.path.join(tempfile.mkdtemp(), "params")
+
+def run_job(job):
+  cfg, rlog_fn, cmp_log_fn, ignore_fields, ignore_msgs = job
+  # rlog_fn is a temporary download, decompressed in memory instead of in the log cache
+  return test_process(cfg, LogReader(rlog_fn, streaming=True, cache=False), cmp_log_fn, ignore_fields, ignore_msgs)
+
+def format_diff(results, ref_commit, summary=False):
+  """diff1 has a summary per field, diff2 every difference unless only the summary is wanted"""
   diff1, diff2 = "", ""
   diff2 += "***** tested against commit %s *****\n" % ref_commit
 
@@ -92,15 +104,9 @@ def format_diff(results, ref_commit):
         diff1 += "\t\t%s\n" % diff
         failed = True
       elif len(diff):
-        cnt = {}
-        for d in diff:
-          diff2 += "\t%s\n" % str(d)
-
-          k = str(d[1])
-          cnt[k] = 1 if k not in cnt else cnt[k] + 1
-
-        for k, v in sorted(cnt.items()):
-          diff1 += "\t\t%s: %s\n" % (k, v)
+        summary_lines = format_summary(summarize_diffs(diff))
+        diff1 += "".join("\t\t%s\n" % l for l in summary_lines)
+        diff2 += "".join("\t%s\n" % l for l in (summary_lines if summary else diff))
         failed = True
   return diff1, diff2, failed
 
@@ -121,6 +127,10 @@ if __name__ == "__main__":
                         help="Extra fields or msgs to ignore (e.g. carState.events)")
   parser.add_argument("--ignore-msgs", type=str, nargs="*", default=[],
                         help="Msgs to ignore (e.g. carEvents)")
+  parser.add_argument("--summary", action="store_true",
+                        help="Only write a summary per field to diff.txt")
+  parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes replaying in parallel")
   args = parser.parse_args()
 
   cars_whitelisted = len(args.whitelist_cars) > 0
@@ -143,17 +153,17 @@ if __name__ == "__main__":
     assert len(untested) == 0, "Cars missing routes: %s" % (str(untested))
 
   results = {}
+  rlog_fns = []
+  jobs = []
   for car_brand, segment in segments:
     if (cars_whitelisted and car_brand.upper() not in args.whitelist_cars) or \
         (not cars_whitelisted and car_brand.upper() in args.blacklist_cars):
       continue
 
-    print("***** testing route segment %s *****\n" % segment)
-
     results[segment] = {}
 
     rlog_fn = get_segment(segment)
-    lr = LogReader(rlog_fn)
+    rlog_fns.append(rlog_fn)
 
     for cfg in CONFIGS:
       if (procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or \
@@ -161,10 +171,25 @@ if __name__ == "__main__":
         continue
 
       cmp_log_fn = os.path.join(ref_files_dir, "%s_%s_%s.bz2" % (segment, cfg.proc_name, ref_commit))
-      results[segment][cfg.proc_name] = test_process(cfg, lr, cmp_log_fn, args.ignore_fields, args.ignore_msgs)
+      jobs.append((segment, (cfg, rlog_fn, cmp_log_fn, args.ignore_fields, args.ignore_msgs)))
+
+  # one process after the other, so workers running at the same time replay different segments
+  jobs.sort(key=lambda j: [c.proc_name for c in CONFIGS].index(j[1][0].proc_name))
+
+  if args.jobs > 1:
+    with ProcessPoolExecutor(args.jobs, mp_context=multiprocessing.get_context("fork"), initializer=init_worker) as pool:
+      futures = [(segment, job[0].proc_name, pool.submit(run_job, job)) for segment, job in jobs]
+      for segment, proc_name, future in futures:
+        results[segment][proc_name] = future.result()
+  else:
+    for segment, job in jobs:
+      print("***** testing %s on route segment %s *****\n" % (job[0].proc_name, segment))
+      results[segment][job[0].proc_name] = run_job(job)
+
+  for rlog_fn in rlog_fns:
     os.remove(rlog_fn)
 
-  diff1, diff2, failed = format_diff(results, ref_commit)
+  diff1, diff2, failed = format_diff(results, ref_commit, args.summary)
   with open(os.path.join(process_replay_dir, "diff.txt"), "w") as f:
     f.write(diff2)
   print(diff1)
@@ -34,7 +34,7 @@ if __name__ == "__main__":
       print("failed to get segment %s" % segment)
       sys.exit(1)
 
-    lr = LogReader(rlog_fn)
+    lr = LogReader(rlog_fn, streaming=True, cache=False)
 
     for cfg in CONFIGS:
       log_msgs = replay_process(cfg, lr)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import os
+import json
+import logging
+import unittest
+from collections import deque
+
+from common.logging_extra import SwagLogger, SwagFormatter
+from selfdrive.swaglog import LOG_BATCH_SIZE, LogMessageHandler, decode_batch, encode_batch
+
+
+class FakeSock():
+  def __init__(self):
+    self.sent = []
+
+  def send(self, dat, flags=0):
+    self.sent.append(dat)
+
+
+class TestSwaglog(unittest.TestCase):
+  def setUp(self):
+    self.log = SwagLogger()
+    self.log.setLevel(logging.DEBUG)
+    self.handler = LogMessageHandler(SwagFormatter(self.log))
+    # connected already, without the sender thread the records go out on flush
+    self.handler.pid = os.getpid()
+    self.handler.sock = FakeSock()
+    self.log.addHandler(self.handler)
+
+  def sent_records(self):
+    self.handler.flush()
+    return [(level, json.loads(dat)) for batch in self.handler.sock.sent for level, dat in decode_batch(batch)]
+
+  def test_batch(self):
+    records = [(logging.INFO, b'{"msg": "a"}'), (logging.ERROR, b""), (logging.DEBUG, b"\xff" * 300)]
+    self.assertEqual(list(decode_batch(encode_batch(records))), records)
+    self.assertEqual(list(decode_batch(encode_batch([]))), [])
+
+  def test_single_record(self):
+    # what the native swaglog sends
+    self.assertEqual(list(decode_batch(bytes([logging.WARNING]) + b'{"msg": "a"}')), [(logging.WARNING, b'{"msg": "a"}')])
+
+  def test_batch_size(self):
+    for i in range(LOG_BATCH_SIZE + 10):
+      self.log.info("record %d", i)
+    records = self.sent_records()
+    self.assertEqual([len(list(decode_batch(b))) for b in self.handler.sock.sent], [LOG_BATCH_SIZE, 10])
+    self.assertEqual([r["msg"] for _, r in records], ["record %d" % i for i in range(LOG_BATCH_SIZE + 10)])
+    self.assertEqual({level for level, _ in records}, {logging.INFO})
+
+  def test_snapshot(self):
+    # records are sent as they were when logged
+    vals = [1]
+    with self.log.ctx(step=1):
+      self.log.event("evt", vals=vals)
+      self.log.info("vals %s", vals)
+    vals.append(2)
+
+    records = [r for _, r in self.sent_records()]
+    self.assertEqual(records[0]["msg"], {"event": "evt", "vals": [1]})
+    self.assertEqual(records[1]["msg"], "vals [1]")
+    self.assertEqual([r["ctx"] for r in records], [{"step": 1}, {"step": 1}])
+
+  def test_exc_info(self):
+    try:
+      raise ValueError("bad")
+    except ValueError:
+      self.log.exception("failed")
+    record = self.sent_records()[0][1]
+    self.assertEqual(record["msg"], "failed")
+    self.assertIn("ValueError: bad", record["exc_info"])
+
+  def test_compact(self):
+    self.log.event("evt", x=1)
+    self.handler.flush()
+    _, dat = next(decode_batch(self.handler.sock.sent[0]))
+    self.assertTrue(dat.startswith(b'{"msg":{"event":"evt","x":1},"ctx":{},"level":"INFO"'))
+
+  def test_dropped(self):
+    self.handler.queue = deque(maxlen=10)
+    for i in range(15):
+      self.log.info("record %d", i)
+    records = [r for _, r in self.sent_records()]
+    self.assertEqual(records[0]["msg"], {"event": "swaglog_dropped", "count": 5})
+    self.assertEqual([r["msg"] for r in records[1:]], ["record %d" % i for i in range(5, 15)])
+    self.assertEqual(self.handler.dropped, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
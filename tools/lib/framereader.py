@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 import glob
@@ -10,16 +11,14 @@ import xml.etree.ElementTree as ET
 import numpy as np
 if sys.version_info >= (3,0):
   import queue
-  import pickle
   from io import BytesIO as StringIO
 else:
   import Queue as queue
-  import cPickle as pickle
   from cStringIO import StringIO
 
 import subprocess
 from aenum import Enum
-from lru import LRU
+from collections import OrderedDict
 from functools import wraps
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -32,6 +31,7 @@ except ImportError:
 from tools.lib.file_helpers import atomic_write_in_dir
 from tools.lib.mkvparse import mkvindex
 from tools.lib.route import Route
+from tools.lib.video_index import VIDEO_INDEX_EXTENSION, load_video_index, save_video_index
 
 H264_SLICE_P = 0
 H264_SLICE_B = 1
@@ -115,21 +115,22 @@ def vidindex(fn, typ):
   return index, prefix
 
 
+def index_cache_path(fn, cache_prefix=None):
+  # the index file only exists once indexing fn finished, so it doubles as the completion marker
+  return cache_path_for_file_path(fn, cache_prefix, extension=VIDEO_INDEX_EXTENSION)
+
 def cache_fn(func):
   @wraps(func)
   def cache_inner(fn, *args, **kwargs):
     cache_prefix = kwargs.pop('cache_prefix', None)
-    cache_path = cache_path_for_file_path(fn, cache_prefix)
+    cache_path = index_cache_path(fn, cache_prefix)
 
-    if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
+    cache_value = load_video_index(cache_path) if cache_path else None
+    if cache_value is None:
       cache_value = func(fn, *args, **kwargs)
 
       if cache_path:
-        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
+        save_video_index(cache_path, cache_value)
 
     return cache_value
 
@@ -167,20 +168,26 @@ def index_mkv(fn):
     'index': index
   }
 
-def index_videos(camera_paths, cache_prefix=None):
-  """Requires that paths in camera_paths are contiguous and of the same type."""
+def index_videos(camera_paths, cache_prefix=None, workers=None):
+  """Requires that paths in camera_paths are contiguous and of the same type.
+
+  Files are indexed on a pool of workers, files that already have an index are
+  skipped, so an interrupted run picks up where it stopped.
+  """
   if len(camera_paths) < 1:
     raise ValueError("must provide at least one video to index")
 
   frame_type = fingerprint_video(camera_paths[0])
   if frame_type == FrameType.h264_pstream:
-    index_pstream(camera_paths, "h264", cache_prefix)
+    index_pstream(camera_paths, "h264", cache_prefix, workers=workers)
   else:
-    for fn in camera_paths:
-      index_video(fn, frame_type, cache_prefix)
+    todo = [fn for fn in camera_paths if not os.path.exists(index_cache_path(fn, cache_prefix))]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      for future in as_completed([pool.submit(index_video, fn, frame_type, cache_prefix) for fn in todo]):
+        future.result()
 
 def index_video(fn, frame_type=None, cache_prefix=None):
-  cache_path = cache_path_for_file_path(fn, cache_prefix)
+  cache_path = index_cache_path(fn, cache_prefix)
 
   if os.path.exists(cache_path):
     return
@@ -204,20 +211,18 @@ def index_video(fn, frame_type=None, cache_prefix=None):
     index_mp4(fn, cache_prefix=cache_prefix)
 
 def get_video_index(fn, frame_type, cache_prefix=None):
-  cache_path = cache_path_for_file_path(fn, cache_prefix)
+  cache_path = index_cache_path(fn, cache_prefix)
 
-  if not os.path.exists(cache_path):
+  index_data = load_video_index(cache_path)
+  if index_data is None:
     index_video(fn, frame_type, cache_prefix)
-
-  if not os.path.exists(cache_path):
-    return None
-  with open(cache_path, "rb") as cache_file:
-    return pickle.load(cache_file)
+    index_data = load_video_index(cache_path)
+  return index_data
 
 def pstream_predecompress(fns, probe, indexes, global_prefix, cache_prefix, multithreaded=False):
   assert len(fns) == len(indexes)
   out_fns = [cache_path_for_file_path(fn, cache_prefix, extension=".predecom.mkv") for fn in fns]
-  out_exists = map(os.path.exists, out_fns)
+  out_exists = list(map(os.path.exists, out_fns))
   if all(out_exists):
     return
 
@@ -292,14 +297,12 @@ def pstream_predecompress(fns, probe, indexes, global_prefix, cache_prefix, mult
 
         assert compress_proc.wait() == 0
 
-      cache_path = cache_path_for_file_path(fn, cache_prefix)
-      with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-        pickle.dump({
-          'predecom': os.path.basename(out_fn),
-          'index': index,
-          'probe': probe,
-          'global_prefix': global_prefix,
-        }, cache_file, -1)
+      save_video_index(index_cache_path(fn, cache_prefix), {
+        'predecom': os.path.basename(out_fn),
+        'index': index,
+        'probe': probe,
+        'global_prefix': global_prefix,
+      })
 
   except:
     decompress_proc.kill()
@@ -312,25 +315,21 @@ def pstream_predecompress(fns, probe, indexes, global_prefix, cache_prefix, mult
     raise DataUnreadableError(fns[0])
 
 
-def index_pstream(fns, typ, cache_prefix=None):
+def _vidindex_file(fn, typ):
+  with FileReader(fn) as f:
+    return vidindex(f.name, typ)
+
+def index_pstream(fns, typ, cache_prefix=None, workers=None):
   if typ != "h264":
     raise NotImplementedError(typ)
 
   if not fns:
     raise DataUnreadableError("chffr h264 requires contiguous files")
 
-  out_fns = [cache_path_for_file_path(fn, cache_prefix) for fn in fns]
-  out_exists = map(os.path.exists, out_fns)
-  if all(out_exists): return
-
+  out_fns = [index_cache_path(fn, cache_prefix) for fn in fns]
   # load existing index files to avoid re-doing work
-  existing_indexes = []
-  for out_fn, exists in zip(out_fns, out_exists):
-    existing = None
-    if exists:
-      with open(out_fn, "rb") as cache_file:
-        existing = pickle.load(cache_file)
-    existing_indexes.append(existing)
+  existing_indexes = [load_video_index(out_fn) for out_fn in out_fns]
+  if all(existing is not None for existing in existing_indexes): return
 
   # probe the first file
   if existing_indexes[0]:
@@ -342,20 +341,23 @@ def index_pstream(fns, typ, cache_prefix=None):
   global_prefix = None
 
   # get the video index of all the segments in this stream
-  indexes = []
-  for i, fn in enumerate(fns):
-    if existing_indexes[i]:
-      index = existing_indexes[i]['index']
-      prefix = existing_indexes[i]['global_prefix']
-    else:
-      with FileReader(fn) as f:
-        index, prefix = vidindex(f.name, typ)
-    if i == 0:
-      # assert prefix
-      if not prefix:
-        raise DataUnreadableError("vidindex failed for %s" % fn)
-      global_prefix = prefix
-    indexes.append(index)
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    new_indexes = {i: pool.submit(_vidindex_file, fn, typ)
+                   for i, fn in enumerate(fns) if not existing_indexes[i]}
+
+    indexes = []
+    for i, fn in enumerate(fns):
+      if existing_indexes[i]:
+        index = existing_indexes[i]['index']
+        prefix = existing_indexes[i]['global_prefix']
+      else:
+        index, prefix = new_indexes[i].result()
+      if i == 0:
+        # assert prefix
+        if not prefix:
+          raise DataUnreadableError("vidindex failed for %s" % fn)
+        global_prefix = prefix
+      indexes.append(index)
 
   assert global_prefix
 
@@ -410,8 +412,7 @@ def index_pstream(fns, typ, cache_prefix=None):
       'num_prefix_frames': len(prefix_index[i]), # number of frames to skip in the first GOP
     }
 
-    with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-      pickle.dump(segment_index, cache_file, -1)
+    save_video_index(cache_path, segment_index)
 
 def read_file_check_size(f, sz, cookie):
   buff = bytearray(sz)
@@ -543,9 +544,18 @@ class BaseFrameReader(object):
   def close(self):
     pass
 
-  def get(self, num, count=1, pix_fmt="yuv420p"):
+  def get(self, num, count=1, pix_fmt="yuv420p", out=None):
     raise NotImplementedError
 
+  def _copy_to_out(self, frames, pix_fmt, out):
+    """Returns frames, or copies them into out for readers that can't decode straight into it"""
+    if out is None:
+      return frames
+    _check_out(out, (len(frames),) + frame_shape(self.w, self.h, pix_fmt))
+    for i, frame in enumerate(frames):
+      out[i] = frame
+    return out
+
 def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, multithreaded=True):
   frame_type = fingerprint_video(fn)
   if frame_type == FrameType.raw:
@@ -553,7 +563,7 @@ def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, multit
   elif frame_type in (FrameType.h265_stream, FrameType.h264_pstream):
     index_data = get_video_index(fn, frame_type, cache_prefix)
     if index_data is not None and "predecom" in index_data:
-      cache_path = cache_path_for_file_path(fn, cache_prefix)
+      cache_path = index_cache_path(fn, cache_prefix)
       return MKVFrameReader(
         os.path.join(os.path.dirname(cache_path), index_data["predecom"]))
     else:
@@ -588,9 +598,9 @@ def rgb24toyuv420(rgb):
 
 class RawData(object):
   def __init__(self, f):
-    self.f = _io.FileIO(f, 'rb')
+    self.f = io.FileIO(f, 'rb')
     self.lenn = struct.unpack("I", self.f.read(4))[0]
-    self.count = os.path.getsize(f) / (self.lenn+4)
+    self.count = os.path.getsize(f) // (self.lenn+4)
 
   def read(self, i):
     self.f.seek((self.lenn+4)*i + 4)
@@ -613,11 +623,11 @@ class RawFrameReader(BaseFrameReader):
     return cimg
 
 
-  def get(self, num, count=1, pix_fmt="yuv420p"):
+  def get(self, num, count=1, pix_fmt="yuv420p", out=None):
     assert self.frame_count is not None
     assert num+count <= self.frame_count
 
-    if pix_fmt not in ("yuv420p", "rgb24"):
+    if pix_fmt not in ("yuv420p", "rgb24", "bgr24"):
       raise ValueError("Unsupported pixel format %r" % pix_fmt)
 
     app = []
@@ -626,12 +636,14 @@ class RawFrameReader(BaseFrameReader):
       rgb_dat = self.load_and_debayer(dat)
       if pix_fmt == "rgb24":
         app.append(rgb_dat)
+      elif pix_fmt == "bgr24":
+        app.append(rgb_dat[..., ::-1])
       elif pix_fmt == "yuv420p":
         app.append(rgb24toyuv420(rgb_dat))
       else:
         raise NotImplementedError
 
-    return app
+    return self._copy_to_out(app, pix_fmt, out)
 
 def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt, multithreaded=False):
   # using a tempfile is much faster than proc.communicate for some reason
@@ -658,7 +670,7 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt, multithreaded=False):
     if proc.wait() != 0:
       raise DataUnreadableError("ffmpeg failed")
 
-  if pix_fmt == "rgb24":
+  if pix_fmt in ("rgb24", "bgr24"):
     ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
   elif pix_fmt == "yuv420p":
     ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
@@ -770,7 +782,7 @@ class MKVFrameReader(BaseFrameReader):
 
     self.frame_count = len(self.index)
 
-  def get(self, num, count=1, pix_fmt="yuv420p"):
+  def get(self, num, count=1, pix_fmt="yuv420p", out=None):
     assert 0 < num+count <= self.frame_count
 
     frame_dats = []
@@ -786,7 +798,7 @@ class MKVFrameReader(BaseFrameReader):
     r = decompress_video_data(of.getvalue(), "matroska", self.w, self.h, pix_fmt)
     assert len(r) == count
 
-    return r
+    return self._copy_to_out(r, pix_fmt, out)
 
 
 class GOPReader(object):
@@ -800,16 +812,73 @@ class DoNothingContextManager(object):
   def __exit__(*x): pass
 
 
+def frame_shape(w, h, pix_fmt):
+  if pix_fmt in ("rgb24", "bgr24"):
+    return (h, w, 3)
+  elif pix_fmt == "yuv420p":
+    return (h*w*3//2,)
+  elif pix_fmt == "yuv444p":
+    return (3, h, w)
+  else:
+    raise NotImplementedError
+
+
+def _check_out(out, shape):
+  if out.shape != shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+    raise ValueError("out must be a contiguous uint8 array of shape {}".format(shape))
+
+
+def _readinto_exact(f, arr):
+  buf = memoryview(arr).cast('B')
+  pos = 0
+  while pos < len(buf):
+    n = f.readinto(buf[pos:])
+    if not n:
+      raise DataUnreadableError("ffmpeg returned %d of %d bytes of a frame" % (pos, len(buf)))
+    pos += n
+
+
+class FrameCache(object):
+  """LRU of decoded frames bounded by their total size in bytes."""
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self._frames = OrderedDict()
+
+  def __contains__(self, key):
+    return key in self._frames
+
+  def get(self, key):
+    frame = self._frames.get(key)
+    if frame is not None:
+      self._frames.move_to_end(key)
+    return frame
+
+  def __setitem__(self, key, frame):
+    old = self._frames.pop(key, None)
+    if old is not None:
+      self.nbytes -= old.nbytes
+    self._frames[key] = frame
+    self.nbytes += frame.nbytes
+
+    while self.nbytes > self.max_bytes and len(self._frames) > 1:
+      _, evicted = self._frames.popitem(last=False)
+      self.nbytes -= evicted.nbytes
+
+
 class GOPFrameReader(BaseFrameReader):
   #FrameReader with caching and readahead for formats that are group-of-picture based
 
-  def __init__(self, readahead=False, readbehind=False, multithreaded=True):
+  # enough for about 64 full size rgb24 road camera frames
+  FRAME_CACHE_BYTES = 200 * 1024 * 1024
+
+  def __init__(self, readahead=False, readbehind=False, multithreaded=True, cache_bytes=FRAME_CACHE_BYTES):
     self.open_ = True
 
     self.multithreaded = multithreaded
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
+    self.frame_cache = FrameCache(cache_bytes)
 
     if self.readahead:
       self.cache_lock = threading.RLock()
@@ -848,44 +917,125 @@ class GOPFrameReader(BaseFrameReader):
       num, pix_fmt = self.readahead_last
 
       if self.readbehind:
-        for k in range(num-1, max(0, num-self.readahead_len), -1):
-          self._get_one(k, pix_fmt)
+        b, e = max(0, num-self.readahead_len), num
       else:
-        for k in range(num, min(self.frame_count, num+self.readahead_len)):
-          self._get_one(k, pix_fmt)
-
-  def _get_one(self, num, pix_fmt):
-    assert num < self.frame_count
-
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
+        b, e = num, min(self.frame_count, num+self.readahead_len)
+
+      uncached = [k for k in range(b, e) if (k, pix_fmt) not in self.frame_cache]
+      if len(uncached):
+        with self.cache_lock:
+          self._decode_range(uncached[0], uncached[-1] + 1, pix_fmt)
+
+  def _decode_range(self, num_b, num_e, pix_fmt, out=None, cache_requested=None):
+    """Decodes frames [num_b, num_e) with one ffmpeg process for all GOPs involved.
+
+    Requested frames are written straight into out when it's given, and copies of
+    them are cached if cache_requested is set, so the caller can change out. Without
+    out they're decoded into frames of their own and cached. The remaining frames of
+    the first and last GOP are always cached.
+    """
+    gops = []
+    i = num_b
+    while i < num_e:
+      gop = self.get_gop(i)
+      gops.append(gop)
+      i = gop[0] + gop[1]
+
+    shape = frame_shape(self.w, self.h, pix_fmt)
+    if cache_requested is None:
+      cache_requested = out is None
+    if cache_requested and out is not None:
+      # only the last requested frames stay in the cache, don't copy the others
+      cache_from = num_e - self.frame_cache.max_bytes // max(1, int(np.prod(shape)))
+    else:
+      cache_from = num_b
 
-    with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+    proc = subprocess.Popen(
+      ["ffmpeg",
+       "-threads", "0" if self.multithreaded else "1",
+       "-vsync", "0",
+       "-f", self.vid_fmt,
+       "-flags2", "showall",
+       "-i", "pipe:0",
+       "-threads", "0" if self.multithreaded else "1",
+       "-f", "rawvideo",
+       "-pix_fmt", pix_fmt,
+       "pipe:1"],
+      stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=open("/dev/null", "wb"))
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+    def write_thread():
+      try:
+        for _, _, _, rawdat in gops:
+          proc.stdin.write(rawdat)
+      except BrokenPipeError:
+        pass
+      finally:
+        proc.stdin.close()
 
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt,
-                                  multithreaded=self.multithreaded)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
+    t = threading.Thread(target=write_thread)
+    t.daemon = True
+    t.start()
 
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+    try:
+      skip_buf = np.empty(shape, dtype=np.uint8)
+      for frame_b, num_frames, skip_frames, _ in gops:
+        for _ in range(skip_frames):
+          _readinto_exact(proc.stdout, skip_buf)
+
+        for k in range(frame_b, frame_b + num_frames):
+          if num_b <= k < num_e and out is not None:
+            frame = out[k - num_b]
+            _readinto_exact(proc.stdout, frame)
+            if cache_requested and k >= cache_from:
+              self.frame_cache[(k, pix_fmt)] = frame.copy()
+          else:
+            frame = np.empty(shape, dtype=np.uint8)
+            _readinto_exact(proc.stdout, frame)
+            self.frame_cache[(k, pix_fmt)] = frame
+
+      if proc.stdout.read(1):
+        raise DataUnreadableError("ffmpeg returned more frames than the GOPs contain")
+    finally:
+      proc.stdout.close()
+      t.join()
+      ret = proc.wait()
+
+    if ret != 0:
+      raise DataUnreadableError("ffmpeg failed")
 
-      return self.frame_cache[(num, pix_fmt)]
+  def get(self, num, count=1, pix_fmt="yuv420p", out=None):
+    """Returns frames [num, num+count) as one contiguous array of shape (count, *frame_shape).
 
-  def get(self, num, count=1, pix_fmt="yuv420p"):
+    Pass out (an array or np.memmap of that shape) to decode straight into it.
+    Frames decoded into out aren't cached, copies of the ones of a returned array are.
+    """
     assert self.frame_count is not None
 
     if num + count > self.frame_count:
       raise ValueError("{} > {}".format(num + count, self.frame_count))
 
-    if pix_fmt not in ("yuv420p", "rgb24", "yuv444p"):
+    if pix_fmt not in ("yuv420p", "rgb24", "bgr24", "yuv444p"):
       raise ValueError("Unsupported pixel format %r" % pix_fmt)
 
-    ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
+    shape = (count,) + frame_shape(self.w, self.h, pix_fmt)
+    cache_requested = out is None
+    if out is None:
+      out = np.empty(shape, dtype=np.uint8)
+    else:
+      _check_out(out, shape)
+
+    with self.cache_lock:
+      missing = []
+      for i in range(count):
+        frame = self.frame_cache.get((num + i, pix_fmt))
+        if frame is None:
+          missing.append(i)
+        else:
+          out[i] = frame
+
+      if len(missing):
+        b, e = missing[0], missing[-1] + 1
+        self._decode_range(num + b, num + e, pix_fmt, out[b:e], cache_requested)
 
     if self.readahead:
       self.readahead_last = (num+count, pix_fmt)
@@ -893,7 +1043,7 @@ class GOPFrameReader(BaseFrameReader):
       self.readahead_c.notify()
       self.readahead_c.release()
 
-    return ret
+    return out
 
 class MP4GOPReader(GOPReader):
   def __init__(self, fn):
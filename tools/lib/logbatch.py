@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Map/reduce over the logs of many routes.
+
+map_fn gets the LogReader of one segment and returns something picklable. The
+per-segment results are merged with reduce_fn in segment order. Results are
+cached by segment and by a hash of map_fn's code (plus an optional version), so
+rerunning a query only processes new segments.
+
+  def count_can_errors(lr):
+    return sum(m.which() == "can" and not m.valid for m in lr)
+
+  total, failed = run_batch(log_paths_for_routes(routes), count_can_errors, operator.add, 0)
+"""
+import os
+import sys
+import pickle
+import hashlib
+import inspect
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tools.lib.cache import DEFAULT_CACHE_DIR
+from tools.lib.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.logreader import LogReader
+from tools.lib.route import Route, LOG_FILENAMES
+
+BATCH_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "batch")
+
+
+def log_paths_for_routes(routes, data_dir=None):
+  log_paths = []
+  for route in routes:
+    log_paths += [p for p in Route(route, data_dir).log_paths() if p is not None]
+  return log_paths
+
+
+def log_paths_in_dir(data_dir):
+  """Finds every log below data_dir, sorted so segments of a route stay in order."""
+  log_paths = []
+  for root, _, files in os.walk(data_dir):
+    # op segment dirs have plain rlog.bz2s, explorer downloads are named <segment>--rlog.bz2
+    log_paths += [os.path.join(root, f) for f in files if f.split("--")[-1] in LOG_FILENAMES]
+  return sorted(log_paths)
+
+
+def function_hash(fn, version=None):
+  try:
+    code = inspect.getsource(fn).encode()
+  except (OSError, TypeError):
+    code = fn.__code__.co_code
+  h = hashlib.sha256(code)
+  h.update(("%s.%s:%s" % (fn.__module__, fn.__qualname__, version)).encode())
+  return h.hexdigest()[:16]
+
+
+def segment_hash(log_path):
+  """Identifies a log by name, plus size and mtime for local files."""
+  key = log_path
+  if os.path.exists(log_path):
+    st = os.stat(log_path)
+    key = "%s:%d:%d" % (os.path.abspath(log_path), st.st_size, st.st_mtime_ns)
+  return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _run_segment(map_fn, log_path, cache_path):
+  if cache_path is not None and os.path.exists(cache_path):
+    with open(cache_path, "rb") as f:
+      return pickle.load(f)
+
+  result = map_fn(LogReader(log_path, streaming=True, cache=False))
+
+  if cache_path is not None:
+    with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as f:
+      pickle.dump(result, f, -1)
+  return result
+
+
+def run_batch(log_paths, map_fn, reduce_fn=None, initial=None, workers=None, version=None, use_cache=True):
+  """Runs map_fn on every log on a process pool and merges the results.
+
+  Without reduce_fn the result is the list of per-segment results. Segments that
+  raise are reported and skipped, the second return value lists their paths.
+  map_fn and reduce_fn need to be picklable, so define them at module level.
+  """
+  cache_dir = None
+  if use_cache:
+    cache_dir = os.path.join(BATCH_CACHE_DIR, function_hash(map_fn, version))
+    mkdirs_exists_ok(cache_dir)
+
+  results = [None] * len(log_paths)
+  failed = set()
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = {}
+    for i, log_path in enumerate(log_paths):
+      cache_path = os.path.join(cache_dir, segment_hash(log_path)) if cache_dir is not None else None
+      futures[pool.submit(_run_segment, map_fn, log_path, cache_path)] = i
+
+    for future in as_completed(futures):
+      i = futures[future]
+      try:
+        results[i] = future.result()
+      except Exception:
+        print("failed processing %s" % log_paths[i], file=sys.stderr)
+        traceback.print_exc()
+        failed.add(i)
+
+  results = [r for i, r in enumerate(results) if i not in failed]
+  failed = [log_paths[i] for i in sorted(failed)]
+  if reduce_fn is None:
+    return results, failed
+
+  acc = initial
+  for r in results:
+    acc = reduce_fn(acc, r)
+  return acc, failed
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Bulk extraction of log fields into NumPy arrays.
+
+Fields are selected with "service.field.path" strings, e.g. "carState.vEgo" or
+"radarState.leadOne.dRel". Every segment is read in a single pass on a process
+pool, and the columns of each (segment, service) are cached on disk, so asking
+for the same fields again only loads the cached arrays.
+
+  cols = get_columns(Route(name).log_paths(), ["carState.vEgo", "controlsState.angleSteers"])
+  cols["carState.vEgo"], cols["carState.logMonoTime"]
+"""
+import os
+import sys
+import argparse
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from tools.lib.cache import cache_path_for_file_path
+from tools.lib.file_helpers import atomic_write_in_dir
+from tools.lib.logreader import LogReader
+from tools.lib.route import Route
+
+# bump when the cached column layout changes
+COLUMNS_CACHE_VERSION = 1
+
+TIME_FIELD = "logMonoTime"
+# the stat key of the log the columns come from, stored with them
+SOURCE_KEY = "__source__"
+
+
+def parse_selectors(selectors):
+  """Groups "service.field.path" selectors into {service: [field.path, ...]}."""
+  fields = defaultdict(list)
+  for selector in selectors:
+    service, _, path = selector.partition(".")
+    if not service or not path:
+      raise ValueError("selector must look like service.field.path: %r" % selector)
+    # a service with only its logMonoTime selected still gets that column
+    paths = fields[service]
+    if path != TIME_FIELD and path not in paths:
+      paths.append(path)
+  return fields
+
+
+def _column_cache_path(log_path, service):
+  return cache_path_for_file_path(log_path, extension=".cols%d.%s.npz" % (COLUMNS_CACHE_VERSION, service))
+
+
+def _source_key(log_path):
+  """inode, size and mtime of a local log, so columns of a replaced log aren't used. Empty for urls"""
+  try:
+    st = os.stat(log_path)
+  except (OSError, ValueError):
+    return np.array([], dtype=np.int64)
+  return np.array([st.st_ino, st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def _load_cached(log_path, service, source_key):
+  cache_path = _column_cache_path(log_path, service)
+  if not os.path.exists(cache_path):
+    return {}
+
+  with np.load(cache_path, allow_pickle=False) as cached:
+    if SOURCE_KEY not in cached.files or not np.array_equal(cached[SOURCE_KEY], source_key):
+      return {}
+    return {k: cached[k] for k in cached.files if k != SOURCE_KEY}
+
+
+def _field_getter(path):
+  names = path.split(".")
+
+  def get(msg):
+    for name in names:
+      msg = getattr(msg, name)
+    return msg
+  return get
+
+
+def _to_array(values):
+  arr = np.asarray(values)
+  if arr.dtype == object:
+    # enums come back as strings, anything else isn't a column
+    arr = np.asarray([str(v) for v in values])
+  return arr
+
+
+def extract_segment(log_path, fields):
+  """Reads {service: [field.path, ...]} from one log, using and filling the cache."""
+  out = {}
+  missing = {}
+  source_key = _source_key(log_path)
+  for service, paths in fields.items():
+    cached = _load_cached(log_path, service, source_key)
+    if all(p in cached for p in [TIME_FIELD] + paths):
+      out[service] = cached
+    else:
+      # extract what was cached before too, the cache file gets rewritten
+      missing[service] = paths + [p for p in cached if p != TIME_FIELD and p not in paths]
+
+  if len(missing):
+    getters = {s: [(p, _field_getter(p)) for p in paths] for s, paths in missing.items()}
+    values = {s: defaultdict(list) for s in missing}
+    for msg in LogReader(log_path, streaming=True):
+      service = msg.which()
+      if service not in getters:
+        continue
+
+      sub = getattr(msg, service)
+      service_values = values[service]
+      service_values[TIME_FIELD].append(msg.logMonoTime)
+      for path, get in getters[service]:
+        service_values[path].append(get(sub))
+
+    for service, paths in missing.items():
+      cols = {TIME_FIELD: np.asarray(values[service][TIME_FIELD], dtype=np.uint64)}
+      for path in paths:
+        cols[path] = _to_array(values[service][path])
+      out[service] = cols
+
+      with atomic_write_in_dir(_column_cache_path(log_path, service), mode="wb", overwrite=True) as f:
+        np.savez(f, **cols, **{SOURCE_KEY: source_key})
+
+  return out
+
+
+def get_columns(log_paths, selectors, workers=None):
+  """Returns {selector: array} for every selector over all logs in log_paths.
+
+  Each service also gets a "<service>.logMonoTime" column with the time of
+  every sample. Missing segments (None entries) are skipped.
+  """
+  fields = parse_selectors(selectors)
+  log_paths = [p for p in log_paths if p is not None]
+
+  if workers == 1 or len(log_paths) <= 1:
+    segments = [extract_segment(p, fields) for p in log_paths]
+  else:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      segments = list(pool.map(extract_segment, log_paths, [fields]*len(log_paths)))
+
+  columns = {}
+  for service, paths in fields.items():
+    for path in [TIME_FIELD] + paths:
+      parts = [seg[service][path] for seg in segments if len(seg[service][path])]
+      columns["%s.%s" % (service, path)] = np.concatenate(parts) if len(parts) else np.array([])
+  return columns
+
+
+def align_columns(columns, selectors, t):
+  """Samples each selector at the logMonoTimes in t, holding the last value.
+
+  Samples before the first message of a service take its first value.
+  """
+  out = {}
+  for selector in selectors:
+    service = selector.split(".", 1)[0]
+    times = columns["%s.%s" % (service, TIME_FIELD)]
+    idx = np.clip(np.searchsorted(times, t, side="right") - 1, 0, max(len(times) - 1, 0))
+    out[selector] = columns[selector][idx]
+  return out
+
+
+def get_route_columns(route_name, selectors, data_dir=None, workers=None):
+  return get_columns(Route(route_name, data_dir).log_paths(), selectors, workers)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Export log fields of a route to an npz file")
+  parser.add_argument("route")
+  parser.add_argument("selectors", nargs="+", help="service.field.path, e.g. carState.vEgo")
+  parser.add_argument("--data_dir", default=None)
+  parser.add_argument("--workers", type=int, default=None)
+  parser.add_argument("--out", default="columns.npz")
+  args = parser.parse_args()
+
+  cols = get_route_columns(args.route, args.selectors, args.data_dir, args.workers)
+  np.savez(args.out, **cols)
+  print("saved %d columns to %s" % (len(cols), args.out), file=sys.stderr)
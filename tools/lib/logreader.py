@@ -1,17 +1,19 @@
 #!/usr/bin/env python3
 import os
 import sys
-import json
 import bz2
-import tempfile
-import requests
-import subprocess
+import mmap
+import bisect
+import struct
 import urllib.parse
-from aenum import Enum
+from io import BytesIO
 import capnp
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
+from tools.lib.cache import cache_path_for_file_path
 from tools.lib.exceptions import DataUnreadableError
+from tools.lib.file_helpers import atomic_write_in_dir
 try:
   from xx.chffr.lib.filereader import FileReader
 except ImportError:
@@ -20,52 +22,177 @@ from cereal import log as capnp_log
 
 OP_PATH = os.path.dirname(os.path.dirname(capnp_log.__file__))
 
-def index_log(fn):
-  index_log_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "index_log")
-  index_log = os.path.join(index_log_dir, "index_log")
-  phonelibs_dir = os.path.join(OP_PATH, 'phonelibs')
+# compressed bytes read per step when streaming a log
+READ_CHUNK_SIZE = 1024 * 1024
 
-  subprocess.check_call(["make", "PHONELIBS=" + phonelibs_dir], cwd=index_log_dir, stdout=subprocess.DEVNULL)
+# capnp refuses messages with more segments than this, anything bigger is garbage
+MAX_SEGMENTS = 512
+
+# bump whenever the layout of the on-disk index changes
+LOG_INDEX_VERSION = 1
+LOG_INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4'), ('mono_time', '<u8')])
+
+
+def message_spans(dat, pos=0):
+  """Yields (start, end) of every complete capnp message in dat after pos.
+
+  Only the segment table is parsed, so this is cheap enough to run on a stream.
+  A truncated message at the end of dat is left alone.
+  """
+  n = len(dat)
+  while n - pos >= 8:
+    n_segs = struct.unpack_from("<I", dat, pos)[0] + 1
+    if n_segs > MAX_SEGMENTS:
+      raise DataUnreadableError("capnp segment table is corrupted at offset %d" % pos)
+
+    hdr_len = (4 + 4*n_segs + 7) & ~7
+    if n - pos < hdr_len:
+      return
+
+    end = pos + hdr_len + 8*sum(struct.unpack_from("<%dI" % n_segs, dat, pos + 4))
+    if end > n:
+      return
+
+    yield pos, end
+    pos = end
+
+
+def event_mono_time(dat, start, end):
+  """Reads Event.logMonoTime of the message at dat[start:end] without decoding it."""
+  n_segs = struct.unpack_from("<I", dat, start)[0] + 1
+  seg0 = start + ((4 + 4*n_segs + 7) & ~7)
+
+  ptr = struct.unpack_from("<Q", dat, seg0)[0]
+  if ptr & 3 == 0:
+    # plain struct pointer: logMonoTime is the first word of the data section
+    offset = (ptr & 0xffffffff) >> 2
+    if offset & (1 << 29):
+      offset -= 1 << 30
+    if (ptr >> 32) & 0xffff == 0:
+      return 0
+    return struct.unpack_from("<Q", dat, seg0 + 8 + 8*offset)[0]
+
+  # far pointer, let capnp resolve it
+  return capnp_log.Event.from_bytes(bytes(dat[start:end])).logMonoTime
+
+
+def decompressed_chunks(f, ext, chunk_size=READ_CHUNK_SIZE):
+  decompressor = bz2.BZ2Decompressor() if ext == ".bz2" else None
+  while True:
+    dat = f.read(chunk_size)
+    if not dat:
+      break
+
+    if decompressor is None:
+      yield dat
+      continue
+
+    while dat:
+      yield decompressor.decompress(dat)
+      # concatenated bz2 streams
+      dat = decompressor.unused_data if decompressor.eof else b""
+      if decompressor.eof:
+        decompressor = bz2.BZ2Decompressor()
 
-  try:
-    dat = subprocess.check_output([index_log, fn, "-"])
-  except subprocess.CalledProcessError:
-    raise DataUnreadableError("%s capnp is corrupted/truncated" % fn)
-  return np.frombuffer(dat, dtype=np.uint64)
 
 def event_read_multiple_bytes(dat):
-  with tempfile.NamedTemporaryFile() as dat_f:
-    dat_f.write(dat)
-    dat_f.flush()
-    idx = index_log(dat_f.name)
+  return [capnp_log.Event.from_bytes(dat[s:e]) for s, e in message_spans(dat)]
 
-  end_idx = np.uint64(len(dat))
-  idx = np.append(idx, end_idx)
 
-  return [capnp_log.Event.from_bytes(dat[idx[i]:idx[i+1]])
-          for i in range(len(idx)-1)]
+class LazyEventList(object):
+  """Read-only sequence of Events backed by a decompressed log and its index."""
+  def __init__(self, dat, index):
+    self._dat = dat
+    self._index = index
+
+  def __len__(self):
+    return len(self._index)
+
+  def __getitem__(self, i):
+    ent = self._index[i]
+    offset = int(ent['offset'])
+    return capnp_log.Event.from_bytes(self._dat[offset:offset + int(ent['length'])])
+
+  def __iter__(self):
+    for i in range(len(self._index)):
+      yield self[i]
+
+
+def _open_indexed_log(log_path):
+  lr = LogReader(log_path, streaming=True)
+  lr._build_index()
+  return lr
 
 
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator(object):
-  def __init__(self, log_paths, wraparound=True):
+  """Iterates the events of a route's logs in order.
+
+  Logs are opened in streaming mode, and the next `prefetch` logs after the
+  cursor are decompressed and indexed on a thread pool so playback doesn't stall
+  at segment boundaries. Only the current log and the prefetch window are kept
+  open.
+  """
+  def __init__(self, log_paths, wraparound=True, prefetch=2):
     self._log_paths = log_paths
     self._wraparound = wraparound
+    self._available_logs = [i for i in range(len(log_paths)) if log_paths[i] is not None]
 
-    self._first_log_idx = next(i for i in range(len(log_paths)) if log_paths[i] is not None)
+    self._first_log_idx = self._available_logs[0]
     self._current_log = self._first_log_idx
     self._idx = 0
     self._log_readers = [None]*len(log_paths)
-    self.start_time = self._log_reader(self._first_log_idx)._ts[0]
+
+    self._prefetch = prefetch
+    self._prefetch_pool = ThreadPoolExecutor(max_workers=prefetch) if prefetch > 0 else None
+    self._prefetch_futures = {}
+
+    self.start_time = int(self._log_reader(self._first_log_idx)._ts[0])
+    self._update_prefetch()
 
   def _log_reader(self, i):
     if self._log_readers[i] is None and self._log_paths[i] is not None:
       log_path = self._log_paths[i]
-      print("LogReader:%s" % log_path)
-      self._log_readers[i] = LogReader(log_path)
+      lr = None
+      future = self._prefetch_futures.pop(i, None)
+      if future is not None:
+        try:
+          lr = future.result()
+        except Exception:
+          # loaded again below so the error surfaces here
+          pass
+
+      if lr is None:
+        print("LogReader:%s" % log_path)
+        lr = _open_indexed_log(log_path)
+      self._log_readers[i] = lr
 
     return self._log_readers[i]
 
+  def _update_prefetch(self):
+    pos = self._available_logs.index(self._current_log)
+    window = self._available_logs[pos:pos + self._prefetch + 1]
+    if self._wraparound:
+      window += self._available_logs[:max(0, pos + self._prefetch + 1 - len(self._available_logs))]
+
+    # drop logs outside of the window to bound memory use
+    for i, lr in enumerate(self._log_readers):
+      if lr is not None and i not in window:
+        self._log_readers[i] = None
+    for i in list(self._prefetch_futures):
+      if i not in window:
+        self._prefetch_futures.pop(i).cancel()
+
+    if self._prefetch_pool is not None:
+      for i in window:
+        if self._log_readers[i] is None and i not in self._prefetch_futures:
+          self._prefetch_futures[i] = self._prefetch_pool.submit(_open_indexed_log, self._log_paths[i])
+
+  def close(self):
+    if self._prefetch_pool is not None:
+      self._prefetch_pool.shutdown(wait=False)
+      self._prefetch_pool = None
+
   def __iter__(self):
     return self
 
@@ -82,6 +209,7 @@ class MultiLogIterator(object):
           self._current_log = self._first_log_idx
         else:
           raise StopIteration
+      self._update_prefetch()
 
   def __next__(self):
     while 1:
@@ -92,46 +220,208 @@ class MultiLogIterator(object):
 
   def tell(self):
     # returns seconds from start of log
-    return (self._log_reader(self._current_log)._ts[self._idx] - self.start_time) * 1e-9
+    return (int(self._log_reader(self._current_log)._ts[self._idx]) - self.start_time) * 1e-9
 
   def seek(self, ts):
-    # seek to nearest minute
-    minute = int(ts/60)
-    if minute >= len(self._log_paths) or self._log_paths[minute] is None:
+    if ts < 0:
       return False
+    target = self.start_time + int(ts * 1e9)
 
-    self._current_log = minute
+    # segments are about a minute long, start there and correct with the real start times
+    pos = max(bisect.bisect_right(self._available_logs, int(ts/60)) - 1, 0)
+    while pos > 0 and self._log_reader(self._available_logs[pos])._ts[0] > target:
+      pos -= 1
+    while pos < len(self._available_logs) - 1 and self._log_reader(self._available_logs[pos + 1])._ts[0] <= target:
+      pos += 1
 
-    # HACK: O(n) seek afterward
-    self._idx = 0
-    while self.tell() < ts:
-      self._inc()
+    lr = self._log_reader(self._available_logs[pos])
+    ts_arr = np.asarray(lr._ts)
+    if lr._ts_sorted:
+      idx = int(np.searchsorted(ts_arr, target))
+    else:
+      # logMonoTime isn't always in file order, take the first message at or after target like a scan does
+      later = np.flatnonzero(ts_arr >= target)
+      idx = int(later[0]) if len(later) else len(ts_arr)
+    if idx == len(ts_arr):
+      if pos == len(self._available_logs) - 1:
+        return False
+      pos, idx = pos + 1, 0
+
+    self._current_log = self._available_logs[pos]
+    self._idx = idx
+    self._update_prefetch()
     return True
 
 
 class LogReader(object):
-  def __init__(self, fn, canonicalize=True, only_union_types=False):
+  """Reads the Events of one log file.
+
+  By default every event is decoded up front. With streaming=True events are
+  decoded one at a time while the file is decompressed, and the decompressed log
+  plus an offset/logMonoTime index are saved next to the other cached files, so
+  reopening the same log only costs an mmap. Pass cache=False to stream without
+  reading or writing the cached files.
+  """
+  def __init__(self, fn, canonicalize=True, only_union_types=False, streaming=False, cache=True):
     data_version = None
     _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-    with FileReader(fn) as f:
-      dat = f.read()
-
-    if ext == "":
-      # old rlogs weren't bz2 compressed
-      ents = event_read_multiple_bytes(dat)
-    elif ext == ".bz2":
-      dat = bz2.decompress(dat)
-      ents = event_read_multiple_bytes(dat)
-    else:
+    if ext not in ("", ".bz2"):
       raise Exception(f"unknown extension {ext}")
 
-    self._ts = [x.logMonoTime for x in ents]
+    self._fn = fn
+    self._ext = ext
+    self._streaming = streaming
+    self._cache = cache
     self.data_version = data_version
     self._only_union_types = only_union_types
-    self._ents = ents
+
+    self._dat = None
+    self._index = None
+    self._ts_is_sorted = None
+    if not streaming:
+      # the events are read from these bytes in place, keeping them costs nothing
+      self._raw_list = list(self._read_messages())
+      ents = [capnp_log.Event.from_bytes(dat) for dat in self._raw_list]
+      self._ts_list = [x.logMonoTime for x in ents]
+      self._ents_list = ents
+    elif cache:
+      self._load_cache()
+
+  @property
+  def _cache_paths(self):
+    data_path = cache_path_for_file_path(self._fn, extension=".log")
+    index_path = cache_path_for_file_path(self._fn, extension=".logidx%d" % LOG_INDEX_VERSION)
+    return data_path, index_path
+
+  def _load_cache(self):
+    data_path, index_path = self._cache_paths
+    if not os.path.exists(index_path) or not os.path.exists(data_path):
+      return False
+
+    # local logs that changed after they were indexed need a new index
+    if os.path.exists(self._fn) and os.path.getmtime(self._fn) > os.path.getmtime(index_path):
+      return False
+
+    try:
+      index = np.load(index_path, mmap_mode='r')
+    except ValueError:
+      # empty arrays can't be mapped
+      index = np.load(index_path)
+
+    size = os.path.getsize(data_path)
+    if len(index) and int(index[-1]['offset']) + int(index[-1]['length']) > size:
+      return False
+
+    if size == 0:
+      self._dat = b""
+    else:
+      with open(data_path, "rb") as f:
+        self._dat = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self._index = index
+    return True
+
+  def _read_messages(self, data_f=None, entries=None):
+    """Yields the raw bytes of each message while decompressing the log.
+
+    If data_f is given the decompressed log is copied into it, and if entries
+    is given the index row of every message is appended to it.
+    """
+    base = 0
+    buf = bytearray()
+    with FileReader(self._fn) as f:
+      for chunk in decompressed_chunks(f, self._ext):
+        if data_f is not None:
+          data_f.write(chunk)
+
+        buf += chunk
+        pos = 0
+        for start, end in message_spans(buf):
+          if entries is not None:
+            entries.append((base + start, end - start, event_mono_time(buf, start, end)))
+          yield bytes(buf[start:end])
+          pos = end
+
+        del buf[:pos]
+        base += pos
+
+  def _stream_and_index(self):
+    entries = []
+    if not self._cache:
+      data_f = BytesIO()
+      yield from self._read_messages(data_f, entries)
+      self._dat = data_f.getvalue()
+      self._index = np.array(entries, dtype=LOG_INDEX_DTYPE)
+      return
+
+    data_path, index_path = self._cache_paths
+    with atomic_write_in_dir(data_path, mode="wb", overwrite=True) as data_f:
+      yield from self._read_messages(data_f, entries)
+
+    with atomic_write_in_dir(index_path, mode="wb", overwrite=True) as index_f:
+      np.save(index_f, np.array(entries, dtype=LOG_INDEX_DTYPE))
+
+    if not self._load_cache():
+      raise DataUnreadableError("failed to index %s" % self._fn)
+
+  def _build_index(self):
+    if self._index is None:
+      for _ in self._stream_and_index():
+        pass
+
+  @property
+  def _ts(self):
+    if not self._streaming:
+      return self._ts_list
+    self._build_index()
+    return self._index['mono_time']
+
+  @property
+  def _ts_sorted(self):
+    """Whether logMonoTime never goes back in file order"""
+    if self._ts_is_sorted is None:
+      ts = np.asarray(self._ts)
+      self._ts_is_sorted = bool(np.all(ts[1:] >= ts[:-1]))
+    return self._ts_is_sorted
+
+  @property
+  def _ents(self):
+    if not self._streaming:
+      return self._ents_list
+    self._build_index()
+    return LazyEventList(self._dat, self._index)
+
+  def _events(self):
+    if not self._streaming:
+      return iter(self._ents_list)
+    elif self._index is not None:
+      return iter(LazyEventList(self._dat, self._index))
+    elif not self._cache:
+      return (capnp_log.Event.from_bytes(dat) for dat in self._read_messages())
+    else:
+      return (capnp_log.Event.from_bytes(dat) for dat in self._stream_and_index())
+
+  def iter_raw(self, sort_by_time=False):
+    """Yields (Event, raw bytes of the event) from the index, optionally in logMonoTime order.
+
+    The bytes come straight from the decompressed log, so passing an event on
+    doesn't need as_builder().to_bytes().
+    """
+    if not self._streaming:
+      order = sorted(range(len(self._ents_list)), key=self._ts_list.__getitem__) if sort_by_time else range(len(self._ents_list))
+      for i in order:
+        yield self._ents_list[i], self._raw_list[i]
+      return
+
+    self._build_index()
+    order = np.argsort(self._index['mono_time'], kind='stable') if sort_by_time else range(len(self._index))
+    for i in order:
+      ent = self._index[i]
+      offset = int(ent['offset'])
+      dat = self._dat[offset:offset + int(ent['length'])]
+      yield capnp_log.Event.from_bytes(dat), dat
 
   def __iter__(self):
-    for ent in self._ents:
+    for ent in self._events():
       if self._only_union_types:
         try:
           ent.which()
@@ -143,6 +433,6 @@ class LogReader(object):
 
 if __name__ == "__main__":
   log_path = sys.argv[1]
-  lr = LogReader(log_path)
+  lr = LogReader(log_path, streaming=True)
   for msg in lr:
     print(msg)
@@ -1,4 +1,6 @@
 """RouteFrameReader indexes and reads frames across routes, by frameId or segment indices."""
+import threading
+
 from tools.lib.framereader import FrameReader
 
 class _FrameReaderDict(dict):
@@ -13,12 +15,17 @@ class _FrameReaderDict(dict):
     self._camera_paths = camera_paths
     self._cache_paths = cache_paths
     self._framereader_kwargs = framereader_kwargs
+    # threads reading frames of the same new segment get one reader
+    self._lock = threading.Lock()
 
   def __missing__(self, key):
     if key < len(self._camera_paths) and self._camera_paths[key] is not None:
-      frame_reader = FrameReader(self._camera_paths[key],
-                                 self._cache_paths.get(key), **self._framereader_kwargs)
-      self[key] = frame_reader
+      with self._lock:
+        frame_reader = self.get(key)
+        if frame_reader is None:
+          frame_reader = FrameReader(self._camera_paths[key],
+                                     self._cache_paths.get(key), **self._framereader_kwargs)
+          self[key] = frame_reader
       return frame_reader
     else:
       raise KeyError("Segment index out of bounds: {}".format(key))
@@ -77,7 +84,7 @@ class RouteFrameReader(object):
 
 
   def close(self):
-    frs = self._frame_readers
+    frs = list(self._frame_readers.values())
     self._frame_readers.clear()
     for fr in frs:
       fr.close()
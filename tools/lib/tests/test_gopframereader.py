@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import io
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+from tools.lib.framereader import GOPFrameReader, frame_shape
+
+GOP_LEN = 4
+
+
+class FakeGOPFrameReader(GOPFrameReader):
+  """GOPs of GOP_LEN frames, every pixel of frame k is k"""
+  def __init__(self, frame_count):
+    super().__init__()
+    self.w, self.h = 8, 4
+    self.frame_count = frame_count
+    self.vid_fmt = "hevc"
+
+  def get_gop(self, num):
+    frame_b = num - num % GOP_LEN
+    return frame_b, min(GOP_LEN, self.frame_count - frame_b), 0, frame_b.to_bytes(4, "little")
+
+
+class FakeFFmpeg():
+  """Popen of an ffmpeg that decodes the GOPs of FakeGOPFrameReader"""
+  def __init__(self, reader, pix_fmt):
+    self.calls = 0
+    self.reader = reader
+    self.pix_fmt = pix_fmt
+
+  def __call__(self, args, stdin, stdout, stderr):
+    self.calls += 1
+    proc = mock.MagicMock()
+    proc.stdin = FakeStdin()
+    proc.stdout = FakeStdout(lambda: self.decode(proc.stdin.written), proc.stdin.closed)
+    proc.wait.return_value = 0
+    return proc
+
+  def decode(self, gops):
+    shape = frame_shape(self.reader.w, self.reader.h, self.pix_fmt)
+    out = b""
+    for gop in gops:
+      frame_b = int.from_bytes(gop, "little")
+      for k in range(frame_b, min(frame_b + GOP_LEN, self.reader.frame_count)):
+        out += np.full(shape, k, dtype=np.uint8).tobytes()
+    return io.BytesIO(out)
+
+
+class FakeStdin():
+  def __init__(self):
+    self.written = []
+    self.closed = threading.Event()
+
+  def write(self, dat):
+    self.written.append(dat)
+
+  def close(self):
+    self.closed.set()
+
+
+class FakeStdout():
+  """Decodes once the writer thread closed stdin"""
+  def __init__(self, decode, stdin_closed):
+    self.decode = decode
+    self.stdin_closed = stdin_closed
+    self.f = None
+
+  def _file(self):
+    if self.f is None:
+      self.stdin_closed.wait()
+      self.f = self.decode()
+    return self.f
+
+  def readinto(self, buf):
+    return self._file().readinto(buf)
+
+  def read(self, n):
+    return self._file().read(n)
+
+  def close(self):
+    pass
+
+
+class TestGOPFrameReader(unittest.TestCase):
+  def setUp(self):
+    self.fr = FakeGOPFrameReader(12)
+    self.ffmpeg = FakeFFmpeg(self.fr, "rgb24")
+    patcher = mock.patch("tools.lib.framereader.subprocess.Popen", self.ffmpeg)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def check(self, frames, num):
+    for i, frame in enumerate(frames):
+      self.assertTrue((frame == num + i).all())
+
+  def test_repeated_get_is_cached(self):
+    self.check(self.fr.get(5, 2, pix_fmt="rgb24"), 5)
+    self.assertEqual(self.ffmpeg.calls, 1)
+    # the requested frames and the rest of their GOP come from the cache
+    self.check(self.fr.get(5, 2, pix_fmt="rgb24"), 5)
+    self.check(self.fr.get(4, 4, pix_fmt="rgb24"), 4)
+    self.assertEqual(self.ffmpeg.calls, 1)
+
+  def test_get_into_out(self):
+    out = np.empty((2,) + frame_shape(self.fr.w, self.fr.h, "rgb24"), dtype=np.uint8)
+    self.assertIs(self.fr.get(9, 2, pix_fmt="rgb24", out=out), out)
+    self.check(out, 9)
+    # frames decoded into out aren't cached, the other frames of the GOP are
+    self.fr.get(8, 1, pix_fmt="rgb24")
+    self.assertEqual(self.ffmpeg.calls, 1)
+    self.fr.get(9, 1, pix_fmt="rgb24")
+    self.assertEqual(self.ffmpeg.calls, 2)
+
+  def test_changing_returned_frames(self):
+    frames = self.fr.get(5, 2, pix_fmt="rgb24")
+    frames[:] = 0
+    self.check(self.fr.get(5, 2, pix_fmt="rgb24"), 5)
+    self.assertEqual(self.ffmpeg.calls, 1)
+
+  def test_cache_bound(self):
+    frame_bytes = int(np.prod(frame_shape(self.fr.w, self.fr.h, "rgb24")))
+    self.fr.frame_cache.max_bytes = 3 * frame_bytes
+    frames = self.fr.get(0, 12, pix_fmt="rgb24")
+    # the cached frames don't keep the returned array alive
+    self.assertLessEqual(self.fr.frame_cache.nbytes, 3 * frame_bytes)
+    self.assertTrue(all(f.base is not frames for f in self.fr.frame_cache._frames.values()))
+    self.check(self.fr.get(9, 3, pix_fmt="rgb24"), 9)
+    self.assertEqual(self.ffmpeg.calls, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
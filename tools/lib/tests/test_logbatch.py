@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import operator
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cereal import log as capnp_log
+from tools.lib import logbatch
+from tools.lib.logbatch import run_batch
+from tools.lib.logreader import LogReader
+
+
+def write_log(fn, mono_times):
+  with open(fn, "wb") as f:
+    for t in mono_times:
+      f.write(capnp_log.Event.new_message(logMonoTime=t).to_bytes())
+
+
+def mono_times(lr):
+  return [m.logMonoTime for m in lr]
+
+
+class TestLogBatch(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.log_paths = []
+    for i in range(3):
+      fn = os.path.join(self.tmp.name, "%d_rlog" % i)
+      write_log(fn, range(i * 100, i * 100 + 50, 5))
+      self.log_paths.append(fn)
+    self.cache_dir = mock.patch.object(logbatch, "BATCH_CACHE_DIR", os.path.join(self.tmp.name, "batch"))
+    self.cache_dir.start()
+
+  def tearDown(self):
+    self.cache_dir.stop()
+    self.tmp.cleanup()
+
+  def test_matches_logreader(self):
+    expected = [mono_times(LogReader(fn)) for fn in self.log_paths]
+    # the second run reads the cached results
+    for _ in range(2):
+      results, failed = run_batch(self.log_paths, mono_times, workers=2)
+      self.assertEqual(results, expected)
+      self.assertEqual(failed, [])
+
+    total, failed = run_batch(self.log_paths, mono_times, operator.add, [], workers=2, use_cache=False)
+    self.assertEqual(total, sum(expected, []))
+
+  def test_failed_segments(self):
+    missing = os.path.join(self.tmp.name, "missing_rlog")
+    results, failed = run_batch(self.log_paths[:1] + [missing], mono_times, workers=2, use_cache=False)
+    self.assertEqual(results, [mono_times(LogReader(self.log_paths[0]))])
+    self.assertEqual(failed, [missing])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import tempfile
+import unittest
+
+import numpy as np
+from cereal import log as capnp_log
+from tools.lib.logcolumns import parse_selectors, get_columns, extract_segment
+from tools.lib.logreader import LogReader
+
+
+def write_log(fn, n, t0=0):
+  with open(fn, "wb") as f:
+    for i in range(n):
+      t = t0 + i * 10
+      msg = capnp_log.Event.new_message(logMonoTime=t)
+      if i % 2:
+        msg.init("radarState")
+        msg.radarState.leadOne.dRel = i * 1.5
+        msg.radarState.cumLagMs = float(i)
+      else:
+        msg.init("pathPlan")
+        msg.pathPlan.angleSteers = -float(i)
+      f.write(msg.to_bytes())
+
+
+class TestParseSelectors(unittest.TestCase):
+  def test_groups_by_service(self):
+    fields = parse_selectors(["radarState.leadOne.dRel", "pathPlan.angleSteers", "radarState.cumLagMs",
+                              "radarState.leadOne.dRel"])
+    self.assertEqual(dict(fields), {"radarState": ["leadOne.dRel", "cumLagMs"], "pathPlan": ["angleSteers"]})
+
+  def test_time_only(self):
+    fields = parse_selectors(["radarState.logMonoTime"])
+    self.assertEqual(dict(fields), {"radarState": []})
+
+  def test_invalid(self):
+    for selector in ["radarState", ".vEgo", ""]:
+      with self.assertRaises(ValueError):
+        parse_selectors([selector])
+
+
+class TestGetColumns(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.log_paths = ["%s/%d_rlog" % (self.tmp.name, i) for i in range(2)]
+    for i, fn in enumerate(self.log_paths):
+      write_log(fn, 20, t0=i * 1000)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def expected(self, service, get):
+    msgs = [m for fn in self.log_paths for m in LogReader(fn) if m.which() == service]
+    return [m.logMonoTime for m in msgs], [get(getattr(m, service)) for m in msgs]
+
+  def check(self, cols):
+    t, d_rel = self.expected("radarState", lambda m: m.leadOne.dRel)
+    np.testing.assert_array_equal(cols["radarState.logMonoTime"], t)
+    np.testing.assert_allclose(cols["radarState.leadOne.dRel"], d_rel)
+    t, angle = self.expected("pathPlan", lambda m: m.angleSteers)
+    np.testing.assert_array_equal(cols["pathPlan.logMonoTime"], t)
+    np.testing.assert_allclose(cols["pathPlan.angleSteers"], angle)
+
+  def test_matches_logreader(self):
+    selectors = ["radarState.leadOne.dRel", "pathPlan.angleSteers"]
+    # the second time the columns come from the cache
+    for _ in range(2):
+      self.check(get_columns(self.log_paths, selectors, workers=1))
+
+  def test_time_only(self):
+    cols = get_columns(self.log_paths, ["radarState.logMonoTime"], workers=1)
+    t, _ = self.expected("radarState", lambda m: None)
+    np.testing.assert_array_equal(cols["radarState.logMonoTime"], t)
+
+  def test_cache_extended(self):
+    extract_segment(self.log_paths[0], parse_selectors(["radarState.cumLagMs"]))
+    cols = extract_segment(self.log_paths[0], parse_selectors(["radarState.leadOne.dRel"]))["radarState"]
+    # the column cached before is kept
+    self.assertIn("cumLagMs", cols)
+    self.assertIn("leadOne.dRel", cols)
+
+  def test_replaced_log(self):
+    fields = parse_selectors(["radarState.cumLagMs"])
+    extract_segment(self.log_paths[0], fields)
+    write_log(self.log_paths[0], 6)
+    # the columns of the old log aren't used
+    cols = extract_segment(self.log_paths[0], fields)["radarState"]
+    np.testing.assert_array_equal(cols["cumLagMs"], [1., 3., 5.])
+    self.assertNotIn("__source__", cols)
+
+
+if __name__ == "__main__":
+  unittest.main()
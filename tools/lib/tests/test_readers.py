@@ -5,8 +5,16 @@ import tempfile
 
 from collections import defaultdict
 import numpy as np
-from tools.lib.framereader import FrameReader
-from tools.lib.logreader import LogReader
+from unittest import mock
+from cereal import log as capnp_log
+from tools.lib.framereader import FrameReader, RawFrameReader
+from tools.lib.logreader import LogReader, MultiLogIterator
+
+
+def write_log(fn, mono_times):
+  with open(fn, "wb") as f:
+    for t in mono_times:
+      f.write(capnp_log.Event.new_message(logMonoTime=t).to_bytes())
 
 class TestReaders(unittest.TestCase):
   def test_logreader(self):
@@ -30,6 +38,83 @@ class TestReaders(unittest.TestCase):
     lr_url = LogReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/raw_log.bz2?raw=true")
     _check_data(lr_url)
 
+  def test_logreader_streaming(self):
+    with tempfile.NamedTemporaryFile(suffix=".bz2") as fp:
+      r = requests.get("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/raw_log.bz2?raw=true")
+      fp.write(r.content)
+      fp.flush()
+
+      lr = LogReader(fp.name)
+      expected = [(m.logMonoTime, m.which()) for m in lr]
+
+      # first pass decompresses and indexes, second pass reads the cached index
+      for _ in range(2):
+        lr_stream = LogReader(fp.name, streaming=True)
+        self.assertEqual([(m.logMonoTime, m.which()) for m in lr_stream], expected)
+        self.assertEqual(list(lr_stream._ts), lr._ts)
+        self.assertEqual(lr_stream._ents[100].logMonoTime, expected[100][0])
+
+  def test_logreader_streaming_no_cache(self):
+    with tempfile.TemporaryDirectory() as d:
+      fn = d + "/rlog"
+      write_log(fn, [0, 10, 20])
+      LogReader(fn, streaming=True)._build_index()
+
+      # the cached files written above are neither read nor written again
+      with mock.patch.object(LogReader, "_load_cache", side_effect=AssertionError), \
+           mock.patch("tools.lib.logreader.atomic_write_in_dir", side_effect=AssertionError):
+        lr = LogReader(fn, streaming=True, cache=False)
+        # and the log isn't decoded up front
+        self.assertIsNone(lr._index)
+        self.assertFalse(hasattr(lr, "_ents_list"))
+        self.assertEqual([m.logMonoTime for m in lr], [0, 10, 20])
+        self.assertEqual(list(lr._ts), [0, 10, 20])
+
+  def test_logreader_iter_raw(self):
+    with tempfile.TemporaryDirectory() as d:
+      fn = d + "/rlog"
+      write_log(fn, [0, 20, 10])
+      with open(fn, "rb") as f:
+        dat = f.read()
+
+      for streaming in [False, True]:
+        lr = LogReader(fn, streaming=streaming, cache=False)
+        self.assertEqual(b"".join(raw for _, raw in lr.iter_raw()), dat)
+        events = list(lr.iter_raw(sort_by_time=True))
+        self.assertEqual([m.logMonoTime for m, _ in events], [0, 10, 20])
+        self.assertEqual([capnp_log.Event.from_bytes(raw).logMonoTime for _, raw in events], [0, 10, 20])
+
+  def test_multilogiterator_seek_unsorted(self):
+    # logMonoTime goes back in file order, like when a service publishes late
+    unsorted = [0, 10, 20, 15, 30, 25, 40]
+    with tempfile.TemporaryDirectory() as d:
+      for name, mono_times in [("unsorted", unsorted), ("sorted", sorted(unsorted))]:
+        fn = "%s/%s_rlog" % (d, name)
+        write_log(fn, mono_times)
+        mli = MultiLogIterator([fn], wraparound=False, prefetch=0)
+        for target in [0, 12, 16, 26, 30]:
+          self.assertTrue(mli.seek(target * 1e-9))
+          # the first message at or after target in file order, like the old linear seek
+          expected = next(t for t in mono_times if t >= target)
+          self.assertEqual(next(mli).logMonoTime, expected)
+        self.assertFalse(mli.seek(41 * 1e-9))
+
+  def test_rawframereader_out(self):
+    with tempfile.TemporaryDirectory() as d:
+      fn = d + "/video.raw"
+      frames = np.random.RandomState(0).randint(0, 256, (2, 960 * 1280), dtype=np.uint8)
+      with open(fn, "wb") as f:
+        for frame in frames:
+          f.write(np.uint32(frame.nbytes).tobytes() + frame.tobytes())
+
+      fr = RawFrameReader(fn)
+      rgb = fr.get(1, pix_fmt="rgb24")[0]
+      out = np.zeros((1, 480, 640, 3), dtype=np.uint8)
+      self.assertIs(fr.get(1, pix_fmt="bgr24", out=out), out)
+      np.testing.assert_array_equal(out[0], rgb[..., ::-1])
+      with self.assertRaises(ValueError):
+        fr.get(1, pix_fmt="bgr24", out=np.zeros((1, 480, 640), dtype=np.uint8))
+
   def test_framereader(self):
     def _check_data(f):
       self.assertEqual(f.frame_count, 1200)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tools.lib.route_framereader import RouteFrameReader
+
+
+class SlowFrameReader():
+  """Takes a while to open, like indexing a segment"""
+  def __init__(self, fn, cache_prefix=None, **kwargs):
+    time.sleep(0.05)
+    self.fn = fn
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+
+class TestRouteFrameReader(unittest.TestCase):
+  def test_one_reader_per_segment(self):
+    with mock.patch("tools.lib.route_framereader.FrameReader", SlowFrameReader):
+      fr = RouteFrameReader(["0.hevc", "1.hevc"], None, {})
+      readers = []
+      threads = [threading.Thread(target=lambda: readers.append(fr._frame_readers[1])) for _ in range(4)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+
+    self.assertEqual(len({id(r) for r in readers}), 1)
+    fr.close()
+    self.assertTrue(readers[0].closed)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tools.lib import framereader
+from tools.lib.framereader import FrameType, cache_fn, index_cache_path, index_videos
+from tools.lib.video_index import VIDEO_INDEX_MAGIC, VIDEO_INDEX_VERSION, load_video_index, save_video_index
+
+
+class TestVideoIndex(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, "index")
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_round_trip(self):
+    index = np.arange(30, dtype=np.uint32).reshape(-1, 2)
+    offsets = np.array([1.5, -2.25, 3.], dtype=np.float64)
+    save_video_index(self.path, {
+      'index': index,
+      'offsets': offsets,
+      'empty': np.zeros((0, 2), dtype=np.int64),
+      'global_prefix': b"\x00\x00\x01prefix",
+      'config_record': b"",
+      'probe': {'streams': [{'width': 1164, 'height': 874, 'r_frame_rate': "20/1"}]},
+      'frame_count': np.int64(15),
+      'size': (1164, 874),
+    })
+    loaded = load_video_index(self.path)
+
+    for k, arr in [('index', index), ('offsets', offsets)]:
+      self.assertIsInstance(loaded[k], np.memmap)
+      self.assertEqual(loaded[k].dtype, arr.dtype)
+      self.assertEqual(loaded[k].shape, arr.shape)
+      np.testing.assert_array_equal(loaded[k], arr)
+    self.assertEqual(loaded['empty'].dtype, np.int64)
+    self.assertEqual(loaded['empty'].shape, (0, 2))
+
+    self.assertEqual(loaded['global_prefix'], b"\x00\x00\x01prefix")
+    self.assertEqual(loaded['config_record'], b"")
+    self.assertEqual(loaded['probe'], {'streams': [{'width': 1164, 'height': 874, 'r_frame_rate': "20/1"}]})
+    self.assertEqual(loaded['frame_count'], 15)
+    # values go through JSON, tuples come back as lists
+    self.assertEqual(loaded['size'], [1164, 874])
+
+  def test_other_format(self):
+    self.assertIsNone(load_video_index(self.path))
+
+    save_video_index(self.path, {'index': np.arange(4)})
+    with open(self.path, "rb") as f:
+      dat = f.read()
+    header_len = struct.unpack_from("<I", dat, 12)[0]
+
+    for preamble in [struct.pack("<8sII", b"NOTANIDX", VIDEO_INDEX_VERSION, header_len),
+                     struct.pack("<8sII", VIDEO_INDEX_MAGIC, VIDEO_INDEX_VERSION + 1, header_len),
+                     b"OPV"]:
+      with open(self.path, "wb") as f:
+        f.write(preamble + (dat[16:] if len(preamble) == 16 else b""))
+      self.assertIsNone(load_video_index(self.path))
+
+
+class TestIndexCache(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.fns = [os.path.join(self.tmp.name, "%d_fcamera.hevc" % i) for i in range(3)]
+
+  def tearDown(self):
+    for fn in self.fns:
+      if os.path.exists(index_cache_path(fn)):
+        os.remove(index_cache_path(fn))
+    self.tmp.cleanup()
+
+  def test_cache_fn(self):
+    calls = []
+
+    @cache_fn
+    def index(fn):
+      calls.append(fn)
+      return {'index': np.arange(3)}
+
+    for _ in range(2):
+      np.testing.assert_array_equal(index(self.fns[0])['index'], np.arange(3))
+    self.assertEqual(calls, [self.fns[0]])
+
+  def test_index_videos_skips_indexed(self):
+    # the index file is the completion marker, an interrupted run only indexes the rest
+    save_video_index(index_cache_path(self.fns[1]), {'index': np.arange(3)})
+    with mock.patch.object(framereader, "fingerprint_video", return_value=FrameType.h265_stream), \
+         mock.patch.object(framereader, "index_video") as index_video:
+      index_videos(self.fns, workers=2)
+    self.assertEqual(sorted(c.args[0] for c in index_video.call_args_list), [self.fns[0], self.fns[2]])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,102 @@
+"""On-disk format for video indexes.
+
+Indexes are dicts of numpy arrays, bytes and JSON-able values. Arrays are
+stored raw and 8 byte aligned so loading them is an mmap, which also makes the
+files safe to share between processes. Layout:
+
+  magic (8 bytes) | version (u32) | header length (u32) | JSON header | padding | data
+
+The header maps every key to either its JSON value or the offset, dtype and
+shape of its data.
+"""
+import json
+import struct
+import numpy as np
+
+from tools.lib.file_helpers import atomic_write_in_dir
+
+VIDEO_INDEX_MAGIC = b"OPVIDIDX"
+# bump whenever the layout or the contents of the indexes change
+VIDEO_INDEX_VERSION = 1
+VIDEO_INDEX_EXTENSION = ".vidx%d" % VIDEO_INDEX_VERSION
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(n):
+  return (n + 7) & ~7
+
+
+def _json_default(o):
+  if isinstance(o, np.integer):
+    return int(o)
+  if isinstance(o, np.floating):
+    return float(o)
+  if isinstance(o, np.ndarray):
+    return o.tolist()
+  raise TypeError("can't store %r in a video index" % type(o))
+
+
+def save_video_index(path, index_data):
+  fields = {}
+  blobs = []
+  data_len = 0
+  for k, v in index_data.items():
+    if isinstance(v, np.ndarray):
+      blob = np.ascontiguousarray(v).tobytes()
+      fields[k] = {'array': [data_len, v.dtype.str, list(v.shape)]}
+    elif isinstance(v, (bytes, bytearray)):
+      blob = bytes(v)
+      fields[k] = {'bytes': [data_len, len(blob)]}
+    else:
+      fields[k] = {'value': v}
+      continue
+
+    blobs.append(blob + b"\x00" * (_align(len(blob)) - len(blob)))
+    data_len += len(blobs[-1])
+
+  header = json.dumps(fields, default=_json_default).encode()
+  data_offset = _align(_PREAMBLE.size + len(header))
+
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    f.write(_PREAMBLE.pack(VIDEO_INDEX_MAGIC, VIDEO_INDEX_VERSION, len(header)))
+    f.write(header)
+    f.write(b"\x00" * (data_offset - _PREAMBLE.size - len(header)))
+    for blob in blobs:
+      f.write(blob)
+
+
+def load_video_index(path):
+  """Returns the index stored at path, or None if it's missing or from another version."""
+  try:
+    f = open(path, "rb")
+  except FileNotFoundError:
+    return None
+
+  with f:
+    preamble = f.read(_PREAMBLE.size)
+    if len(preamble) != _PREAMBLE.size:
+      return None
+    magic, version, header_len = _PREAMBLE.unpack(preamble)
+    if magic != VIDEO_INDEX_MAGIC or version != VIDEO_INDEX_VERSION:
+      return None
+
+    fields = json.loads(f.read(header_len))
+    data_offset = _align(_PREAMBLE.size + header_len)
+
+    index_data = {}
+    for k, field in fields.items():
+      if 'value' in field:
+        index_data[k] = field['value']
+      elif 'bytes' in field:
+        offset, length = field['bytes']
+        f.seek(data_offset + offset)
+        index_data[k] = f.read(length)
+      else:
+        offset, dtype, shape = field['array']
+        if np.prod(shape) == 0:
+          index_data[k] = np.zeros(shape, dtype=dtype)
+        else:
+          index_data[k] = np.memmap(path, dtype=dtype, mode='r', offset=data_offset + offset, shape=tuple(shape))
+
+  return index_data
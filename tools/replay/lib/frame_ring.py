@@ -0,0 +1,148 @@
+"""Ring of decoded camera frames in shared memory.
+
+The unlogger decodes frames straight into a slot of the ring and only passes the
+sequence number of the slot around, instead of copying every image through its
+sockets. The ring is a file in /dev/shm, so other processes can open it by name
+and look frames up by frameId when the unlogger publishes frames without image.
+
+Slots are reused in order. The writer waits until a slot was released by the
+process that publishes its frame, and readers check the sequence number of a slot
+before and after copying it so they never return a frame that was overwritten.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_NAME = "unlogger_frames"
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+_MAGIC = 0x52465246
+# header: magic, slots, h, w, channels, sequence numbers released
+_HEADER_LEN = 8
+# per slot: 2 * seq + 1 while it's written, 2 * seq + 2 once it holds a frame, frameId
+_SLOT_LEN = 2
+_RELEASED = 5
+
+
+def ring_path(name):
+  return os.path.join(SHM_DIR, name)
+
+
+class FrameRing(object):
+  def __init__(self, path, mm):
+    self.path = path
+    self.inode = os.stat(path).st_ino
+    self._mm = mm
+
+    header = mm[:_HEADER_LEN * 8].view(np.int64)
+    if header[0] != _MAGIC:
+      raise ValueError("%s is not a frame ring" % path)
+    self._header = header
+    self.slots = int(header[1])
+    self.shape = (int(header[2]), int(header[3]), int(header[4]))
+
+    table_end = (_HEADER_LEN + self.slots * _SLOT_LEN) * 8
+    self._table = mm[_HEADER_LEN * 8:table_end].view(np.int64).reshape(self.slots, _SLOT_LEN)
+    self._images = mm[table_end:].reshape((self.slots,) + self.shape)
+    self._next_seq = 0
+
+  @classmethod
+  def create(cls, name, slots, shape):
+    """Makes a new ring at name, replacing the old one. Processes that have the
+    old one open keep it until they reopen."""
+    path = ring_path(name)
+    size = (_HEADER_LEN + slots * _SLOT_LEN) * 8 + slots * int(np.prod(shape))
+
+    # a new file, so readers of the old ring can tell by the inode
+    tmp_path = path + ".tmp"
+    mm = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=(size,))
+    header = mm[:_HEADER_LEN * 8].view(np.int64)
+    header[:5] = [_MAGIC, slots] + list(shape)
+    mm[_HEADER_LEN * 8:(_HEADER_LEN + slots * _SLOT_LEN) * 8].view(np.int64)[:] = -1
+    os.rename(tmp_path, path)
+    return cls(path, mm)
+
+  @classmethod
+  def open(cls, name):
+    path = ring_path(name)
+    return cls(path, np.memmap(path, dtype=np.uint8, mode="r+"))
+
+  def close(self, unlink=False):
+    self._header = self._table = self._images = self._mm = None
+    if unlink:
+      try:
+        os.unlink(self.path)
+      except FileNotFoundError:
+        pass
+
+  # *** writer ***
+
+  def reserve(self, timeout=None):
+    """Waits until the next slot is free, returns its sequence number or None on timeout"""
+    seq = self._next_seq
+    end = None if timeout is None else time.monotonic() + timeout
+    while seq - self._header[_RELEASED] >= self.slots:
+      if end is not None and time.monotonic() > end:
+        return None
+      time.sleep(0.001)
+
+    self._next_seq += 1
+    self._table[seq % self.slots] = (2 * seq + 1, -1)
+    return seq
+
+  def buffer(self, seq):
+    """The image of slot seq, to decode into"""
+    return self._images[seq % self.slots]
+
+  def commit(self, seq, frame_id):
+    row = self._table[seq % self.slots]
+    row[1] = frame_id
+    row[0] = 2 * seq + 2
+
+  # *** publisher ***
+
+  def image(self, seq):
+    """The image of slot seq, valid until it's released"""
+    return self._images[seq % self.slots]
+
+  def release(self, seq):
+    if seq + 1 > self._header[_RELEASED]:
+      self._header[_RELEASED] = seq + 1
+
+  # *** readers ***
+
+  def read(self, frame_id):
+    """Returns a copy of the image of frame_id, None when it's not in the ring"""
+    for slot in range(self.slots):
+      state, slot_frame_id = self._table[slot]
+      if slot_frame_id != frame_id or state < 0 or state % 2:
+        continue
+
+      img = np.array(self._images[slot])
+      if self._table[slot][0] == state:
+        return img
+    return None
+
+
+class FrameRingReader(object):
+  """Gets frames from the ring of a running unlogger, which is opened again when it's replaced"""
+  def __init__(self, name=DEFAULT_NAME):
+    self.name = name
+    self.ring = None
+
+  def get(self, frame_id):
+    """Returns the image bytes of frame_id or None"""
+    path = ring_path(self.name)
+    try:
+      if self.ring is None or os.stat(path).st_ino != self.ring.inode:
+        if self.ring is not None:
+          self.ring.close()
+        self.ring = FrameRing.open(self.name)
+    except (FileNotFoundError, ValueError):
+      self.ring = None
+      return None
+
+    img = self.ring.read(frame_id)
+    return None if img is None else img.tobytes()
@@ -16,20 +16,22 @@ else:
 
 from common.transformations.camera import FULL_FRAME_SIZE, eon_intrinsics
 
+from tools.replay.lib.frame_ring import FrameRingReader
 from tools.replay.lib.ui_helpers import CalibrationTransformsForWarpMatrix
 
 if __name__ == "__main__":
   sm = messaging.SubMaster(['liveCalibration'])
   frame = messaging.sub_sock('frame', conflate=True)
+  frame_ring = FrameRingReader()
   win = Window(MEDMODEL_INPUT_SIZE[0], MEDMODEL_INPUT_SIZE[1], double=True)
   calibration = None
 
   while 1:
     fpkt = messaging.recv_one(frame)
-    if len(fpkt.frame.image) == 0:
+    rgb_img_raw = fpkt.frame.image or frame_ring.get(fpkt.frame.frameId)
+    if not rgb_img_raw:
       continue
     sm.update(timeout=1)
-    rgb_img_raw = fpkt.frame.image
     imgff = np.frombuffer(rgb_img_raw, dtype=np.uint8).reshape((FULL_FRAME_SIZE[1], FULL_FRAME_SIZE[0], 3))
     imgff = imgff[:, :, ::-1] # Convert BGR to RGB
 
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import zmq
+
+import cereal.messaging as messaging
+from cereal import log as capnp_log
+from tools.replay.lib.frame_ring import FrameRing, FrameRingReader
+from tools.replay.unlogger import StopAndQuit, UnloggerWorker, _PendingFrame, unlogger_thread
+
+FRAME_SHAPE = (2, 4, 3)
+NUM_FRAMES = 12
+
+
+class TestUnloggerFrameHandles(unittest.TestCase):
+  def setUp(self):
+    prefix = "ipc:///tmp/test_unlogger_%d_" % os.getpid()
+    self.command_address, self.forward_address, self.data_address = [prefix + s for s in ("cmd", "fwd", "data")]
+    self.ring_name = "test_unlogger_frames_%d" % os.getpid()
+    self.ring = FrameRing.create(self.ring_name, 4, FRAME_SHAPE)
+
+    self.ctx = zmq.Context()
+    self.command_sock = self.ctx.socket(zmq.PUSH)
+    self.command_sock.connect(self.command_address)
+    self.forward_sock = self.ctx.socket(zmq.PULL)
+    self.forward_sock.connect(self.forward_address)
+
+  def tearDown(self):
+    self.ring.close(unlink=True)
+    self.ctx.destroy(linger=0)
+
+  def _decode_frames(self):
+    # what the worker does: decode into a slot as soon as one is free and pass the handle on
+    data_sock = self.ctx.socket(zmq.PUSH)
+    data_sock.connect(self.data_address)
+    for frame_id in range(NUM_FRAMES):
+      seq = self.ring.reserve(timeout=5)
+      self.ring.buffer(seq)[:] = frame_id
+      self.ring.commit(seq, frame_id)
+
+      msg = capnp_log.Event.new_message(logMonoTime=frame_id * 50000000)
+      msg.init("frame").frameId = frame_id
+      data_sock.send_pyobj((0, "frame", msg.logMonoTime, frame_id * 0.05, (self.ring.inode, seq, True)), flags=zmq.SNDMORE)
+      data_sock.send(msg.to_bytes())
+    data_sock.close()
+
+  def test_read_published_frames(self):
+    publisher = threading.Thread(target=unlogger_thread, args=(
+      self.command_address, self.forward_address, self.data_address, False, {"frame": "frame"}, None, True, False),
+      kwargs={"frame_ring_name": self.ring_name, "frame_handles": True})
+    publisher.start()
+    sock = messaging.sub_sock("frame", timeout=5000)
+    time.sleep(0.3)
+
+    decoder = threading.Thread(target=self._decode_frames)
+    decoder.start()
+    try:
+      reader = FrameRingReader(self.ring_name)
+      for frame_id in range(NUM_FRAMES):
+        msg = capnp_log.Event.from_bytes(sock.receive())
+        self.assertEqual(msg.frame.frameId, frame_id)
+        self.assertEqual(len(msg.frame.image), 0)
+
+        # the decoder is waiting for a slot, the one of a published frame is kept a while
+        img = reader.get(frame_id)
+        self.assertIsNotNone(img, "frame %d was released before it was read" % frame_id)
+        np.testing.assert_array_equal(np.frombuffer(img, dtype=np.uint8), frame_id)
+    finally:
+      decoder.join()
+      self.command_sock.send_pyobj(StopAndQuit())
+      publisher.join()
+
+
+class BlockingFrameReader(object):
+  """Fills the frame with its value once decoding is let through"""
+  def __init__(self, value):
+    self.value = value
+    self.go = threading.Event()
+
+  def get(self, frame_id, pix_fmt, out):
+    self.go.wait(5)
+    out[:] = self.value
+    return out
+
+
+class TestUnloggerWorkerRouteChange(unittest.TestCase):
+  def setUp(self):
+    self.ring_name = "test_unlogger_worker_%d" % os.getpid()
+    self.ring = FrameRing.create(self.ring_name, 4, FRAME_SHAPE)
+    self.worker = UnloggerWorker(self.ring_name)
+    self.worker._decode_pool = ThreadPoolExecutor(max_workers=1)
+
+  def tearDown(self):
+    self.worker._decode_pool.shutdown(wait=True)
+    self.ring.close(unlink=True)
+
+  def test_stop_decoding(self):
+    old_reader = BlockingFrameReader(1)
+    decoding = _PendingFrame(0, old_reader, self.ring)
+    queued = _PendingFrame(1, old_reader, self.ring)
+    undecoded = _PendingFrame(2, old_reader, self.ring)
+    self.worker._start_decode(decoding)
+    self.worker._start_decode(queued)
+    self.worker._undecoded_frames[undecoded.frame_id] = undecoded
+    self.worker._readahead.extend((None, None, 0., 0, f) for f in (undecoded, queued, decoding))
+
+    while not decoding.future.running():
+      time.sleep(0.001)
+    threading.Timer(0.1, old_reader.go.set).start()
+    self.worker._stop_decoding()
+
+    # the frame being decoded is done with the old reader, the others go out without image
+    self.assertTrue(decoding.future.result(timeout=0))
+    np.testing.assert_array_equal(self.ring.buffer(decoding.seq), 1)
+    self.assertFalse(queued.future.result(timeout=0))
+    self.assertFalse(undecoded.future.result(timeout=0))
+    self.assertEqual(self.worker._undecoded_frames, {})
+
+
+if __name__ == "__main__":
+  unittest.main()
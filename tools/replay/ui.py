@@ -17,6 +17,7 @@ from selfdrive.car.toyota.interface import CarInterface as ToyotaInterface
 from selfdrive.config import UIParams as UP
 from selfdrive.controls.lib.vehicle_model import VehicleModel
 import cereal.messaging as messaging
+from tools.replay.lib.frame_ring import FrameRingReader
 from tools.replay.lib.ui_helpers import (_BB_TO_FULL_FRAME, BLACK, BLUE, GREEN,
                                          YELLOW, RED,
                                          CalibrationTransformsForWarpMatrix,
@@ -67,6 +68,8 @@ def ui_thread(addr, frame_address):
   top_down_surface = pygame.surface.Surface((UP.lidar_x, UP.lidar_y),0,8)
 
   frame = messaging.sub_sock('frame', addr=addr, conflate=True)
+  # frames published by unlogger --frame-handles have their image in its frame ring
+  frame_ring = FrameRingReader()
   sm = messaging.SubMaster(['carState', 'plan', 'carControl', 'radarState', 'liveCalibration', 'controlsState', 'liveTracks', 'model', 'liveMpc', 'liveParameters', 'pathPlan'], addr=addr)
 
   calibration = None
@@ -121,7 +124,7 @@ def ui_thread(addr, frame_address):
 
     # ***** frame *****
     fpkt = messaging.recv_one(frame)
-    rgb_img_raw = fpkt.frame.image
+    rgb_img_raw = fpkt.frame.image or frame_ring.get(fpkt.frame.frameId)
 
     if fpkt.frame.transform:
       img_transform = np.array(fpkt.frame.transform).reshape(3,3)
@@ -12,6 +12,7 @@ from uuid import uuid4
 from collections import namedtuple
 from collections import deque
 from multiprocessing import Process, TimeoutError
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
 
 # strat 1: script to copy files
@@ -27,21 +28,54 @@ from tools.lib.kbhit import KBHit
 from tools.lib.logreader import MultiLogIterator
 from tools.lib.route import Route
 from tools.lib.route_framereader import RouteFrameReader
+from tools.replay.lib.frame_ring import DEFAULT_NAME as DEFAULT_FRAME_RING, FrameRing
 
 # Commands.
 SetRoute = namedtuple("SetRoute", ("name", "start_time", "data_dir"))
 SeekAbsoluteTime = namedtuple("SeekAbsoluteTime", ("secs",))
 SeekRelativeTime = namedtuple("SeekRelativeTime", ("secs",))
 TogglePause = namedtuple("TogglePause", ())
+SetSpeed = namedtuple("SetSpeed", ("speed",))
 StopAndQuit = namedtuple("StopAndQuit", ())
 
+# decoded frames that can be ahead of the ones published, plus the ones published in the
+# last FRAME_HANDLE_GRACE seconds. About 3 MB each
+FRAME_RING_SLOTS = 32
+# a GOPFrameReader decodes one range at a time, more threads would only wait on its lock
+FRAME_DECODE_WORKERS = 1
+FRAME_LAG = 0.05
+# how long subscribers of frames without image have to read a published frame from the ring
+FRAME_HANDLE_GRACE = 0.5
+
+
+class _PendingFrame(object):
+  """A frame in the readahead, being decoded by the frame reader of its route into its
+  slot of the frame ring"""
+  __slots__ = ("frame_id", "reader", "ring", "seq", "future")
+
+  def __init__(self, frame_id, reader, ring):
+    self.frame_id = frame_id
+    self.reader = reader
+    self.ring = ring
+    self.seq = ring.reserve()
+    self.future = None
+
 
 class UnloggerWorker(object):
-  def __init__(self):
+  def __init__(self, frame_ring_name=DEFAULT_FRAME_RING):
     self._frame_reader = None
+    self._lr = None
     self._cookie = None
     self._readahead = deque()
 
+    # frames are decoded ahead on a thread into the shared frame ring, only their
+    # slot goes to the publishing process
+    self._frame_ring_name = frame_ring_name
+    self._frame_ring = None
+    self._frames_ahead = 0
+    self._undecoded_frames = {}
+    self._decode_pool = None
+
   def run(self, commands_address, data_address, pub_types):
     zmq.Context._instance = None
     commands_socket = zmq.Context.instance().socket(zmq.PULL)
@@ -56,6 +90,7 @@ class UnloggerWorker(object):
     # We can't publish frames without encodeIdx, so add when it's missing.
     if "frame" in pub_types:
       pub_types["encodeIdx"] = None
+      self._decode_pool = ThreadPoolExecutor(max_workers=FRAME_DECODE_WORKERS)
 
     # gc.set_debug(gc.DEBUG_LEAK | gc.DEBUG_OBJECTS | gc.DEBUG_STATS | gc.DEBUG_SAVEALL |
     # gc.DEBUG_UNCOLLECTABLE)
@@ -74,15 +109,43 @@ class UnloggerWorker(object):
         self._read_logs(cookie, pub_types)
         self._send_logs(data_socket)
     finally:
+      if self._decode_pool is not None:
+        self._decode_pool.shutdown(wait=True)
       if self._frame_reader is not None:
         self._frame_reader.close()
+      if self._frame_ring is not None:
+        self._frame_ring.close(unlink=True)
       data_socket.close()
       commands_socket.close()
 
+  def _decode_frame(self, frame):
+    # BGR, which is what the camera outputs
+    out = frame.ring.buffer(frame.seq)[np.newaxis]
+    return frame.reader.get(frame.frame_id, pix_fmt="bgr24", out=out) is not None
+
+  def _start_decode(self, frame):
+    frame.future = self._decode_pool.submit(self._decode_frame, frame)
+
+  def _stop_decoding(self):
+    """Lets the decodes of the frames in the readahead finish. The frames that aren't
+    being decoded yet go out without image."""
+    running = []
+    for _, _, _, _, frame in self._readahead:
+      if frame is None:
+        continue
+      if frame.future is None or frame.future.cancel():
+        frame.future = Future()
+        frame.future.set_result(False)
+      else:
+        running.append(frame.future)
+    wait(running)
+    self._undecoded_frames = {}
+
   def _read_logs(self, cookie, pub_types):
     fullHEVC = capnp_log.EncodeIndex.Type.fullHEVC
     lr = self._lr
-    while len(self._readahead) < 1000:
+    # every frame in the readahead holds a slot of the ring
+    while len(self._readahead) < 1000 and (self._frame_ring is None or self._frames_ahead < self._frame_ring.slots):
       route_time = lr.tell()
       msg = next(lr)
       typ = msg.which()
@@ -90,44 +153,60 @@ class UnloggerWorker(object):
         continue
 
       # **** special case certain message types ****
+      frame = None
       if typ == "encodeIdx" and msg.encodeIdx.type == fullHEVC:
         # this assumes the encodeIdx always comes before the frame
         self._frame_id_lookup[
           msg.encodeIdx.frameId] = msg.encodeIdx.segmentNum, msg.encodeIdx.segmentId
         #print "encode", msg.encodeIdx.frameId, len(self._readahead), route_time
-      self._readahead.appendleft((typ, msg, route_time, cookie))
+        undecoded = self._undecoded_frames.pop(msg.encodeIdx.frameId, None)
+        if undecoded is not None:
+          self._start_decode(undecoded)
+      elif typ == "frame" and self._frame_ring is not None:
+        frame = _PendingFrame(msg.frame.frameId, self._frame_reader, self._frame_ring)
+        self._frames_ahead += 1
+        if frame.frame_id in self._frame_id_lookup:
+          self._start_decode(frame)
+        else:
+          self._undecoded_frames[frame.frame_id] = frame
+      self._readahead.appendleft((typ, msg, route_time, cookie, frame))
 
   def _send_logs(self, data_socket):
-    while len(self._readahead) > 500:
-      typ, msg, route_time, cookie = self._readahead.pop()
-      smsg = msg.as_builder()
+    while len(self._readahead) > 500 or (self._frame_ring is not None and self._frames_ahead >= self._frame_ring.slots):
+      typ, msg, route_time, cookie, frame = self._readahead.pop()
 
-      if typ == "frame":
-        frame_id = msg.frame.frameId
+      frame_handle = None
+      if frame is not None:
+        self._frames_ahead -= 1
+        if frame.future is None:
+          self._undecoded_frames.pop(frame.frame_id, None)
+          self._start_decode(frame)
 
-        # Frame exists, make sure we have a framereader.
-        # load the frame readers as needed
         s1 = time.time()
-        img = self._frame_reader.get(frame_id, pix_fmt="rgb24")
+        decoded = frame.future.result()
         fr_time = time.time() - s1
-        if fr_time > 0.05:
-          print("FRAME(%d) LAG -- %.2f ms" % (frame_id, fr_time*1000.0))
+        if fr_time > FRAME_LAG:
+          print("FRAME(%d) LAG -- %.2f ms" % (frame.frame_id, fr_time*1000.0))
 
-        if img is not None:
-          img = img[:, :, ::-1] # Convert RGB to BGR, which is what the camera outputs
-          img = img.flatten()
-          smsg.frame.image = img.tobytes()
+        if decoded:
+          frame.ring.commit(frame.seq, frame.frame_id)
+        # the publisher releases the slot, also when there's no image
+        frame_handle = (frame.ring.inode, frame.seq, decoded)
 
-      data_socket.send_pyobj((cookie, typ, msg.logMonoTime, route_time), flags=zmq.SNDMORE)
-      data_socket.send(smsg.to_bytes(), copy=False)
+      data_socket.send_pyobj((cookie, typ, msg.logMonoTime, route_time, frame_handle), flags=zmq.SNDMORE)
+      data_socket.send(msg.as_builder().to_bytes(), copy=False)
 
   def _process_commands(self, cmd, route, pub_types):
     seek_to = None
     if route is None or (isinstance(cmd, SetRoute) and route.name != cmd.name):
       seek_to = cmd.start_time
       route = Route(cmd.name, cmd.data_dir)
+      if self._lr is not None:
+        self._lr.close()
       self._lr = MultiLogIterator(route.log_paths(), wraparound=True)
       if self._frame_reader is not None:
+        # the frames of the old route in the readahead are done with its reader before it closes
+        self._stop_decoding()
         self._frame_reader.close()
       if "frame" in pub_types or "encodeIdx" in pub_types:
         # reset frames for a route
@@ -135,6 +214,12 @@ class UnloggerWorker(object):
         self._frame_reader = RouteFrameReader(
           route.camera_paths(), None, self._frame_id_lookup, readahead=True)
 
+      if self._decode_pool is not None:
+        # frames still in the readahead keep their slots, new ones go in a ring for this route
+        shape = (self._frame_reader.h, self._frame_reader.w, 3)
+        if self._frame_ring is None or self._frame_ring.shape != shape:
+          self._frame_ring = FrameRing.create(self._frame_ring_name, FRAME_RING_SLOTS, shape)
+
     # always reset this on a seek
     if isinstance(cmd, SeekRelativeTime):
       seek_to = self._lr.tell() + cmd.secs
@@ -156,8 +241,22 @@ def _get_address_send_func(address):
   return sock.send
 
 
+def _open_frame_ring(frame_ring, name, inode):
+  """Returns the frame ring the worker decodes into, None when it was replaced again"""
+  if frame_ring is not None and frame_ring.inode == inode:
+    return frame_ring
+  if frame_ring is not None:
+    frame_ring.close()
+  try:
+    frame_ring = FrameRing.open(name)
+  except FileNotFoundError:
+    return None
+  return frame_ring if frame_ring.inode == inode else None
+
+
 def unlogger_thread(command_address, forward_commands_address, data_address, run_realtime,
-                    address_mapping, publish_time_length, bind_early, no_loop):
+                    address_mapping, publish_time_length, bind_early, no_loop, speed=1.,
+                    frame_ring_name=DEFAULT_FRAME_RING, frame_handles=False):
   # Clear context to avoid problems with multiprocessing.
   zmq.Context._instance = None
   context = zmq.Context.instance()
@@ -195,8 +294,16 @@ def unlogger_thread(command_address, forward_commands_address, data_address, run
   paused = False
   reset_time = True
   prev_msg_time = None
+  frame_ring = None
+  frame_releases = deque()  # [time, seq] of the slots of frame_ring to release, in order
   while True:
-    evts = dict(poller.poll())
+    # the ring only keeps track of the highest slot released, so they go in order
+    now = time.monotonic()
+    while frame_releases and frame_releases[0][0] <= now:
+      frame_ring.release(frame_releases.popleft()[1])
+    poll_timeout = None if not frame_releases else max(frame_releases[0][0] - now, 0.) * 1000.
+
+    evts = dict(poller.poll(poll_timeout))
     if command_sock in evts:
       cmd = command_sock.recv_pyobj()
       if isinstance(cmd, TogglePause):
@@ -205,6 +312,9 @@ def unlogger_thread(command_address, forward_commands_address, data_address, run
           poller.modify(data_socket, 0)
         else:
           poller.modify(data_socket, zmq.POLLIN)
+      elif isinstance(cmd, SetSpeed):
+        speed = cmd.speed
+        print("playback speed %.2fx" % speed)
       else:
         # Forward the command the the log data thread.
         # TODO: Remove everything on data_socket.
@@ -215,8 +325,28 @@ def unlogger_thread(command_address, forward_commands_address, data_address, run
 
       reset_time = True
     elif data_socket in evts:
-      msg_generation, typ, msg_time, route_time = data_socket.recv_pyobj(flags=zmq.RCVMORE)
+      msg_generation, typ, msg_time, route_time, frame_handle = data_socket.recv_pyobj(flags=zmq.RCVMORE)
       msg_bytes = data_socket.recv()
+
+      # the worker decodes ahead into the frame ring. Images that go out with the message
+      # are copied here and the slot is released on the next iteration. Subscribers of
+      # frames without image look them up by frameId, so then the slot is kept for
+      # FRAME_HANDLE_GRACE after the frame is published.
+      frame_image = None
+      frame_release = None
+      if frame_handle is not None:
+        frame_inode, frame_seq, frame_has_image = frame_handle
+        ring = _open_frame_ring(frame_ring, frame_ring_name, frame_inode)
+        if ring is not frame_ring:
+          # the slots of a replaced ring don't need to be released
+          frame_releases.clear()
+          frame_ring = ring
+        if frame_ring is not None:
+          if frame_has_image and not frame_handles:
+            frame_image = frame_ring.image(frame_seq).tobytes()
+          frame_release = [time.monotonic(), frame_seq]
+          frame_releases.append(frame_release)
+
       if msg_generation < generation:
         # Skip packets.
         continue
@@ -260,7 +390,7 @@ def unlogger_thread(command_address, forward_commands_address, data_address, run
 
       # Sleep as needed for real time playback.
       if run_realtime:
-        msg_time_offset = msg_time_seconds - msg_start_time
+        msg_time_offset = (msg_time_seconds - msg_start_time) / speed
         real_time_offset = realtime.sec_since_boot() - real_start_time
         lag = msg_time_offset - real_time_offset
         if lag > 0 and lag < 30: # a large jump is OK, likely due to an out of order segment
@@ -271,11 +401,19 @@ def unlogger_thread(command_address, forward_commands_address, data_address, run
           # Relax the real time schedule when we slip far behind.
           reset_time = True
 
+      if frame_image is not None:
+        smsg = capnp_log.Event.from_bytes(msg_bytes).as_builder()
+        smsg.frame.image = frame_image
+        msg_bytes = smsg.to_bytes()
+
       # Send message.
       try:
         send_funcs[typ](msg_bytes)
       except MultiplePublishersError:
         del send_funcs[typ]
+      else:
+        if frame_release is not None and frame_handles:
+          frame_release[0] = time.monotonic() + FRAME_HANDLE_GRACE
 
 def timestamp_to_s(tss):
   return time.mktime(datetime.strptime(tss, '%Y-%m-%d--%H-%M-%S').timetuple())
@@ -311,11 +449,14 @@ def _get_address_mapping(args):
 
   return address_mapping
 
-def keyboard_controller_thread(q, route_start_time):
+def keyboard_controller_thread(q, route_start_time, speed=1.):
   print("keyboard waiting for input")
   kb = KBHit()
   while 1:
     c = kb.getch()
+    if c in '+-': # Double or halve the playback speed
+      speed = speed * 2. if c == '+' else speed / 2.
+      q.send_pyobj(SetSpeed(speed))
     if c=='m': # Move forward by 1m
       q.send_pyobj(SeekRelativeTime(60))
     elif c=='M': # Move backward by 1m
@@ -368,6 +509,18 @@ def get_arg_parser():
     "--no-realtime", dest="realtime", action="store_false", default=True,
     help="Publish messages as quickly as possible instead of realtime.")
 
+  parser.add_argument(
+    "--speed", type=float, default=1.,
+    help="Playback speed relative to realtime, + and - double or halve it while running.")
+
+  parser.add_argument(
+    "--frame-ring", default=DEFAULT_FRAME_RING,
+    help="Name of the shared memory ring in /dev/shm the frames are decoded into.")
+
+  parser.add_argument(
+    "--frame-handles", action="store_true", default=False,
+    help="Publish frames without image, subscribers read it from the frame ring by frameId.")
+
   parser.add_argument(
     "--no-interactive", dest="interactive", action="store_false", default=True,
     help="Disable interactivity.")
@@ -405,13 +558,14 @@ def main(argv):
   subprocesses = {}
   try:
     subprocesses["data"] = Process(
-      target=UnloggerWorker().run,
+      target=UnloggerWorker(args.frame_ring).run,
       args=(forward_commands_address, data_address, address_mapping.copy()))
 
     subprocesses["control"] = Process(
       target=unlogger_thread,
       args=(command_address, forward_commands_address, data_address, args.realtime,
-            _get_address_mapping(args), args.publish_time_length, args.bind_early, args.no_loop))
+            _get_address_mapping(args), args.publish_time_length, args.bind_early, args.no_loop,
+            args.speed, args.frame_ring, args.frame_handles))
 
     for p in subprocesses.values():
       p.daemon = True
@@ -429,7 +583,7 @@ def main(argv):
     signal.signal(signal.SIGCHLD, exit_if_children_dead)
 
     if args.interactive:
-      keyboard_controller_thread(command_sock, route_start_time)
+      keyboard_controller_thread(command_sock, route_start_time, args.speed)
     else:
       # Wait forever for children.
       while True: